@@ -1,8 +1,12 @@
 import os
 import re
+import functools
+import numpy as np
 import pandas as pd
 import unidecode
 from fuzzywuzzy import fuzz
+from rapidfuzz.distance import Indel
+from rapidfuzz.process import cdist
 import ast
 
 # Extracts text between <output> and </output>
@@ -39,7 +43,7 @@ def ensure_list(val):
             pass
     raise ValueError(f"Ground truth must be in list form. Got: {val}")
 
-# Calculate exact and fuzzy match scores
+# Calculate exact and fuzzy match scores of one row (reference for batch_match_scores)
 def calculate_match_scores(ents_list, pred_result):
     pred_norm = unidecode.unidecode(str(pred_result)).lower().strip()
     exact_match = 0
@@ -52,6 +56,55 @@ def calculate_match_scores(ents_list, pred_result):
         highest_fuzzy_score = max(highest_fuzzy_score, fuzzy_score)
     return exact_match, highest_fuzzy_score
 
+# Normalize a name or prediction for matching, once per unique string
+@functools.lru_cache(maxsize=1 << 20)
+def normalize_name(val):
+    return unidecode.unidecode(str(val)).lower().strip()
+
+# fuzz.ratio is the Indel similarity rounded to a whole percent when fuzzywuzzy runs on python-Levenshtein,
+# which rapidfuzz's cdist computes for a whole matrix at once. fuzzywuzzy's pure-Python difflib fallback
+# scores some pairs differently, so without python-Levenshtein each unique pair is scored by fuzz.ratio itself.
+LEVENSHTEIN_RATIO = fuzz.SequenceMatcher.__module__ != "difflib"
+
+# fuzz.ratio / 100 of every (entity, prediction) pair, given as ids into the unique normalized strings
+def fuzzy_pair_scores(strings, ent_ids, pred_ids):
+    if not LEVENSHTEIN_RATIO:
+        pairs, pair_index = np.unique(np.stack([ent_ids, pred_ids], axis=1), axis=0, return_inverse=True)
+        scores = np.array([fuzz.ratio(strings[ent], strings[pred]) / 100 for ent, pred in pairs], dtype=np.float64)
+        return scores[pair_index.reshape(-1)]
+    ent_vocab = np.unique(ent_ids)
+    pred_vocab = np.unique(pred_ids)
+    scores = cdist([strings[i] for i in ent_vocab], [strings[i] for i in pred_vocab],
+                   scorer=Indel.normalized_similarity, dtype=np.float64, workers=-1)
+    scores = np.rint(100 * scores) / 100
+    # No special case for empty strings: fuzz.ratio checks equality before emptiness, so it scores ("", "") 100
+    # and ("", x) 0, as Indel does
+    return scores[np.searchsorted(ent_vocab, ent_ids), np.searchsorted(pred_vocab, pred_ids)]
+
+# calculate_match_scores for every row at once. Entity variants and predictions are normalized once per
+# unique string, scored pairwise by fuzzy_pair_scores and reduced to each row's best in NumPy.
+def batch_match_scores(ents_lists, preds):
+    preds = [normalize_name(pred) for pred in preds]
+    ents = [normalize_name(ent) for row_ents in ents_lists for ent in row_ents]
+    counts = np.array([len(row_ents) for row_ents in ents_lists], dtype=np.int64)
+    ids, strings = pd.factorize(np.array(preds + ents, dtype=object))
+    pred_ids, ent_ids = ids[:len(preds)], ids[len(preds):]
+
+    exact_match = np.zeros(len(pred_ids), dtype=np.int64)
+    highest_fuzzy_score = np.zeros(len(pred_ids), dtype=np.float64)
+    if len(ent_ids) == 0:
+        return exact_match, highest_fuzzy_score
+
+    pair_preds = np.repeat(pred_ids, counts)
+    pair_scores = fuzzy_pair_scores(strings, ent_ids, pair_preds)
+    pair_exact = (ent_ids == pair_preds).astype(np.int64)
+
+    has_ents = counts > 0
+    starts = (np.cumsum(counts) - counts)[has_ents]
+    exact_match[has_ents] = np.maximum.reduceat(pair_exact, starts)
+    highest_fuzzy_score[has_ents] = np.maximum.reduceat(pair_scores, starts)
+    return exact_match, highest_fuzzy_score
+
 # Main evaluation function
 def evaluate_predictions(input_csv_path, output_csv_path):
     df = pd.read_csv(input_csv_path)
@@ -71,12 +124,11 @@ def evaluate_predictions(input_csv_path, output_csv_path):
     for lang in available_langs:
         result_col = f'{lang}_results'
         if result_col in df.columns:
-            df[f'{lang}_exact_match'], df[f'{lang}_highest_fuzzy_match'] = zip(*df.apply(
-                lambda row: calculate_match_scores(row['Single_ent'], row[result_col]), axis=1))
-            df[f'{lang}_correct'] = df.apply(
-                lambda row: 'correct' if (
-                    row[f'{lang}_exact_match'] == 1 or row[f'{lang}_highest_fuzzy_match'] >= 0.7
-                ) else 'incorrect', axis=1)
+            exact_match, highest_fuzzy_score = batch_match_scores(df['Single_ent'].tolist(), df[result_col].tolist())
+            df[f'{lang}_exact_match'] = exact_match
+            df[f'{lang}_highest_fuzzy_match'] = highest_fuzzy_score
+            df[f'{lang}_correct'] = np.where(
+                (exact_match == 1) | (highest_fuzzy_score >= 0.7), 'correct', 'incorrect')
 
     # Select columns for output
     output_cols = ['Single_ent']
@@ -103,11 +155,12 @@ def list_csv_files(folder_path, recursive=False):
     
     return csv_files
 
-files = list_csv_files("EMNLP_results/name_cloze/audio")
-files = [f.replace('.csv', '') for f in files]
+if __name__ == "__main__":
+    files = list_csv_files("EMNLP_results/name_cloze/audio")
+    files = [f.replace('.csv', '') for f in files]
 
-for f in files:
-    evaluate_predictions(
-        input_csv_path=f'EMNLP_results/name_cloze/audio/{f}.csv',
-        output_csv_path=f'scripts/Evaluation/nct/eval/audio/{f}_eval.csv'
-    )
+    for f in files:
+        evaluate_predictions(
+            input_csv_path=f'EMNLP_results/name_cloze/audio/{f}.csv',
+            output_csv_path=f'scripts/Evaluation/nct/eval/audio/{f}_eval.csv'
+        )
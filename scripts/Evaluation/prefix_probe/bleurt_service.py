@@ -0,0 +1,138 @@
+import os
+import hashlib
+import sqlite3
+
+# Config of evaluate's BLEURT metric, "default" is the BLEURT-base-128 checkpoint evaluate.load("bleurt") uses
+DEFAULT_CHECKPOINT = "default"
+
+# Score cache file name, kept in common.response_cache.CACHE_DIR by the evaluation CLIs
+CACHE_FILE_NAME = "bleurt_cache.sqlite"
+
+# Pairs scored per call to the model. A GPU runs a whole batch in parallel, on CPU smaller
+# batches keep the padded tensors in cache.
+CPU_BATCH_SIZE = 16
+GPU_BATCH_SIZE = 128
+
+
+def configure_cpu_threads(num_threads):
+    """
+    Sizes TensorFlow's thread pools, which BLEURT runs on. Must be called before TensorFlow runs anything.
+    """
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(min(2, num_threads))
+
+
+def has_gpu():
+    import tensorflow as tf
+    return bool(tf.config.list_physical_devices("GPU"))
+
+
+def length_buckets(pairs, batch_size):
+    """
+    Splits (prediction, reference) pairs into batches of similar length, so no batch is padded far
+    beyond its own longest pair. Returns lists of indices into pairs.
+    """
+    order = sorted(range(len(pairs)), key=lambda i: len(pairs[i][0]) + len(pairs[i][1]))
+    return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+
+class BleurtScoreCache:
+    """
+    Persistent (checkpoint, prediction, reference) -> score store in SQLite, shared by runs,
+    plots and the workers of run_eval.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS bleurt_scores (key TEXT PRIMARY KEY, score REAL NOT NULL)")
+        self.conn.commit()
+
+    def get_many(self, keys):
+        found = {}
+        unique_keys = list(set(keys))
+        for start in range(0, len(unique_keys), 500):
+            chunk = unique_keys[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT key, score FROM bleurt_scores WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            )
+            found.update(rows)
+        return found
+
+    def put_many(self, items):
+        self.conn.executemany("INSERT OR REPLACE INTO bleurt_scores (key, score) VALUES (?, ?)", items)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class BleurtService:
+    """
+    Scores (prediction, reference) pairs with BLEURT. Only pairs missing from the score cache are
+    sent to the model, once each, in length-bucketed batches of `batch_size` (by default sized for
+    the device TensorFlow finds). The model is loaded on first use, with `num_threads` CPU threads if given.
+    Without `cache_path` scores are not kept beyond the call.
+    """
+
+    def __init__(self, checkpoint=DEFAULT_CHECKPOINT, batch_size=None, num_threads=None, cache_path=None):
+        self.checkpoint = checkpoint
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+        self.cache = BleurtScoreCache(cache_path) if cache_path else None
+        self.hits = 0
+        self.misses = 0
+        self._score_batch = None
+
+    def load(self):
+        if self._score_batch is not None:
+            return
+        if self.num_threads:
+            configure_cpu_threads(self.num_threads)
+        import evaluate
+        metric = evaluate.load("bleurt", self.checkpoint)
+        scorer = getattr(metric, "scorer", None)
+        if scorer is not None:
+            self._score_batch = lambda predictions, references: scorer.score(
+                references=references, candidates=predictions, batch_size=len(predictions))
+        else:
+            self._score_batch = lambda predictions, references: metric.compute(
+                predictions=predictions, references=references)["scores"]
+        if self.batch_size is None:
+            self.batch_size = GPU_BATCH_SIZE if has_gpu() else CPU_BATCH_SIZE
+
+    def key(self, prediction, reference):
+        return hashlib.sha256("\0".join([self.checkpoint, prediction, reference]).encode("utf-8")).hexdigest()
+
+    def score(self, predictions, references):
+        """
+        BLEURT score of every (prediction, reference) pair, in order.
+        """
+        pairs = [(str(prediction), str(reference)) for prediction, reference in zip(predictions, references)]
+        keys = [self.key(*pair) for pair in pairs]
+        scores = self.cache.get_many(keys) if self.cache is not None else {}
+        hits = sum(1 for key in keys if key in scores)
+        self.hits += hits
+        self.misses += len(keys) - hits
+
+        missing = {}
+        for key, pair in zip(keys, pairs):
+            if key not in scores:
+                missing.setdefault(key, pair)
+        if missing:
+            self.load()
+            missing_keys = list(missing)
+            missing_pairs = list(missing.values())
+            for batch in length_buckets(missing_pairs, self.batch_size):
+                batch_scores = self._score_batch([missing_pairs[i][0] for i in batch], [missing_pairs[i][1] for i in batch])
+                computed = [(missing_keys[i], float(score)) for i, score in zip(batch, batch_scores)]
+                scores.update(computed)
+                if self.cache is not None:
+                    self.cache.put_many(computed)
+        return [scores[key] for key in keys]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return f"BLEURT cache: {self.hits} hits, {self.misses} misses ({self.hits / total if total else 0:.1%} hit rate)"
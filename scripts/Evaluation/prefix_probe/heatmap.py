@@ -5,7 +5,7 @@ import matplotlib.pyplot as plt
 from matplotlib.colors import LinearSegmentedColormap
 
 # Folder containing all evaluation CSVs
-eval_folder = 'scripts/Evaluation/prefix_probe/eval/unmasked'
+eval_folder = 'scripts/Evaluation/prefix_probe/eval/text/unmasked'
 
 # Custom model order
 custom_model_order = [
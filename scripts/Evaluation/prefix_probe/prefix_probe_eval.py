@@ -1,18 +1,70 @@
+import os
+import sys
 import pandas as pd
 import sacrebleu
-import evaluate
+from argparse import ArgumentParser
 from tqdm import tqdm
+from bleurt_service import CACHE_FILE_NAME, BleurtService
+from prefix_probe_metrics import BLEURT_CACHE_ENV, METRICS
 
-# Load metrics only once
-bleurt = evaluate.load("bleurt")
-rouge = evaluate.load("rouge")
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from common.response_cache import CACHE_DIR
 
-def evaluate_csv(csv_path: str, output_path: str):
+LANGS = ["en", "vi", "es", "tr"]
+
+# Model-backed metrics are registered as loaders and built once, on first use, so importing this
+# module (or a plotting script reusing its helpers) never starts TensorFlow or loads a checkpoint.
+METRIC_LOADERS = {}
+_metric_backends = {}
+
+def register_metric_backend(name, loader):
+    METRIC_LOADERS[name] = loader
+    _metric_backends.pop(name, None)
+
+def metric_backend(name):
+    if name not in _metric_backends:
+        _metric_backends[name] = METRIC_LOADERS[name]()
+    return _metric_backends[name]
+
+def load_rouge():
+    import evaluate
+    return evaluate.load("rouge")
+
+register_metric_backend("rouge", load_rouge)
+register_metric_backend("bleurt", lambda: BleurtService(cache_path=os.environ.get(BLEURT_CACHE_ENV)))
+
+def keep_previous_scores(df_out, previous_path, metrics):
+    """
+    Adds the columns of an earlier evaluation of metrics not in `metrics`, so evaluating a subset
+    of the metrics updates an _eval.csv instead of dropping its other scores. An earlier evaluation
+    with another number of rows was computed from other results and is not kept.
+    """
+    previous = pd.read_csv(previous_path)
+    if len(previous) != len(df_out):
+        print(f"Not keeping the scores in {previous_path}: {len(previous)} rows, this evaluation has {len(df_out)}")
+        return df_out
+    merged = df_out.reset_index(drop=True)
+    for column in previous.columns:
+        if column not in merged.columns and column.rsplit("_", 1)[-1] not in metrics:
+            merged[column] = previous[column].values
+    order = [f"{lang}_{metric}" for lang in LANGS for metric in METRICS]
+    return merged[sorted(merged.columns, key=lambda column: order.index(column) if column in order else len(order))]
+
+def evaluate_csv(csv_path: str, output_path: str, metrics=None, keep_previous=False):
+    """
+    Writes the scores of `metrics` (all of METRICS by default) to output_path. When only some
+    metrics are computed, the other scores of an existing output_path are kept, which the caller
+    confirms with `keep_previous` once it knows output_path was evaluated from the same csv_path.
+    Without it every metric is computed.
+    """
+    metrics = metrics or METRICS
+    if set(metrics) != set(METRICS) and not keep_previous:
+        print(f"Computing every metric: the scores in {output_path} are not confirmed to come from {csv_path}")
+        metrics = METRICS
     df = pd.read_csv(csv_path)
     df_out = pd.DataFrame(index=df.index)
-    langs = ["en", "vi", "es", "tr"]
 
-    for lang in langs:
+    for lang in LANGS:
         pred_col = f"{lang}_Completion"
         ref_col = f"{lang}_second_half"
 
@@ -29,43 +81,78 @@ def evaluate_csv(csv_path: str, output_path: str):
 
         print(f"Computing metrics for {lang}...")
         
+        sample_scores = {}
+
         # Per-sample metrics with tqdm
-        bleu_scores = []
-        chrf_scores = []
-        for p, r in tqdm(zip(predictions, references), total=len(predictions), desc=f"{lang} BLEU/ChrF++"):
-            bleu_scores.append(sacrebleu.sentence_bleu(p, [r]).score)
-            chrf_scores.append(sacrebleu.sentence_chrf(p, [r]).score)
+        sentence_metrics = [metric for metric in ["BLEU", "ChrF++"] if metric in metrics]
+        if sentence_metrics:
+            bleu_scores = []
+            chrf_scores = []
+            for p, r in tqdm(zip(predictions, references), total=len(predictions), desc=f"{lang} {'/'.join(sentence_metrics)}"):
+                if "BLEU" in metrics:
+                    bleu_scores.append(sacrebleu.sentence_bleu(p, [r]).score)
+                if "ChrF++" in metrics:
+                    chrf_scores.append(sacrebleu.sentence_chrf(p, [r]).score)
+            if "BLEU" in metrics:
+                sample_scores["BLEU"] = bleu_scores
+            if "ChrF++" in metrics:
+                sample_scores["ChrF++"] = chrf_scores
 
-        # Batch compute vectorized metrics
+        # Batch compute vectorized metrics, loading their backends on first use
         try:
-            rouge_scores = rouge.compute(predictions=predictions, references=references, rouge_types=["rougeL"])
-            bleurt_scores = bleurt.compute(predictions=predictions, references=references)["scores"]
+            if "ROUGE-L" in metrics:
+                rouge_scores = metric_backend("rouge").compute(predictions=predictions, references=references, rouge_types=["rougeL"])
+                sample_scores["ROUGE-L"] = rouge_scores["rougeL"]
+            if "BLEURT" in metrics:
+                sample_scores["BLEURT"] = metric_backend("bleurt").score(predictions, references)
         except Exception as e:
             print(f"Error during batch BLEURT/ROUGE computation for {lang}: {e}")
             continue
 
         # Fill scores into output dataframe
-        df_out.loc[valid_indices, f"{lang}_ROUGE-L"] = rouge_scores["rougeL"]
-        df_out.loc[valid_indices, f"{lang}_BLEU"] = bleu_scores
-        df_out.loc[valid_indices, f"{lang}_ChrF++"] = chrf_scores
-        df_out.loc[valid_indices, f"{lang}_BLEURT"] = bleurt_scores
+        for metric in METRICS:
+            if metric in sample_scores:
+                df_out.loc[valid_indices, f"{lang}_{metric}"] = sample_scores[metric]
 
         # System-level row
         try:
-            system_row = {
-                f"{lang}_ROUGE-L": rouge_scores["rougeL"],
-                f"{lang}_BLEU": sacrebleu.corpus_bleu(hypotheses=predictions, references=[references]).score,
-                f"{lang}_ChrF++": sacrebleu.corpus_chrf(hypotheses=predictions, references=[references]).score,
-                f"{lang}_BLEURT": sum(bleurt_scores) / len(bleurt_scores),
+            system_scores = {
+                "ROUGE-L": lambda: sample_scores["ROUGE-L"],
+                "BLEU": lambda: sacrebleu.corpus_bleu(hypotheses=predictions, references=[references]).score,
+                "ChrF++": lambda: sacrebleu.corpus_chrf(hypotheses=predictions, references=[references]).score,
+                "BLEURT": lambda: sum(sample_scores["BLEURT"]) / len(sample_scores["BLEURT"]),
             }
+            system_row = {f"{lang}_{metric}": system_scores[metric]() for metric in METRICS if metric in sample_scores}
             df_out.loc["System Scores", list(system_row.keys())] = list(system_row.values())
         except Exception as e:
             print(f"System-level score error for {lang}: {e}")
 
+    if set(metrics) != set(METRICS) and os.path.exists(output_path):
+        df_out = keep_previous_scores(df_out, output_path, metrics)
     df_out.to_csv(output_path, index=False)
     print(f"Saved evaluation to: {output_path}")
 
 if __name__ == "__main__":
-    input_csv = "EMNLP_results/prefix_probe/unmasked/text/GPT4o_unmasked_prefix_probe_one-shot.csv"  
-    output_csv = "scripts/Evaluation/prefix_probe/eval/GPT4o_unmasked_prefix_probe_one-shot_eval.csv" 
-    evaluate_csv(input_csv, output_csv)
+    parser = ArgumentParser()
+    parser.add_argument("input_csv", nargs="?", default="EMNLP_results/prefix_probe/unmasked/text/GPT4o_unmasked_prefix_probe_one-shot.csv")
+    parser.add_argument("output_csv", nargs="?", default="scripts/Evaluation/prefix_probe/eval/text/unmasked/GPT4o_unmasked_prefix_probe_one-shot_eval.csv")
+    parser.add_argument("--metrics", nargs="+", default=METRICS, choices=METRICS,
+                        help="Metrics to compute, model-backed ones are only loaded if selected. "
+                             "Needs --keep_previous, otherwise every metric is computed")
+    parser.add_argument("--keep_previous", action="store_true",
+                        help="output_csv was evaluated from this input_csv, keep its scores of the metrics not computed")
+    parser.add_argument("--bleurt_batch_size", type=int, default=None, help="Pairs per BLEURT batch, defaults to 128 on GPU and 16 on CPU")
+    parser.add_argument("--bleurt_threads", type=int, default=None, help="TensorFlow CPU threads for BLEURT")
+    parser.add_argument("--bleurt_cache", type=str, default=None,
+                        help=f"Persistent (prediction, reference) -> BLEURT score cache, defaults to {os.path.join(CACHE_DIR, CACHE_FILE_NAME)}")
+    parser.add_argument("--no_bleurt_cache", action="store_true", help="Score every pair with the model")
+    args = parser.parse_args()
+
+    bleurt_cache = None
+    if not args.no_bleurt_cache:
+        bleurt_cache = args.bleurt_cache or os.path.join(CACHE_DIR, CACHE_FILE_NAME)
+    register_metric_backend("bleurt", lambda: BleurtService(batch_size=args.bleurt_batch_size, num_threads=args.bleurt_threads,
+                                                            cache_path=bleurt_cache))
+    evaluate_csv(args.input_csv, args.output_csv, args.metrics, args.keep_previous)
+    if "bleurt" in _metric_backends:
+        print(metric_backend("bleurt").stats())
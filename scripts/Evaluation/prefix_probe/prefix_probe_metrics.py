@@ -0,0 +1,9 @@
+# Names shared by prefix_probe_eval and run_eval. This module imports nothing, so run_eval can list
+# the metrics without loading sacrebleu, evaluate or TensorFlow.
+
+# Metrics in the order their columns are written
+METRICS = ["ROUGE-L", "BLEU", "ChrF++", "BLEURT"]
+
+# Environment variable with the BLEURT score cache path of the default BleurtService, set by run_eval
+# for its workers
+BLEURT_CACHE_ENV = "BLEURT_CACHE"
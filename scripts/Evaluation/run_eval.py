@@ -0,0 +1,281 @@
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import fnmatch
+import hashlib
+import sqlite3
+import importlib
+from argparse import ArgumentParser
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+EVALUATION_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# An evaluator wraps one of the task evaluation modules. Result files are found under
+# <results_dir>/<results_subdir>/<results_layout>/*.csv and evaluated into
+# <eval_dir>/<eval_subdir>/eval/<eval_layout>/<name>_eval.csv, the layout the heatmap scripts read.
+# Bump an evaluator's version whenever its scores change, so its _eval.csv files are recomputed.
+Evaluator = namedtuple("Evaluator", ["name", "eval_subdir", "module", "function", "results_subdir", "results_layout",
+                                     "eval_layout", "version"])
+
+EVALUATORS = {
+    "nct": Evaluator("nct", "nct", "nct_eval", "evaluate_predictions",
+                     "name_cloze", "{modality}", "{modality}", "1"),
+    "dir_probe": Evaluator("dir_probe", "dir_probe", "dir_probe_eval", "evaluate_csv",
+                           "direct_probe", "{variant}/{modality}", "{modality}/{variant}", "1"),
+    "prefix_probe": Evaluator("prefix_probe", "prefix_probe", "prefix_probe_eval", "evaluate_csv",
+                              "prefix_probe", "{variant}/{modality}", "{modality}/{variant}", "1"),
+}
+
+# The metric names live in a module of their own, so the CLI starts without importing an evaluation module
+sys.path.append(os.path.join(EVALUATION_DIR, "prefix_probe"))
+from prefix_probe_metrics import BLEURT_CACHE_ENV, METRICS as PREFIX_PROBE_METRICS
+from bleurt_service import CACHE_FILE_NAME as BLEURT_CACHE_FILE_NAME
+
+sys.path.append(os.path.dirname(EVALUATION_DIR))
+from common.response_cache import CACHE_DIR
+
+EvalJob = namedtuple("EvalJob", ["evaluator", "input_path", "output_path"])
+
+# Content hash of a result file with the size and mtime it had before it was read
+InputState = namedtuple("InputState", ["hash", "size", "mtime_ns"])
+
+
+def layout_fields(layout):
+    return [part.strip("{}") for part in layout.split("/")]
+
+
+def discover_jobs(evaluator, results_dir, eval_dir, file_pattern="*.csv"):
+    """
+    Lists an EvalJob for every result file of `evaluator`. Two result files that would be
+    written to the same _eval.csv are reported and only the first is kept.
+    """
+    fields = layout_fields(evaluator.results_layout)
+    task_dir = os.path.join(results_dir, evaluator.results_subdir)
+    pattern = os.path.join(task_dir, *["*"] * len(fields), "*.csv")
+    jobs = []
+    outputs = {}
+    for input_path in sorted(glob.glob(pattern)):
+        name = os.path.splitext(os.path.basename(input_path))[0]
+        if name.endswith("_eval") or not fnmatch.fnmatch(os.path.basename(input_path), file_pattern):
+            continue
+        parts = os.path.relpath(os.path.dirname(input_path), task_dir).split(os.sep)
+        output_dir = evaluator.eval_layout.format(**dict(zip(fields, parts)))
+        output_path = os.path.join(eval_dir, evaluator.eval_subdir, "eval", output_dir, f"{name}_eval.csv")
+        if output_path in outputs:
+            print(f"Skipping {input_path}: {outputs[output_path]} is also evaluated into {output_path}")
+            continue
+        outputs[output_path] = input_path
+        jobs.append(EvalJob(evaluator.name, input_path, output_path))
+    return jobs
+
+
+def file_hash(path, chunk_bytes=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_bytes), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class EvalManifest:
+    """
+    SQLite record of what every _eval.csv was computed from: the content hash of its result file,
+    the evaluator version and the metric config. An _eval.csv whose record still matches is up
+    to date and is not evaluated again.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS evaluations (output_path TEXT PRIMARY KEY, input_path TEXT NOT NULL, "
+            "input_hash TEXT NOT NULL, input_size INTEGER NOT NULL, input_mtime_ns INTEGER NOT NULL, "
+            "version TEXT NOT NULL, config TEXT NOT NULL, seconds REAL, evaluated_at REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    def input_state(self, input_path):
+        """
+        InputState of a result file. The file is only read again when its size or mtime changed
+        since its hash was recorded.
+        """
+        stat = os.stat(input_path)
+        row = self.conn.execute(
+            "SELECT input_hash FROM evaluations WHERE input_path = ? AND input_size = ? AND input_mtime_ns = ? LIMIT 1",
+            (input_path, stat.st_size, stat.st_mtime_ns),
+        ).fetchone()
+        return InputState(row[0] if row else file_hash(input_path), stat.st_size, stat.st_mtime_ns)
+
+    def is_current(self, job, input_hash, version, config):
+        row = self.conn.execute(
+            "SELECT input_hash, version, config FROM evaluations WHERE output_path = ?", (job.output_path,)
+        ).fetchone()
+        return row == (input_hash, version, config) and os.path.exists(job.output_path)
+
+    def input_unchanged(self, job, input_hash):
+        """
+        True when the existing _eval.csv of `job` was computed from a result file with `input_hash`.
+        """
+        row = self.conn.execute("SELECT input_hash FROM evaluations WHERE output_path = ?", (job.output_path,)).fetchone()
+        return row is not None and row[0] == input_hash and os.path.exists(job.output_path)
+
+    def refresh(self, job, state):
+        """
+        Stores the current size and mtime of an unchanged result file, so it is not hashed again.
+        """
+        self.conn.execute("UPDATE evaluations SET input_size = ?, input_mtime_ns = ? WHERE output_path = ?",
+                          (state.size, state.mtime_ns, job.output_path))
+        self.conn.commit()
+
+    def record(self, job, state, version, config, seconds):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO evaluations (output_path, input_path, input_hash, input_size, input_mtime_ns, "
+            "version, config, seconds, evaluated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job.output_path, job.input_path, state.hash, state.size, state.mtime_ns, version, config, seconds, time.time()),
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def metric_config(options):
+    return json.dumps(options or {}, sort_keys=True)
+
+
+def stale_jobs(jobs, manifest, options=None):
+    """
+    Returns the jobs whose _eval.csv is missing or was computed from another input, evaluator
+    version or metric config, with the InputState of each. `options` maps evaluator names to
+    the options their jobs are run with.
+    """
+    options = options or {}
+    stale = []
+    for job in jobs:
+        state = manifest.input_state(job.input_path)
+        config = metric_config(options.get(job.evaluator))
+        if not manifest.is_current(job, state.hash, EVALUATORS[job.evaluator].version, config):
+            stale.append((job, state))
+        else:
+            manifest.refresh(job, state)
+    return stale
+
+
+def run_job(job, options=None, keep_previous=False):
+    """
+    Evaluates one result file in a worker process and returns the seconds it took. The evaluation
+    module is imported on first use, and the output is written to a temporary file and renamed
+    over the _eval.csv, so an interrupted run never leaves a partial result behind. With
+    `keep_previous`, the temporary file starts as a copy of the existing _eval.csv, for evaluations
+    that update their output; it must only be set when that _eval.csv was computed from the same
+    result file. `options` are passed to the evaluation function as keyword arguments.
+    """
+    evaluator = EVALUATORS[job.evaluator]
+    module_dir = os.path.join(EVALUATION_DIR, evaluator.eval_subdir)
+    if module_dir not in sys.path:
+        sys.path.append(module_dir)
+    evaluate = getattr(importlib.import_module(evaluator.module), evaluator.function)
+
+    start = time.time()
+    os.makedirs(os.path.dirname(job.output_path), exist_ok=True)
+    tmp_path = f"{job.output_path}.{os.getpid()}.tmp"
+    try:
+        if keep_previous and os.path.exists(job.output_path):
+            shutil.copyfile(job.output_path, tmp_path)
+        evaluate(job.input_path, tmp_path, **(options or {}))
+        os.replace(tmp_path, job.output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return time.time() - start
+
+
+def run_jobs(jobs, workers=None, manifest=None, options=None):
+    """
+    Fans the (job, InputState) pairs out over a process pool and prints each file's time as it
+    finishes, recording it in the manifest. `options` maps evaluator names to the options of
+    their jobs. A job only updates its existing _eval.csv when the manifest shows it was computed
+    from the same result file, otherwise its metric selection is dropped and every metric is
+    computed again. Returns the jobs that failed.
+    """
+    options = options or {}
+    failed = []
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for job, state in jobs:
+            job_options = options.get(job.evaluator)
+            keep_previous = manifest is not None and manifest.input_unchanged(job, state.hash)
+            call_options = job_options
+            if job_options and "metrics" in job_options:
+                if keep_previous:
+                    # the evaluation only merges the earlier scores when told they are from this input
+                    call_options = dict(job_options, keep_previous=True)
+                else:
+                    job_options = call_options = {key: value for key, value in job_options.items() if key != "metrics"}
+            futures[executor.submit(run_job, job, call_options, keep_previous)] = (job, state, job_options)
+        for done, future in enumerate(as_completed(futures), 1):
+            job, state, job_options = futures[future]
+            try:
+                elapsed = future.result()
+                print(f"[{done}/{len(jobs)}] {job.evaluator} {job.input_path} -> {job.output_path} in {elapsed:.1f}s")
+                if manifest is not None:
+                    manifest.record(job, state, EVALUATORS[job.evaluator].version, metric_config(job_options), elapsed)
+            except Exception as e:
+                failed.append(job)
+                print(f"[{done}/{len(jobs)}] Error evaluating {job.input_path}: {e}")
+    print(f"Evaluated {len(jobs) - len(failed)} of {len(jobs)} files in {time.time() - start:.1f}s")
+    return failed
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Evaluates every probe result file in parallel")
+    parser.add_argument("--tasks", nargs="+", default=list(EVALUATORS), choices=list(EVALUATORS))
+    parser.add_argument("--results_dir", type=str, default="EMNLP_results",
+                        help="Directory with name_cloze/, direct_probe/ and prefix_probe/ result CSVs")
+    parser.add_argument("--eval_dir", type=str, default="scripts/Evaluation",
+                        help="The _eval.csv files go to <eval_dir>/<task>/eval/...")
+    parser.add_argument("--files", type=str, default="*.csv", help="Only evaluate result files whose name matches this pattern")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Worker processes, each prefix_probe worker loads its own copy of the metrics")
+    parser.add_argument("--metrics", nargs="+", default=None, choices=PREFIX_PROBE_METRICS,
+                        help="Only compute these prefix_probe metrics, BLEURT and ROUGE are only loaded if selected. "
+                             "Result files changed since their last evaluation still get every metric")
+    parser.add_argument("--bleurt_cache", type=str, default=None,
+                        help=f"BLEURT score cache shared by the prefix_probe workers, defaults to {os.path.join(CACHE_DIR, BLEURT_CACHE_FILE_NAME)}")
+    parser.add_argument("--manifest", type=str, default=None,
+                        help="Record of what every _eval.csv was computed from, defaults to <eval_dir>/eval_manifest.sqlite")
+    parser.add_argument("--force", action="store_true", help="Evaluate every result file, even if its _eval.csv is up to date")
+    parser.add_argument("--dry_run", action="store_true", help="List the files that would be evaluated")
+    args = parser.parse_args()
+
+    options = {}
+    if args.metrics:
+        options["prefix_probe"] = {"metrics": [metric for metric in PREFIX_PROBE_METRICS if metric in args.metrics]}
+
+    # set before the pool starts, so every worker inherits it
+    os.environ[BLEURT_CACHE_ENV] = args.bleurt_cache or os.path.join(CACHE_DIR, BLEURT_CACHE_FILE_NAME)
+
+    manifest = EvalManifest(args.manifest or os.path.join(args.eval_dir, "eval_manifest.sqlite"))
+    jobs = []
+    for task in args.tasks:
+        task_jobs = discover_jobs(EVALUATORS[task], args.results_dir, args.eval_dir, args.files)
+        if args.force:
+            stale = [(job, manifest.input_state(job.input_path)) for job in task_jobs]
+        else:
+            stale = stale_jobs(task_jobs, manifest, options)
+        print(f"{task}: {len(task_jobs)} result files, {len(stale)} new or changed")
+        jobs.extend(stale)
+
+    if args.dry_run:
+        for job, _ in jobs:
+            print(f"{job.input_path} -> {job.output_path}")
+        sys.exit(0)
+
+    failed = run_jobs(jobs, args.workers, manifest, options)
+    manifest.close()
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,116 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(SCRIPTS_DIR)
+sys.path.append(os.path.join(SCRIPTS_DIR, "direct_probing"))
+
+import Openai_direct_probing
+from common.async_openai import AsyncOpenAIChatBackend
+from common.backends import OpenAIChatBackend
+
+# Compares the per-row synchronous loop of the OpenAI direct probing script with the asyncio
+# executor against a local mock of the chat completions endpoint, which answers after a fixed
+# latency, reports x-ratelimit headers and returns 429 with retry-after-ms above its request rate.
+
+
+def make_handler(latency, requests_per_second):
+    # OpenAI style limit: a bucket of one second of requests that refills continuously,
+    # reported as a per-minute limit
+    bucket = {"tokens": float(requests_per_second), "at": time.monotonic()}
+    lock = threading.Lock()
+
+    class MockChatCompletions(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, payload, headers):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            with lock:
+                now = time.monotonic()
+                bucket["tokens"] = min(requests_per_second, bucket["tokens"] + (now - bucket["at"]) * requests_per_second)
+                bucket["at"] = now
+                limited = bucket["tokens"] < 1
+                if not limited:
+                    bucket["tokens"] -= 1
+                remaining = int(bucket["tokens"])
+                reset_ms = int((requests_per_second - bucket["tokens"]) / requests_per_second * 1000)
+                retry_ms = int((1 - bucket["tokens"]) / requests_per_second * 1000) + 1
+            headers = {
+                "x-ratelimit-limit-requests": str(requests_per_second * 60),
+                "x-ratelimit-remaining-requests": str(remaining),
+                "x-ratelimit-reset-requests": f"{reset_ms}ms",
+            }
+            if limited:
+                self._send(429, {"error": {"message": "Rate limit reached", "type": "requests"}},
+                           dict(headers, **{"retry-after-ms": str(retry_ms)}))
+                return
+
+            time.sleep(latency)
+            prompt = body["messages"][-1]["content"]
+            answer = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+            self._send(200, {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body["model"],
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": f'<output>"title": "{answer}"</output>'},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": 8, "total_tokens": len(prompt) // 4 + 8},
+            }, headers)
+
+    return MockChatCompletions
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds the mock server takes per completion")
+    parser.add_argument("--requests_per_second", type=int, default=100, help="Mock server rate limit")
+    parser.add_argument("--max_concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(args.latency, args.requests_per_second))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}/v1"
+
+    passages = [f"Passage number {i} of the benchmark book." for i in range(args.rows)]
+
+    from openai import OpenAI
+    sync_backend = OpenAIChatBackend("gpt-4o-2024-11-20", OpenAI(api_key="mock", base_url=base_url, max_retries=0))
+    start = time.time()
+    # the synchronous backend sends a column's requests one after the other, like the old per-row loop
+    sync_output = Openai_direct_probing.predict_column("en", passages, sync_backend, "unshuffled", "one-shot")
+    sync_elapsed = time.time() - start
+
+    async_backend = AsyncOpenAIChatBackend("gpt-4o-2024-11-20", max_concurrency=args.max_concurrency,
+                                           base_url=base_url, api_key="mock")
+    start = time.time()
+    async_output = Openai_direct_probing.predict_column("en", passages, async_backend, "unshuffled", "one-shot")
+    async_elapsed = time.time() - start
+
+    server.shutdown()
+    print(f"sync:  {args.rows} rows in {sync_elapsed:.1f}s ({args.rows / sync_elapsed:.1f} rows/s)")
+    print(f"async: {args.rows} rows in {async_elapsed:.1f}s ({args.rows / async_elapsed:.1f} rows/s), "
+          f"{async_backend.retries} retries")
+    print(f"speedup: {sync_elapsed / async_elapsed:.1f}x, identical outputs: {sync_output == async_output}")
@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import tracemalloc
+from types import SimpleNamespace
+from argparse import ArgumentParser
+
+import pyarrow as pa
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.batch_api import download_results
+
+# Compares peak memory of parsing a Batch API output file the old way (whole file through
+# .text, splitlines and json.loads) with the streamed reader of common.batch_api, on a synthetic
+# output file served from disk by a stand-in for the Files API.
+
+
+class DiskFiles:
+    def __init__(self, path):
+        self.path = path
+        self.with_streaming_response = SimpleNamespace(content=self._stream)
+
+    def content(self, file_id):
+        with open(self.path, encoding="utf-8") as f:
+            return SimpleNamespace(text=f.read())
+
+    def _stream(self, file_id):
+        path = self.path
+
+        class Response:
+            def __enter__(self):
+                self.f = open(path, "rb")
+                return self
+
+            def __exit__(self, *exc):
+                self.f.close()
+
+            def iter_bytes(self, chunk_size):
+                while True:
+                    chunk = self.f.read(chunk_size)
+                    if not chunk:
+                        return
+                    yield chunk
+
+        return Response()
+
+
+def write_synthetic_output(path, rows):
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(rows):
+            line = {
+                "id": f"batch_req_{i:024d}",
+                "custom_id": f"en_{i}",
+                "response": {
+                    "status_code": 200,
+                    "request_id": f"{i:032x}",
+                    "body": {
+                        "id": f"chatcmpl-{i:029d}",
+                        "object": "chat.completion",
+                        "created": 1735689600,
+                        "model": "gpt-4o-2024-11-20",
+                        "choices": [{
+                            "index": 0,
+                            "message": {"role": "assistant", "content": f'<output>"title": "Book number {i}", "author": "Author {i}"</output>', "refusal": None},
+                            "logprobs": None,
+                            "finish_reason": "stop",
+                        }],
+                        "usage": {"prompt_tokens": 812, "completion_tokens": 21, "total_tokens": 833,
+                                  "prompt_tokens_details": {"cached_tokens": 768, "audio_tokens": 0},
+                                  "completion_tokens_details": {"reasoning_tokens": 0, "audio_tokens": 0}},
+                        "system_fingerprint": "fp_0123456789",
+                    },
+                },
+                "error": None,
+            }
+            f.write(json.dumps(line) + "\n")
+
+
+def download_whole(client, batch):
+    """
+    The original download_and_parse_results of the batch scripts.
+    """
+    file_contents = client.files.content(batch.output_file_id).text
+    results = {}
+    for line in file_contents.splitlines():
+        response_data = json.loads(line)
+        custom_id = response_data.get("custom_id")
+        if response_data.get("error"):
+            results[custom_id] = None
+        else:
+            results[custom_id] = response_data["response"]["body"]["choices"][0]["message"]["content"]
+    return results
+
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.time()
+    results = fn()
+    elapsed = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return results, elapsed, peak
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output_path = os.path.join(tmp, "output.jsonl")
+        write_synthetic_output(output_path, args.rows)
+        size = os.path.getsize(output_path)
+        client = SimpleNamespace(files=DiskFiles(output_path))
+        batch = SimpleNamespace(id="batch_bench", output_file_id="file-bench")
+
+        whole, whole_elapsed, whole_peak = measure(lambda: download_whole(client, batch))
+        del whole
+        streamed, streamed_elapsed, streamed_peak = measure(lambda: download_results(client, batch))
+        store_path = os.path.join(tmp, "results.parquet")
+        stored, stored_elapsed, stored_peak = measure(lambda: download_results(client, batch, store_path))
+
+        print(f"output file: {args.rows} rows, {size / 2**20:.0f} MiB")
+        print(f"whole file: {whole_elapsed:.1f}s, peak {whole_peak / 2**20:.0f} MiB")
+        print(f"streamed:   {streamed_elapsed:.1f}s, peak {streamed_peak / 2**20:.0f} MiB")
+        print(f"streamed into Parquet: {stored_elapsed:.1f}s, peak {stored_peak / 2**20:.0f} MiB "
+              f"(+{pa.default_memory_pool().max_memory() / 2**20:.0f} MiB Arrow), "
+              f"store {os.path.getsize(store_path) / 2**20:.1f} MiB")
+        print(f"identical results: {streamed == stored == download_whole(client, batch)}")
@@ -0,0 +1,124 @@
+import os
+import sys
+import glob
+import json
+import time
+from argparse import ArgumentParser
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from run_probes import TASKS, load_books
+from common.backends import SamplingParams, VLLMBackend
+from common.batching import collect_prompts
+from common.tokenization import backend_token_counter
+
+# Sampling settings the runners used before stop strings and passage-sized budgets
+LEGACY_MAX_TOKENS = {
+    "direct_probe": 100,
+    "prefix_probe": 1000,
+    "name_cloze": 100,
+}
+
+
+def timed_generate(backend, prompts, sampling_params):
+    start = time.time()
+    completions = backend.generate(prompts, sampling_params)
+    elapsed = time.time() - start
+    return elapsed, completions
+
+
+def is_truncated(completion, params):
+    """
+    True when generation ran out of max_tokens before the model finished or hit a stop string.
+    """
+    if completion.generated_tokens < params.max_tokens:
+        return False
+    return not any(completion.text.endswith(stop) for stop in params.stop if params.include_stop_str_in_output)
+
+
+def truncated_per_column(completions, sampling_params, tags):
+    """
+    Returns {language column: length-truncated outputs}.
+    """
+    counts = {}
+    for completion, params, (_, column, _) in zip(completions, sampling_params, tags):
+        counts[column] = counts.get(column, 0) + is_truncated(completion, params)
+    return counts
+
+
+def reset_prefix_cache(backend):
+    """
+    Empties vLLM's prefix cache, so a run does not reuse the KV blocks of the run before it.
+    Returns False on vLLM versions that cannot reset it.
+    """
+    reset = getattr(backend.llm, "reset_prefix_cache", None)
+    if reset is None:
+        return False
+    reset()
+    return True
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("model", type=str, help="Name of the model to use")
+    parser.add_argument("gpus", type=str, help="Nums of gpus to use")
+    parser.add_argument("task", type=str, choices=list(TASKS))
+    parser.add_argument("data", type=str, help="Glob of the book files to benchmark on")
+    parser.add_argument("--prompt_setting", type=str, default="one-shot")
+    parser.add_argument("--max_model_len", type=int, default=2048)
+    parser.add_argument("--repeats", type=int, default=2,
+                        help="Timed runs of each variant, the variant that goes first alternates between repeats")
+    parser.add_argument("--output", type=str, default=None,
+                        help="JSON file the throughput and per-language truncation counts of both variants are written to")
+    args = parser.parse_args()
+
+    task = TASKS[args.task]
+    backend = VLLMBackend.from_model(args.model, tensor_parallel_size=int(args.gpus), max_model_len=args.max_model_len)
+    books = load_books(task, sorted(glob.glob(args.data, recursive=True)), count_tokens=backend_token_counter(backend))
+    prompts, early_stop_params, tags = collect_prompts(task.module, books, args.prompt_setting)
+    legacy_params = SamplingParams(temperature=0.0, top_p=1.0, max_tokens=LEGACY_MAX_TOKENS[args.task])
+    print(f"{len(prompts)} prompts from {len(books)} books")
+
+    # warm up CUDA graphs so no run pays for them
+    backend.generate(prompts[:32], legacy_params)
+
+    variants = [("legacy", legacy_params), ("early stop", early_stop_params)]
+    totals = {label: [0.0, 0] for label, _ in variants}
+    truncated = {}
+    for repeat in range(args.repeats):
+        # Each run starts from an empty prefix cache, and the order alternates so neither
+        # variant always runs on the engine state the other one left behind.
+        for label, sampling_params in (variants if repeat % 2 == 0 else variants[::-1]):
+            if not reset_prefix_cache(backend):
+                print("This vLLM cannot reset its prefix cache, the second run of each repeat may reuse cached prompts")
+            elapsed, completions = timed_generate(backend, prompts, sampling_params)
+            generated_tokens = sum(completion.generated_tokens for completion in completions)
+            params_list = sampling_params if isinstance(sampling_params, list) else [sampling_params] * len(prompts)
+            # greedy decoding, so every repeat truncates the same outputs
+            truncated[label] = truncated_per_column(completions, params_list, tags)
+            totals[label][0] += elapsed
+            totals[label][1] += generated_tokens
+            print(f"[{repeat + 1}/{args.repeats}] {label}: {elapsed:.1f}s, {generated_tokens} generated tokens, "
+                  f"{len(prompts) / elapsed:.1f} prompts/s, {generated_tokens / elapsed:.0f} tok/s")
+
+    for label, (elapsed, generated_tokens) in totals.items():
+        print(f"{label}: {elapsed / args.repeats:.1f}s per run, {generated_tokens / elapsed:.0f} tok/s")
+        print(f"  length-truncated outputs: {', '.join(f'{column} {count}' for column, count in sorted(truncated[label].items()))}")
+    legacy_time, early_stop_time = totals["legacy"][0], totals["early stop"][0]
+    print(f"Speedup: {legacy_time / early_stop_time:.2f}x")
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "model": args.model,
+                "task": args.task,
+                "data": args.data,
+                "prompt_setting": args.prompt_setting,
+                "prompts": len(prompts),
+                "variants": {label: {
+                    "seconds_per_run": elapsed / args.repeats,
+                    "generated_tokens_per_second": generated_tokens / elapsed,
+                    "length_truncated": truncated[label],
+                } for label, (elapsed, generated_tokens) in totals.items()},
+                "speedup": legacy_time / early_stop_time,
+            }, f, indent=2)
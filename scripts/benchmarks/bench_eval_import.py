@@ -0,0 +1,55 @@
+import os
+import sys
+import time
+import statistics
+import subprocess
+from argparse import ArgumentParser
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EVALUATION_DIR = os.path.join(SCRIPTS_DIR, "Evaluation")
+
+# (label, directory the command runs in, python arguments). Each is timed in a fresh interpreter,
+# so nothing a previous run imported is already loaded.
+TARGETS = [
+    ("python", EVALUATION_DIR, ["-c", "pass"]),
+    ("import nct_eval", os.path.join(EVALUATION_DIR, "nct"), ["-c", "import nct_eval"]),
+    ("import dir_probe_eval", os.path.join(EVALUATION_DIR, "dir_probe"), ["-c", "import dir_probe_eval"]),
+    ("import prefix_probe_eval", os.path.join(EVALUATION_DIR, "prefix_probe"), ["-c", "import prefix_probe_eval"]),
+    ("prefix_probe_eval.py --help", os.path.join(EVALUATION_DIR, "prefix_probe"), ["prefix_probe_eval.py", "--help"]),
+    ("run_eval.py --help", EVALUATION_DIR, ["run_eval.py", "--help"]),
+]
+
+
+def time_command(cwd, arguments, repeats):
+    """
+    Median wall-clock seconds of `python <arguments>` over `repeats` runs, or the error of a failing run.
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, *arguments], cwd=cwd, capture_output=True, text=True)
+        elapsed = time.perf_counter() - start
+        if result.returncode != 0:
+            return None, result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit {result.returncode}"
+        times.append(elapsed)
+    return statistics.median(times), None
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Measures the startup time of the evaluation modules and CLIs")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--targets", nargs="+", default=None, help="Only time the targets whose label contains one of these")
+    args = parser.parse_args()
+
+    failed = 0
+    for label, cwd, arguments in TARGETS:
+        if args.targets and not any(target in label for target in args.targets):
+            continue
+        seconds, error = time_command(cwd, arguments, args.repeats)
+        if error:
+            failed += 1
+            print(f"{label:32} failed: {error}")
+        else:
+            print(f"{label:32} {seconds * 1000:8.0f} ms")
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,97 @@
+import os
+import sys
+import glob
+import time
+from argparse import ArgumentParser
+
+import pandas as pd
+from bs4 import BeautifulSoup
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.extraction import extract_tag, extract_all_tag_texts
+
+# Completions in the shapes the probing models actually produce
+SAMPLE_OUTPUTS = [
+    '<output>"title": "The Picture of Dorian Gray","author": "Oscar Wilde"</output>',
+    'Based on the passage, I believe this is from:\n<output>"title": "Dracula","author": "Bram Stoker"</output>',
+    '<output>Hester</output>',
+    '<name>Alice</name>',
+    '<output>Elizabeth Bennet</output>\n\nThe passage mentions Darcy, so the masked name is likely Elizabeth.',
+    '"title": "Frankenstein","author": "Mary Shelley"',
+    '<continuation>was more truth in the rumor than our modern incredulity may be inclined to admit.</continuation>',
+    '<continuation>Y entonces</continuation> <continuation>el viejo se fue & no volvió</continuation>',
+    'Here is the continuation:\n<continuation>and the door closed behind him',
+    '<output>"title": "1984","author": "George Orwell"</output> <b>Note</b>: shuffled text.',
+    '<output>Tom &amp; Huck</output>',
+    '',
+]
+
+
+def bs4_find(text, tag):
+    element = BeautifulSoup(text, 'html.parser').find(tag)
+    return element.decode_contents() if element else None
+
+
+def bs4_find_all_texts(text, tag):
+    return [element.get_text() for element in BeautifulSoup(text, 'html.parser').find_all(tag)]
+
+
+def load_completions(pattern):
+    """
+    Collects every string in the *_results / *_results_raw columns of the result CSVs matching pattern.
+    """
+    completions = []
+    for path in glob.glob(pattern, recursive=True):
+        df = pd.read_csv(path)
+        for col in df.columns:
+            if col.endswith("_results") or col.endswith("_results_raw"):
+                completions.extend(df[col].dropna().astype(str).tolist())
+    return completions
+
+
+def check_parity(completions):
+    mismatches = 0
+    for text in completions:
+        for tag in ["output", "name"]:
+            if extract_tag(text, tag) != bs4_find(text, tag):
+                mismatches += 1
+                print(f"Mismatch for <{tag}>: {text!r}")
+        if extract_all_tag_texts(text, "continuation") != bs4_find_all_texts(text, "continuation"):
+            mismatches += 1
+            print(f"Mismatch for <continuation>: {text!r}")
+    return mismatches
+
+
+def time_it(fn, completions, tag, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in completions:
+            fn(text, tag)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--results", type=str, default=None, help="Glob of probe result CSVs to use as real completions")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    completions = list(SAMPLE_OUTPUTS)
+    if args.results:
+        completions.extend(load_completions(args.results))
+    print(f"{len(completions)} completions")
+
+    mismatches = check_parity(completions)
+    print(f"Parity: {mismatches} mismatches")
+
+    for label, fast, slow, tag in [
+        ("find <output>", extract_tag, bs4_find, "output"),
+        ("find_all <continuation>", extract_all_tag_texts, bs4_find_all_texts, "continuation"),
+    ]:
+        fast_time = time_it(fast, completions, tag, args.repeat)
+        slow_time = time_it(slow, completions, tag, args.repeat)
+        n = len(completions) * args.repeat
+        print(f"{label}: bs4 {slow_time / n * 1e6:.1f}us, fast path {fast_time / n * 1e6:.1f}us per completion "
+              f"({slow_time / fast_time:.1f}x)")
+
+    sys.exit(1 if mismatches else 0)
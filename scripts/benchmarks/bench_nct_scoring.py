@@ -0,0 +1,77 @@
+import os
+import sys
+import glob
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+import pandas as pd
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(SCRIPTS_DIR, "Evaluation", "nct"))
+from nct_eval import LEVENSHTEIN_RATIO, batch_match_scores, calculate_match_scores, ensure_list, granular_ents, preprocess_result
+
+
+def load_result_file(path):
+    """
+    Reads a name cloze result CSV and prepares it the way evaluate_predictions does.
+    Returns (df, result columns).
+    """
+    df = pd.read_csv(path)
+    df['Single_ent'] = df['Single_ent'].apply(ensure_list).apply(granular_ents)
+    result_cols = [col for col in df.columns if col.endswith('_results')]
+    for col in result_cols:
+        df[col] = df[col].apply(preprocess_result)
+    return df, result_cols
+
+
+def row_wise_scores(df, result_col):
+    exact_match, highest_fuzzy_score = zip(*df.apply(
+        lambda row: calculate_match_scores(row['Single_ent'], row[result_col]), axis=1))
+    return np.array(exact_match), np.array(highest_fuzzy_score, dtype=np.float64)
+
+
+def score_files(paths, scorer):
+    """
+    Scores every result column of every file with `scorer`, returns ({(path, col): scores}, seconds spent scoring).
+    """
+    scores = {}
+    elapsed = 0.0
+    for path in paths:
+        try:
+            df, result_cols = load_result_file(path)
+        except Exception as e:
+            print(f"Skipping {path}: {e}")
+            continue
+        start = time.perf_counter()
+        for col in result_cols:
+            scores[(path, col)] = scorer(df, col)
+        elapsed += time.perf_counter() - start
+    return scores, elapsed
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--results", type=str, default="EMNLP_results/name_cloze/**/*.csv",
+                        help="Glob of name cloze result CSVs of all models")
+    args = parser.parse_args()
+
+    paths = sorted(path for path in glob.glob(args.results, recursive=True) if not path.endswith("_eval.csv"))
+    print(f"{len(paths)} result files, fuzz.ratio on {'python-Levenshtein (cdist)' if LEVENSHTEIN_RATIO else 'difflib'}")
+
+    batch, batch_time = score_files(paths, lambda df, col: batch_match_scores(df['Single_ent'].tolist(), df[col].tolist()))
+    row_wise, row_wise_time = score_files(paths, row_wise_scores)
+
+    mismatches = 0
+    for key, (exact_match, highest_fuzzy_score) in row_wise.items():
+        batch_exact_match, batch_highest_fuzzy_score = batch[key]
+        if not (np.array_equal(exact_match, batch_exact_match)
+                and np.array_equal(highest_fuzzy_score, batch_highest_fuzzy_score)):
+            mismatches += 1
+            print(f"Mismatch in {key[0]} ({key[1]})")
+    rows = sum(len(exact_match) for exact_match, _ in row_wise.values())
+    print(f"Parity: {mismatches} mismatching columns out of {len(row_wise)}")
+    print(f"{rows} rows: row-wise {row_wise_time:.2f}s, batch {batch_time:.2f}s "
+          f"({row_wise_time / batch_time if batch_time else float('inf'):.1f}x)")
+
+    sys.exit(1 if mismatches else 0)
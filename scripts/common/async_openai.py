@@ -0,0 +1,139 @@
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from common.backends import (Backend, _params_list, openai_request_body, chat_completion_to_completion, estimate_tokens,
+                             retry_delay)
+from common.dedup import DedupBackend
+from common.rate_limit import get_limiter
+from common.response_cache import DEFAULT_CACHE_PATH, CachedBackend, ResponseCache
+
+
+class AsyncOpenAIChatBackend(Backend):
+    """
+    OpenAI chat completions issued concurrently from an asyncio event loop.
+
+    At most `max_concurrency` requests are in flight, paced by `limiter` (the process-wide
+    "openai" common.rate_limit limiter by default) to the requests-per-minute and
+    tokens-per-minute limits reported in the x-ratelimit headers of every response. Rate
+    limited, timed out and 5xx requests are retried up to `max_retries` times after
+    Retry-After or a jittered exponential backoff, and a 429 holds back every request.
+    Completions come back in the order of the conversations. Callers already running an event
+    loop await generate_async or generate_settled_async.
+    """
+
+    name = "openai-async"
+
+    def __init__(self, model, max_concurrency=32, max_retries=8, base_delay=1.0, max_delay=60.0,
+                 base_url=None, api_key=None, timeout=120.0, limiter=None):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.limiter = limiter or get_limiter("openai")
+        self.retries = 0
+
+    def _make_client(self):
+        from openai import AsyncOpenAI
+        return AsyncOpenAI(
+            api_key=self.api_key or os.environ.get('OpenAI_API_KEY') or os.environ.get('OPENAI_API_KEY'),
+            base_url=self.base_url,
+            max_retries=0,
+            timeout=self.timeout,
+        )
+
+    async def _complete(self, client, semaphore, conversation, params):
+        import openai
+
+        body = openai_request_body(self.model, conversation, params)
+        tokens = estimate_tokens(conversation, params)
+        for attempt in range(self.max_retries + 1):
+            async with semaphore:
+                await self.limiter.acquire_async(tokens)
+                try:
+                    raw = await client.chat.completions.with_raw_response.create(**body)
+                    self.limiter.update_from_headers(raw.headers)
+                    self.limiter.on_success()
+                    return chat_completion_to_completion(raw.parse(), body, params)
+                except (openai.APIStatusError, openai.APIConnectionError) as e:
+                    delay = retry_delay(e, attempt, self.limiter, self.max_retries, self.base_delay, self.max_delay)
+                    if delay is None:
+                        raise
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    async def _run(self, conversations, params):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._make_client() as client:
+            return await asyncio.gather(
+                *[self._complete(client, semaphore, conversation, p) for conversation, p in zip(conversations, params)],
+                return_exceptions=True,
+            )
+
+    async def generate_settled_async(self, conversations, params):
+        """
+        generate_settled for callers already running an event loop.
+        """
+        return await self._run(conversations, _params_list(params, len(conversations)))
+
+    async def generate_async(self, conversations, params):
+        return _raise_failed(await self.generate_settled_async(conversations, params))
+
+    def generate_settled(self, conversations, params):
+        return run_sync(self.generate_settled_async(conversations, params))
+
+    def generate(self, conversations, params):
+        return _raise_failed(self.generate_settled(conversations, params))
+
+
+def _raise_failed(results):
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    return results
+
+
+def run_sync(coroutine):
+    """
+    Runs a coroutine to completion from synchronous code. Inside a running event loop (a notebook,
+    an async caller reaching a synchronous backend), which asyncio.run refuses, it runs on a loop
+    of its own in a worker thread.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+def make_openai_backend(model, cache_path=DEFAULT_CACHE_PATH, dedup=True, max_concurrency=32):
+    """
+    Backend of the OpenAI probing scripts: up to `max_concurrency` concurrent requests, paced by
+    the API's rate limit headers. With `dedup`, identical prompts of one call are sent once, and
+    with a `cache_path` prompts answered in an earlier run are served from that response cache.
+    """
+    backend = AsyncOpenAIChatBackend(model, max_concurrency=max_concurrency)
+    if dedup:
+        backend = DedupBackend(backend)
+    if cache_path:
+        backend = CachedBackend(backend, ResponseCache(cache_path), model)
+    return backend
+
+
+def backend_stats(backend, model):
+    """
+    Dedup savings and response cache hit rate of a backend built by make_openai_backend.
+    """
+    lines = []
+    while backend is not None:
+        if isinstance(backend, CachedBackend):
+            lines.append(backend.cache.stats())
+        elif isinstance(backend, DedupBackend):
+            lines.append(backend.stats.report(model))
+        backend = getattr(backend, "backend", None)
+    return "\n".join(reversed(lines))
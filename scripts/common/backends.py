@@ -0,0 +1,480 @@
+import os
+import re
+import copy
+import json
+import time
+import random
+import hashlib
+import itertools
+from collections import namedtuple
+
+from common.rate_limit import get_limiter, retry_after
+
+# An inference backend turns chat conversations (lists of {"role", "content"} messages) into
+# completions. Task modules only build conversations and parse completions, so the same task
+# logic runs on vLLM, the OpenAI chat or batch APIs, or the deterministic CPU-only backends.
+
+Completion = namedtuple("Completion", ["text", "prompt_tokens", "generated_tokens", "cached_tokens"])
+
+_request_ids = itertools.count()
+
+
+class SamplingParams:
+    """
+    Backend independent sampling settings, converted by each backend to its own request format.
+    """
+
+    def __init__(self, temperature=1.0, top_p=1.0, max_tokens=16, stop=None, include_stop_str_in_output=False):
+        self.temperature = temperature
+        self.top_p = top_p
+        self.max_tokens = max_tokens
+        self.stop = list(stop or [])
+        self.include_stop_str_in_output = include_stop_str_in_output
+
+    def clone(self):
+        return copy.deepcopy(self)
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+def closing_tag_params(closing_tag, max_tokens):
+    """
+    Greedy SamplingParams of the probing tasks. Generation stops at `closing_tag`, which is kept so
+    the raw output still parses downstream; being a single closing tag, it is also sent as the stop
+    string of the OpenAI backends, which cut it off and have restore_stop_string put it back.
+    """
+    return SamplingParams(temperature=0.0, top_p=1.0, max_tokens=max_tokens, stop=[closing_tag],
+                          include_stop_str_in_output=True)
+
+
+def _params_list(params, n):
+    return params if isinstance(params, (list, tuple)) else [params] * n
+
+
+class Backend:
+    """
+    Protocol every backend follows: generate(conversations, params) -> [Completion], where params
+    is one SamplingParams for all conversations or a list with one per conversation.
+    """
+
+    name = "backend"
+    # False for the CPU stubs, whose completions must never be stored as a real model's answers
+    cacheable = True
+
+    def generate(self, conversations, params):
+        raise NotImplementedError
+
+    def stream(self, items, max_in_flight=1024):
+        """
+        Yields (tag, Completion) for every (conversation, params, tag) in items. Backends without
+        request-level streaming generate up to max_in_flight items at a time.
+        """
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= max_in_flight:
+                yield from self._generate_tagged(batch)
+                batch = []
+        if batch:
+            yield from self._generate_tagged(batch)
+
+    def generate_settled(self, conversations, params):
+        """
+        Like generate, but a conversation whose request fails gives its exception in place of a
+        Completion instead of failing the whole call.
+        """
+        results = []
+        for conversation, p in zip(conversations, _params_list(params, len(conversations))):
+            try:
+                results.append(self.generate([conversation], [p])[0])
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def _generate_tagged(self, batch):
+        conversations, params, tags = zip(*batch)
+        yield from zip(tags, self.generate(list(conversations), list(params)))
+
+
+class VLLMBackend(Backend):
+    """
+    Runs a vllm.LLM. Conversations are rendered with the model's chat template, or with a
+    `prompt_cache` (common.prompt_cache.PromptTokenCache) fetched as pre-tokenized prompt ids.
+    """
+
+    name = "vllm"
+
+    def __init__(self, llm, prompt_cache=None):
+        self.llm = llm
+        self.tokenizer = llm.get_tokenizer()
+        self.prompt_cache = prompt_cache
+        self._vllm_params = {}
+
+    @classmethod
+    def from_model(cls, model, prompt_cache_path=None, **llm_kwargs):
+        from vllm import LLM
+        llm = LLM(model=model, **llm_kwargs)
+        prompt_cache = None
+        if prompt_cache_path:
+            from common.prompt_cache import PromptTokenCache
+            os.makedirs(os.path.dirname(prompt_cache_path) or ".", exist_ok=True)
+            prompt_cache = PromptTokenCache(prompt_cache_path, llm.get_tokenizer())
+        return cls(llm, prompt_cache)
+
+    def render(self, conversations):
+        if self.prompt_cache is not None:
+            return [{"prompt_token_ids": token_ids} for token_ids in self.prompt_cache.compile(conversations)]
+        return self.tokenizer.apply_chat_template(conversations, tokenize=False, add_generation_prompt=True)
+
+    def to_vllm_params(self, params):
+        key = json.dumps(params.as_dict(), sort_keys=True)
+        if key not in self._vllm_params:
+            from vllm import SamplingParams as VLLMSamplingParams
+            self._vllm_params[key] = VLLMSamplingParams(**params.as_dict())
+        return self._vllm_params[key]
+
+    @staticmethod
+    def to_completion(output):
+        return Completion(
+            output.outputs[0].text,
+            len(output.prompt_token_ids),
+            len(output.outputs[0].token_ids),
+            getattr(output, "num_cached_tokens", None),
+        )
+
+    def generate(self, conversations, params):
+        prompts = self.render(conversations)
+        vllm_params = [self.to_vllm_params(p) for p in _params_list(params, len(prompts))]
+        outputs = self.llm.generate(prompts, vllm_params, use_tqdm=False)
+        return [self.to_completion(output) for output in outputs]
+
+    def stream(self, items, max_in_flight=1024):
+        """
+        Feeds the engine through its request-level API, keeping at most max_in_flight requests
+        queued, and yields each result as soon as its request finishes.
+        """
+        engine = self.llm.llm_engine
+        items = iter(items)
+        in_flight = {}
+        exhausted = False
+
+        while True:
+            while not exhausted and len(in_flight) < max_in_flight:
+                try:
+                    conversation, params, tag = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                request_id = str(next(_request_ids))
+                engine.add_request(request_id, self.render([conversation])[0], self.to_vllm_params(params))
+                in_flight[request_id] = tag
+
+            if not in_flight:
+                return
+
+            for output in engine.step():
+                if output.finished:
+                    yield in_flight.pop(output.request_id), self.to_completion(output)
+
+
+def _openai_client(client):
+    if client is not None:
+        return client
+    from openai import OpenAI
+    # retries go through create_chat_completion, which reports rate limits to the shared limiter
+    return OpenAI(api_key=os.environ.get('OpenAI_API_KEY') or os.environ.get('OPENAI_API_KEY'), max_retries=0)
+
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=60.0):
+    return min(max_delay, base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def retry_delay(error, attempt, limiter, max_retries, base_delay=1.0, max_delay=60.0):
+    """
+    Seconds to wait before retrying an OpenAI request that failed with `error` on try `attempt`,
+    or None when it is not retried. Rate limited, timed out and 5xx requests are retried after
+    Retry-After or a jittered exponential backoff, and a 429 holds back every caller of `limiter`.
+    """
+    status = getattr(error, "status_code", None)
+    if status is None:
+        import openai
+        if not isinstance(error, openai.APIConnectionError) or attempt == max_retries:
+            return None
+        return backoff_delay(attempt, base_delay, max_delay)
+
+    headers = error.response.headers
+    limiter.update_from_headers(headers)
+    if status not in RETRYABLE_STATUS or attempt == max_retries:
+        return None
+    delay = retry_after(headers) or backoff_delay(attempt, base_delay, max_delay)
+    if status == 429:
+        # hold back every request, not only this one, until the limit resets
+        limiter.on_rate_limited(delay)
+    return delay
+
+
+def create_chat_completion(client, body, tokens, limiter, max_retries=8, base_delay=1.0, max_delay=60.0):
+    """
+    Sends a chat completions request body paced by `limiter`, retrying it as retry_delay says,
+    and returns the parsed ChatCompletion.
+    """
+    for attempt in range(max_retries + 1):
+        limiter.acquire(tokens)
+        try:
+            raw = client.chat.completions.with_raw_response.create(**body)
+        except Exception as e:
+            delay = retry_delay(e, attempt, limiter, max_retries, base_delay, max_delay)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            continue
+        limiter.update_from_headers(raw.headers)
+        limiter.on_success()
+        return raw.parse()
+
+
+def openai_request_body(model, conversation, params):
+    """
+    Chat completions request body for one conversation. The API never returns the stop string
+    itself, so a stop string kept in the output is only sent when it is a single closing tag,
+    which restore_stop_string can put back.
+    """
+    body = {
+        "model": model,
+        "messages": conversation,
+        "max_tokens": params.max_tokens,
+        "temperature": params.temperature,
+        "top_p": params.top_p,
+    }
+    if params.stop and (not params.include_stop_str_in_output
+                        or (len(params.stop) == 1 and _CLOSING_TAG.fullmatch(params.stop[0]))):
+        body["stop"] = params.stop
+    return body
+
+
+_CLOSING_TAG = re.compile(r"</([a-zA-Z][\w-]*)>")
+
+
+def restore_stop_string(text, finish_reason, body, params):
+    """
+    Puts back the closing tag the API cut off. finish_reason "stop" is also returned when the
+    model ended on its own, so the tag is only appended when the text has an opening tag it
+    would close.
+    """
+    if text is None or finish_reason != "stop" or "stop" not in body or not params.include_stop_str_in_output:
+        return text
+    tag = _CLOSING_TAG.fullmatch(params.stop[0]).group(1)
+    if re.search(rf"<{re.escape(tag)}(?:\s[^>]*)?>", text, re.IGNORECASE):
+        return text + params.stop[0]
+    return text
+
+
+def estimate_tokens(conversation, params):
+    """
+    Tokens a request counts against the tokens-per-minute limit: about 4 characters per prompt
+    token, plus max_tokens, which OpenAI reserves up front.
+    """
+    return sum(len(message["content"]) for message in conversation) // 4 + params.max_tokens
+
+
+def chat_completion_to_completion(completion, body, params):
+    choice = completion.choices[0]
+    usage = completion.usage
+    details = getattr(usage, "prompt_tokens_details", None)
+    return Completion(
+        restore_stop_string(choice.message.content, choice.finish_reason, body, params),
+        usage.prompt_tokens if usage else 0,
+        usage.completion_tokens if usage else 0,
+        getattr(details, "cached_tokens", None),
+    )
+
+
+class OpenAIChatBackend(Backend):
+    """
+    Synchronous OpenAI chat completions, one request per conversation, paced by `limiter`
+    (the process-wide "openai" limiter by default) and retried up to `max_retries` times.
+    """
+
+    name = "openai-chat"
+
+    def __init__(self, model, client=None, limiter=None, max_retries=8):
+        self.model = model
+        self._client = client
+        self.limiter = limiter or get_limiter("openai")
+        self.max_retries = max_retries
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = _openai_client(None)
+        return self._client
+
+    def complete(self, conversation, params):
+        body = openai_request_body(self.model, conversation, params)
+        completion = create_chat_completion(self.client, body, estimate_tokens(conversation, params), self.limiter,
+                                            self.max_retries)
+        return chat_completion_to_completion(completion, body, params)
+
+    def generate(self, conversations, params):
+        return [self.complete(conversation, p) for conversation, p in zip(conversations, _params_list(params, len(conversations)))]
+
+
+class OpenAIBatchBackend(Backend):
+    """
+    OpenAI Batch API: all conversations of a generate call go into one batch, which is polled
+    until it completes. Failed requests come back with text None.
+    """
+
+    name = "openai-batch"
+
+    def __init__(self, model, client=None, work_dir="batches", poll_interval=30, completion_window="24h"):
+        self.model = model
+        self._client = client
+        self.work_dir = work_dir
+        self.poll_interval = poll_interval
+        self.completion_window = completion_window
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = _openai_client(None)
+        return self._client
+
+    def generate(self, conversations, params):
+        params = _params_list(params, len(conversations))
+        bodies = [openai_request_body(self.model, conversation, p) for conversation, p in zip(conversations, params)]
+
+        os.makedirs(self.work_dir, exist_ok=True)
+        jsonl_file_path = os.path.join(self.work_dir, f"batch_input_{int(time.time() * 1000)}.jsonl")
+        with open(jsonl_file_path, "w", encoding="utf-8") as f:
+            for i, body in enumerate(bodies):
+                f.write(json.dumps({"custom_id": f"request_{i}", "method": "POST", "url": "/v1/chat/completions", "body": body}) + "\n")
+
+        with open(jsonl_file_path, "rb") as f:
+            input_file_id = self.client.files.create(file=f, purpose="batch").id
+        batch = self.client.batches.create(input_file_id=input_file_id, endpoint="/v1/chat/completions",
+                                           completion_window=self.completion_window)
+        print(f"Created batch {batch.id} with {len(bodies)} requests")
+
+        while batch.status not in ["completed", "failed", "expired", "cancelled"]:
+            time.sleep(self.poll_interval)
+            batch = self.client.batches.retrieve(batch.id)
+            print(f"Batch {batch.id} status: {batch.status}")
+        if batch.status != "completed":
+            raise Exception(f"Batch {batch.id} {batch.status}")
+
+        completions = [Completion(None, 0, 0, None)] * len(bodies)
+        for line in self.client.files.content(batch.output_file_id).text.splitlines():
+            response_data = json.loads(line)
+            i = int(response_data["custom_id"].split("_")[-1])
+            if response_data.get("error"):
+                continue
+            body = response_data["response"]["body"]
+            choice = body["choices"][0]
+            usage = body.get("usage", {})
+            completions[i] = Completion(
+                restore_stop_string(choice["message"]["content"], choice.get("finish_reason"), bodies[i], params[i]),
+                usage.get("prompt_tokens", 0),
+                usage.get("completion_tokens", 0),
+                usage.get("prompt_tokens_details", {}).get("cached_tokens"),
+            )
+        return completions
+
+
+_PASSAGE = re.compile(r"<passage>(.*?)</passage>", re.DOTALL)
+
+
+def _count_tokens(conversation):
+    return sum(len(message["content"].split()) for message in conversation)
+
+
+class EchoBackend(Backend):
+    """
+    Deterministic CPU-only backend: the completion is the first max_tokens words of the last
+    <passage> in the conversation, with stop strings applied like vLLM does.
+    """
+
+    name = "echo"
+    cacheable = False
+
+    def complete(self, conversation, params):
+        passages = _PASSAGE.findall(conversation[-1]["content"])
+        text = " ".join((passages[-1].split() if passages else [])[:params.max_tokens])
+        for stop in params.stop:
+            index = text.find(stop)
+            if index != -1:
+                text = text[:index + len(stop)] if params.include_stop_str_in_output else text[:index]
+        return Completion(text, _count_tokens(conversation), len(text.split()), None)
+
+    def generate(self, conversations, params):
+        return [self.complete(conversation, p) for conversation, p in zip(conversations, _params_list(params, len(conversations)))]
+
+
+def replay_key(conversation, params):
+    return hashlib.sha256(json.dumps([conversation, params.as_dict()], sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class ReplayBackend(Backend):
+    """
+    Replays completions recorded in a JSONL file, keyed by the conversation and sampling params.
+    With a `fallback` backend, conversations missing from the file are generated by it and
+    appended, so a first run records and later runs replay.
+    """
+
+    name = "replay"
+    cacheable = False
+
+    def __init__(self, path, fallback=None):
+        self.path = path
+        self.fallback = fallback
+        self.recorded = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.recorded[entry["key"]] = Completion(*entry["completion"])
+
+    def generate(self, conversations, params):
+        params = _params_list(params, len(conversations))
+        keys = [replay_key(conversation, p) for conversation, p in zip(conversations, params)]
+
+        missing = [i for i, key in enumerate(keys) if key not in self.recorded]
+        if missing:
+            if self.fallback is None:
+                raise KeyError(f"{len(missing)} conversations are not recorded in {self.path}")
+            generated = self.fallback.generate([conversations[i] for i in missing], [params[i] for i in missing])
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                for i, completion in zip(missing, generated):
+                    self.recorded[keys[i]] = completion
+                    f.write(json.dumps({"key": keys[i], "completion": list(completion)}, ensure_ascii=False) + "\n")
+
+        return [self.recorded[key] for key in keys]
+
+
+BACKENDS = ["vllm", "openai-chat", "openai-async", "openai-batch", "echo", "replay"]
+
+
+def make_backend(name, model, replay_path=None, prompt_cache_path=None, **vllm_kwargs):
+    """
+    Builds a backend by name. `replay` replays `replay_path` and records misses with the echo backend.
+    `prompt_cache_path` is the pre-tokenized prompt cache of the vLLM backend, None disables it.
+    """
+    if name == "vllm":
+        return VLLMBackend.from_model(model, prompt_cache_path, **vllm_kwargs)
+    if name == "openai-chat":
+        return OpenAIChatBackend(model)
+    if name == "openai-async":
+        from common.async_openai import AsyncOpenAIChatBackend
+        return AsyncOpenAIChatBackend(model)
+    if name == "openai-batch":
+        return OpenAIBatchBackend(model)
+    if name == "echo":
+        return EchoBackend()
+    if name == "replay":
+        return ReplayBackend(replay_path, fallback=EchoBackend())
+    raise ValueError(f"Unknown backend {name}")
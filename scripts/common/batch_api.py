@@ -0,0 +1,644 @@
+import os
+import json
+import time
+import sqlite3
+from collections import namedtuple
+
+from common.backends import Completion, SamplingParams, create_chat_completion, estimate_tokens
+from common.rate_limit import get_limiter
+from common.dedup import DedupStats, batch_request_tokens
+from common.response_cache import request_key
+from common.result_sink import BATCH_RESULT_SCHEMA, ParquetResultSink, read_batch_results
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# OpenAI Batch API limits of a single input file, the byte limit keeps a little headroom
+MAX_REQUESTS_PER_BATCH = 50_000
+MAX_BATCH_FILE_BYTES = 190 * 1024 * 1024
+
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+# result files are streamed in chunks of this many bytes instead of being read whole
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+
+# failed or missing requests are retried in follow-up rounds, synchronously when there are few
+MAX_RETRY_ROUNDS = 3
+SYNC_RETRY_LIMIT = 50
+
+# requests_path is the book's full request file, shard_path the part of it a batch was sent
+BatchShard = namedtuple("BatchShard", ["book_name", "csv_file", "shard_path", "input_file_id", "batch_id", "requests_path"])
+
+
+def split_jsonl(jsonl_file_path, max_requests=MAX_REQUESTS_PER_BATCH, max_bytes=MAX_BATCH_FILE_BYTES):
+    """
+    Splits a batch input file into shards that each respect the Batch API request and size limits.
+    Returns [jsonl_file_path] when the file already fits, otherwise the paths of the
+    <name>_part<i>.jsonl shards written next to it.
+    """
+    with open(jsonl_file_path, "rb") as f:
+        line_count = sum(1 for _ in f)
+    if line_count <= max_requests and os.path.getsize(jsonl_file_path) <= max_bytes:
+        return [jsonl_file_path]
+
+    base, ext = os.path.splitext(jsonl_file_path)
+    shard_paths = []
+    shard = None
+    with open(jsonl_file_path, "rb") as f:
+        for line in f:
+            if shard is None or shard_lines >= max_requests or shard_bytes + len(line) > max_bytes:
+                if shard is not None:
+                    shard.close()
+                shard_paths.append(f"{base}_part{len(shard_paths)}{ext}")
+                shard = open(shard_paths[-1], "wb")
+                shard_lines = shard_bytes = 0
+            shard.write(line)
+            shard_lines += 1
+            shard_bytes += len(line)
+    shard.close()
+    return shard_paths
+
+
+def upload_file(client, jsonl_file_path):
+    with open(jsonl_file_path, "rb") as f:
+        return client.files.create(file=f, purpose="batch").id
+
+
+def create_batch(client, input_file_id, completion_window="24h"):
+    batch = client.batches.create(
+        input_file_id=input_file_id,
+        endpoint="/v1/chat/completions",
+        completion_window=completion_window
+    )
+    return batch.id
+
+
+class BatchLedger:
+    """
+    On-disk record of every submitted batch in SQLite: source CSV, shard file, input file id,
+    batch id, status and output/error file ids, plus the custom_ids each batch carries.
+    Requests left out as duplicates are recorded as aliases of the (batch, custom_id) that
+    answers them, with their book, so a resumed run fans the answers out again.
+    Lets a run that died during the completion window be resumed without resubmitting.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS batches (batch_id TEXT PRIMARY KEY, book_name TEXT, csv_file TEXT, "
+            "shard_path TEXT, input_file_id TEXT, status TEXT, output_file_id TEXT, error_file_id TEXT, "
+            "merged INTEGER NOT NULL DEFAULT 0, updated_at REAL, requests_path TEXT)"
+        )
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(batches)")]
+        if "requests_path" not in columns:
+            self.conn.execute("ALTER TABLE batches ADD COLUMN requests_path TEXT")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS requests (csv_file TEXT, custom_id TEXT, batch_id TEXT, "
+            "owner_custom_id TEXT, book_name TEXT, requests_path TEXT, merged INTEGER NOT NULL DEFAULT 0, "
+            "PRIMARY KEY (csv_file, custom_id))"
+        )
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(requests)")]
+        for column, definition in [("owner_custom_id", "TEXT"), ("book_name", "TEXT"), ("requests_path", "TEXT"),
+                                   ("merged", "INTEGER NOT NULL DEFAULT 0")]:
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE requests ADD COLUMN {column} {definition}")
+        self.conn.commit()
+
+    def record(self, shard, custom_ids):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO batches (batch_id, book_name, csv_file, shard_path, input_file_id, requests_path, "
+            "status, updated_at) VALUES (?, ?, ?, ?, ?, ?, 'submitted', ?)",
+            (shard.batch_id, shard.book_name, shard.csv_file, shard.shard_path, shard.input_file_id,
+             shard.requests_path, time.time()),
+        )
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO requests (csv_file, custom_id, batch_id) VALUES (?, ?, ?)",
+            [(shard.csv_file, custom_id, shard.batch_id) for custom_id in custom_ids],
+        )
+        self.conn.commit()
+
+    def record_aliases(self, book_name, csv_file, requests_path, aliases):
+        """
+        Records {custom_id: (batch_id, owner custom_id)} of the requests of a book that were not sent
+        because an identical request went out in that batch.
+        """
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO requests (csv_file, custom_id, batch_id, owner_custom_id, book_name, requests_path) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(csv_file, custom_id, batch_id, owner_custom_id, book_name, requests_path)
+             for custom_id, (batch_id, owner_custom_id) in aliases.items()],
+        )
+        self.conn.commit()
+
+    def update(self, batch):
+        self.conn.execute(
+            "UPDATE batches SET status = ?, output_file_id = ?, error_file_id = ?, updated_at = ? WHERE batch_id = ?",
+            (batch.status, batch.output_file_id, batch.error_file_id, time.time(), batch.id),
+        )
+        self.conn.commit()
+
+    def mark_merged(self, csv_file):
+        self.conn.execute("UPDATE batches SET merged = 1, updated_at = ? WHERE csv_file = ?", (time.time(), csv_file))
+        self.conn.execute("UPDATE requests SET merged = 1 WHERE csv_file = ?", (csv_file,))
+        self.conn.commit()
+
+    def unmerged(self):
+        """
+        Shards of every book that has not been merged yet.
+        """
+        rows = self.conn.execute(
+            "SELECT book_name, csv_file, shard_path, input_file_id, batch_id, COALESCE(requests_path, shard_path) "
+            "FROM batches WHERE merged = 0 ORDER BY rowid"
+        )
+        return [BatchShard(*row) for row in rows]
+
+    def unmerged_aliases(self):
+        """
+        Aliases of every book that has not been merged yet, as track_batches takes them:
+        ({csv_file: {custom_id: (batch_id, owner custom_id)}}, {csv_file: (book_name, requests_path)}).
+        """
+        aliases = {}
+        books = {}
+        rows = self.conn.execute(
+            "SELECT csv_file, custom_id, batch_id, owner_custom_id, book_name, requests_path FROM requests "
+            "WHERE owner_custom_id IS NOT NULL AND merged = 0"
+        )
+        for csv_file, custom_id, batch_id, owner_custom_id, book_name, requests_path in rows:
+            aliases.setdefault(csv_file, {})[custom_id] = (batch_id, owner_custom_id)
+            books[csv_file] = (book_name, requests_path)
+        return aliases, books
+
+    def shards(self, batch_ids):
+        """
+        Shards of the given batches, merged or not.
+        """
+        batch_ids = list(batch_ids)
+        rows = self.conn.execute(
+            "SELECT book_name, csv_file, shard_path, input_file_id, batch_id, COALESCE(requests_path, shard_path) "
+            f"FROM batches WHERE batch_id IN ({','.join('?' * len(batch_ids))})", batch_ids
+        )
+        return [BatchShard(*row) for row in rows]
+
+    def custom_ids(self, csv_file):
+        rows = self.conn.execute("SELECT custom_id, batch_id FROM requests WHERE csv_file = ? AND owner_custom_id IS NULL",
+                                 (csv_file,))
+        return dict(rows.fetchall())
+
+    def close(self):
+        self.conn.close()
+
+
+def read_custom_ids(jsonl_file_path):
+    with open(jsonl_file_path, "rb") as f:
+        return [json.loads(line)["custom_id"] for line in f if line.strip()]
+
+
+def submit_book(client, book_name, csv_file, jsonl_file_path, ledger=None, requests_path=None):
+    """
+    Shards a book's request file, uploads every shard and creates one batch per shard,
+    recording each batch in the ledger as soon as it exists. `requests_path` is the book's full
+    request file when `jsonl_file_path` only holds some of its requests.
+    """
+    shards = []
+    for shard_path in split_jsonl(jsonl_file_path):
+        input_file_id = upload_file(client, shard_path)
+        batch_id = create_batch(client, input_file_id)
+        print(f"Created batch {batch_id} for {book_name} from {shard_path}")
+        shard = BatchShard(book_name, csv_file, shard_path, input_file_id, batch_id, requests_path or jsonl_file_path)
+        if ledger is not None:
+            ledger.record(shard, read_custom_ids(shard_path))
+        shards.append(shard)
+    return shards
+
+
+def iter_file_lines(client, file_id, chunk_size=DOWNLOAD_CHUNK_BYTES):
+    """
+    Streams a file from the Files API and yields its non-empty lines as bytes, holding at most
+    one chunk and one partial line in memory.
+    """
+    with client.files.with_streaming_response.content(file_id) as response:
+        partial = b""
+        for chunk in response.iter_bytes(chunk_size):
+            lines = (partial + chunk).split(b"\n")
+            partial = lines.pop()
+            for line in lines:
+                if line.strip():
+                    yield line
+        if partial.strip():
+            yield partial
+
+
+def _error_code(response_data):
+    error = response_data.get("error") or ((response_data.get("response") or {}).get("body") or {}).get("error")
+    if not error:
+        return None
+    return error.get("code") or error.get("message") or "unknown"
+
+
+def parse_result_line(line):
+    """
+    (custom_id, response content, error code) of one line of a batch output or error file.
+    """
+    response_data = _loads(line)
+    error = _error_code(response_data)
+    if error or response_data.get("error"):
+        return response_data.get("custom_id"), None, error or "unknown"
+    content = response_data["response"]["body"]["choices"][0]["message"]["content"]
+    return response_data.get("custom_id"), content, None
+
+
+def download_results(client, batch, store_path=None):
+    """
+    Streams the output file of a finished batch and returns {custom_id: response content},
+    with None for requests that came back with an error.
+
+    With `store_path` the parsed rows are also written, as they arrive, to a Parquet file keyed by
+    custom_id, and later calls (a resumed run) read that file instead of downloading again.
+    """
+    if store_path and os.path.exists(store_path):
+        return read_batch_results(store_path)
+    results = {}
+    if not batch.output_file_id:
+        return results
+
+    sink = ParquetResultSink(store_path + ".tmp", schema=BATCH_RESULT_SCHEMA) if store_path else None
+    for line in iter_file_lines(client, batch.output_file_id):
+        custom_id, content, error = parse_result_line(line)
+        results[custom_id] = content
+        if sink is not None:
+            sink.write(custom_id, content, error)
+    if sink is not None:
+        sink.close()
+        os.replace(sink.path, store_path)
+    return results
+
+
+def download_errors(client, batch):
+    """
+    Returns {custom_id: error code} from the error file of a finished batch.
+    """
+    errors = {}
+    if not getattr(batch, "error_file_id", None):
+        return errors
+    for line in iter_file_lines(client, batch.error_file_id):
+        custom_id, _, error = parse_result_line(line)
+        errors[custom_id] = error
+    return errors
+
+
+def read_requests(jsonl_file_paths, custom_ids=None):
+    """
+    The request objects of `custom_ids` (all of them when None), read back from the batch input
+    files that carried them.
+    """
+    requests_list = {}
+    for jsonl_file_path in jsonl_file_paths:
+        with open(jsonl_file_path, "rb") as f:
+            for line in f:
+                if line.strip():
+                    request = json.loads(line)
+                    if custom_ids is None or request["custom_id"] in custom_ids:
+                        requests_list.setdefault(request["custom_id"], request)
+    return list(requests_list.values())
+
+
+def complete_synchronously(client, requests_list, limiter=None):
+    """
+    Sends a handful of batch requests straight to the chat completions endpoint, paced by the
+    shared "openai" limiter and retried like every other OpenAI request, and returns
+    {custom_id: response content} for the ones that succeed. A request the API rejects as
+    invalid (400) is left out, any other error that outlasts the retries is raised.
+    """
+    limiter = limiter or get_limiter("openai")
+    # the retries are create_chat_completion's, which report rate limits to the limiter
+    client = client.with_options(max_retries=0)
+    results = {}
+    for request in requests_list:
+        body = request["body"]
+        tokens = estimate_tokens(body["messages"], SamplingParams(max_tokens=body.get("max_tokens") or 0))
+        try:
+            response = create_chat_completion(client, body, tokens, limiter)
+        except Exception as e:
+            if getattr(e, "status_code", None) != 400:
+                raise
+            print(f"Error retrying {request['custom_id']}: {e}")
+            continue
+        results[request["custom_id"]] = response.choices[0].message.content
+    return results
+
+
+def write_retry_file(shard_path, requests_list, retry_round):
+    base, ext = os.path.splitext(shard_path)
+    base = base.split("_retry")[0]
+    retry_path = f"{base}_retry{retry_round}{ext}"
+    with open(retry_path, "w", encoding="utf-8") as f:
+        for request in requests_list:
+            f.write(json.dumps(request) + "\n")
+    return retry_path
+
+
+def merge_results(results, new_results):
+    """
+    Adds `new_results` without letting a failed (None) answer overwrite a successful one.
+    """
+    for custom_id, content in new_results.items():
+        if content is not None or custom_id not in results:
+            results[custom_id] = content
+
+
+def cached_results(cache, requests_list):
+    """
+    {custom_id: response content} of the requests whose responses are in the response cache.
+    """
+    keys = {request["custom_id"]: request_key(request) for request in requests_list}
+    cached = cache.get_many(list(keys.values()))
+    return {custom_id: cached[key].text for custom_id, key in keys.items() if key in cached}
+
+
+def store_results(cache, requests_list, results):
+    """
+    Adds the answers of `requests_list` to the response cache. Their token counts are stored as 0,
+    since the merged results only keep each response's text.
+    """
+    cache.put_many([
+        (request_key(request), Completion(results[request["custom_id"]], 0, 0, None))
+        for request in requests_list if results.get(request["custom_id"]) is not None
+    ])
+
+
+def poll_batches(client, batch_ids, on_finished, poll_interval=10, max_poll_interval=300, backoff=2.0):
+    """
+    Polls every outstanding batch in one loop and calls on_finished(batch) as soon as each reaches
+    a terminal status; any batch ids it returns are polled too. The wait between rounds grows by
+    `backoff` up to `max_poll_interval` while nothing finishes, and drops back to `poll_interval`
+    when something does.
+    """
+    outstanding = set(batch_ids)
+    interval = poll_interval
+    while outstanding:
+        finished_any = False
+        statuses = {}
+        for batch_id in sorted(outstanding):
+            try:
+                batch = client.batches.retrieve(batch_id)
+            except Exception as e:
+                print(f"Error polling batch {batch_id}: {e}")
+                continue
+            statuses[batch.status] = statuses.get(batch.status, 0) + 1
+            if batch.status in TERMINAL_STATUSES:
+                outstanding.discard(batch_id)
+                finished_any = True
+                outstanding.update(on_finished(batch) or [])
+
+        if outstanding:
+            interval = poll_interval if finished_any else min(max_poll_interval, interval * backoff)
+            print(f"{len(outstanding)} batches outstanding ({statuses}), next poll in {interval:.0f}s")
+            time.sleep(interval)
+
+
+def track_batches(client, shards, merge, ledger=None, cache=None, aliases=None, books=None,
+                  max_retry_rounds=MAX_RETRY_ROUNDS, sync_retry_limit=SYNC_RETRY_LIMIT, **poll_kwargs):
+    """
+    Polls the batches of `shards` together and calls merge(book_name, csv_file, results) for each
+    book as soon as all of its shards have finished, so wall-clock time follows the slowest batch.
+
+    Before merging, requests of the book that failed or are missing from the output are retried:
+    up to `sync_retry_limit` of them directly against the chat completions endpoint, more in a
+    follow-up batch holding only those requests, for at most `max_retry_rounds` rounds.
+    With a response `cache`, requests left out of the batches because they were cached are
+    answered from it, and the new answers are added to it.
+
+    `aliases` maps a csv_file to {custom_id: (batch_id, custom_id)} for requests that were not
+    sent because an identical request went out in that batch; the book also waits for it.
+    `books` maps the csv_file of books without shards of their own to (book_name, requests_path).
+    A batch answering aliases whose own book was already merged (before a resume) is looked up
+    in the ledger and polled again, without merging its book a second time.
+    """
+    shard_by_batch = {shard.batch_id: shard for shard in shards}
+    book_names = {}
+    requests_paths = {}
+    pending = {}
+    for shard in shards:
+        book_names[shard.csv_file] = shard.book_name
+        requests_paths[shard.csv_file] = shard.requests_path
+        pending.setdefault(shard.csv_file, set()).add(shard.batch_id)
+    for csv_file, (book_name, requests_path) in (books or {}).items():
+        book_names.setdefault(csv_file, book_name)
+        requests_paths.setdefault(csv_file, requests_path)
+        pending.setdefault(csv_file, set())
+    source_batch_ids = {batch_id for book_aliases in (aliases or {}).values() for batch_id, _ in book_aliases.values()}
+    if ledger is not None and source_batch_ids - set(shard_by_batch):
+        for shard in ledger.shards(source_batch_ids - set(shard_by_batch)):
+            shard_by_batch[shard.batch_id] = shard
+    waiting = {}
+    for csv_file, book_aliases in (aliases or {}).items():
+        for custom_id, (batch_id, owner_custom_id) in book_aliases.items():
+            if batch_id not in shard_by_batch:
+                # the batch is unknown, so the book does not wait for it and the request is
+                # retried with the book's other missing ones
+                continue
+            waiting.setdefault(batch_id, []).append((csv_file, custom_id, owner_custom_id))
+            pending[csv_file].add(batch_id)
+    results = {csv_file: {} for csv_file in pending}
+    retry_rounds = {csv_file: 0 for csv_file in pending}
+
+    def missing_requests(csv_file):
+        answered = {custom_id for custom_id, content in results[csv_file].items() if content is not None}
+        return set(read_custom_ids(requests_paths[csv_file])) - answered
+
+    def retry(csv_file):
+        """
+        Retries what the book is still missing, returns the ids of the follow-up batches it submitted.
+        """
+        if cache is not None:
+            merge_results(results[csv_file],
+                          cached_results(cache, read_requests([requests_paths[csv_file]], missing_requests(csv_file))))
+        while retry_rounds[csv_file] < max_retry_rounds:
+            missing = missing_requests(csv_file)
+            if not missing:
+                return []
+            retry_rounds[csv_file] += 1
+            requests_list = read_requests([requests_paths[csv_file]], missing)
+            print(f"Retrying {len(requests_list)} failed or missing requests of {book_names[csv_file]} "
+                  f"(round {retry_rounds[csv_file]})")
+            if len(requests_list) <= sync_retry_limit:
+                merge_results(results[csv_file], complete_synchronously(client, requests_list))
+                continue
+
+            retry_path = write_retry_file(requests_paths[csv_file], requests_list, retry_rounds[csv_file])
+            retry_shards = submit_book(client, book_names[csv_file], csv_file, retry_path, ledger, requests_paths[csv_file])
+            for retry_shard in retry_shards:
+                shard_by_batch[retry_shard.batch_id] = retry_shard
+                pending[csv_file].add(retry_shard.batch_id)
+            return [retry_shard.batch_id for retry_shard in retry_shards]
+        return []
+
+    def finish_book(csv_file):
+        book_name = book_names[csv_file]
+        try:
+            retry_batch_ids = retry(csv_file)
+        except Exception as e:
+            print(f"Error retrying {book_name}: {e}")
+            retry_batch_ids = []
+        if retry_batch_ids:
+            return retry_batch_ids
+
+        missing = missing_requests(csv_file)
+        if missing:
+            print(f"{book_name} still has {len(missing)} requests without an answer")
+        if cache is not None:
+            store_results(cache, read_requests([requests_paths[csv_file]], set(results[csv_file])), results[csv_file])
+        try:
+            merge(book_name, csv_file, results.pop(csv_file))
+            if ledger is not None:
+                ledger.mark_merged(csv_file)
+        except Exception as e:
+            print(f"Error merging {book_name}: {e}")
+        return []
+
+    def on_finished(batch):
+        shard = shard_by_batch[batch.id]
+        if ledger is not None:
+            ledger.update(batch)
+        if batch.status != "completed":
+            print(f"Batch {batch.id} for {shard.book_name} {batch.status}, merging what it returned")
+        batch_results = {}
+        try:
+            store_path = os.path.join(os.path.dirname(shard.shard_path), f"{batch.id}_output.parquet")
+            batch_results = download_results(client, batch, store_path)
+            if shard.csv_file in results:
+                merge_results(results[shard.csv_file], batch_results)
+            errors = download_errors(client, batch)
+            if errors:
+                codes = {}
+                for code in errors.values():
+                    codes[code] = codes.get(code, 0) + 1
+                print(f"Batch {batch.id} for {shard.book_name} has {len(errors)} failed requests: {codes}")
+        except Exception as e:
+            print(f"Error downloading batch {batch.id}: {e}")
+
+        # fan the answers out to the identical requests of other books and rows
+        for csv_file, custom_id, owner_custom_id in waiting.pop(batch.id, []):
+            if csv_file in results:
+                merge_results(results[csv_file], {custom_id: batch_results.get(owner_custom_id)})
+
+        new_batch_ids = []
+        for csv_file, batch_ids in pending.items():
+            if batch.id in batch_ids:
+                batch_ids.discard(batch.id)
+                if not batch_ids:
+                    new_batch_ids.extend(finish_book(csv_file))
+        return new_batch_ids
+
+    # books with nothing left to wait for, such as aliases of unknown batches, are retried and merged now
+    for csv_file in [csv_file for csv_file, batch_ids in pending.items() if not batch_ids]:
+        finish_book(csv_file)
+    poll_batches(client, list(shard_by_batch), on_finished, **poll_kwargs)
+
+
+def write_submitted(jsonl_file_path, requests_list):
+    """
+    Writes the requests of a book that actually have to be sent to <name>_submit.jsonl.
+    """
+    base, ext = os.path.splitext(jsonl_file_path)
+    submit_path = f"{base}_submit{ext}"
+    with open(submit_path, "w", encoding="utf-8") as f:
+        for request in requests_list:
+            f.write(json.dumps(request) + "\n")
+    return submit_path
+
+
+def run_batches(client, books, merge, ledger=None, cache=None, dedup=True, **poll_kwargs):
+    """
+    Submits the request files of all `books`, given as (book_name, csv_file, jsonl_file_path),
+    up front and tracks them until every book is merged. With a ledger, books that still have
+    unmerged batches from an earlier run are not resubmitted but tracked along with the new ones.
+    With a response cache, only requests it cannot answer are submitted, and a book it answers
+    completely is merged right away.
+
+    With `dedup`, a request identical to one already submitted in this run, by the same book or
+    an earlier one, is not sent again; its answer is copied from the first one's batch.
+    """
+    in_flight = set()
+    if ledger is not None:
+        in_flight = {shard.csv_file for shard in ledger.unmerged()} | set(ledger.unmerged_aliases()[1])
+    shards = []
+    aliases = {}
+    alias_books = {}
+    submitted = {}
+    stats = DedupStats()
+    model = None
+    for book_name, csv_file, jsonl_file_path in books:
+        if csv_file in in_flight:
+            print(f"{csv_file} already has unmerged requests in the ledger, not resubmitting")
+            continue
+        try:
+            requests_list = read_requests([jsonl_file_path])
+            stats.requests += len(requests_list)
+            cached = cached_results(cache, requests_list) if cache is not None else {}
+            if cached:
+                print(f"{len(cached)} of {len(requests_list)} requests of {book_name} found in the response cache")
+
+            to_send = []
+            keys = {}
+            book_keys = set()
+            duplicates = {}
+            for request in requests_list:
+                if request["custom_id"] in cached:
+                    continue
+                model = model or request["body"]["model"]
+                key = request_key(request)
+                if dedup and (key in submitted or key in book_keys):
+                    duplicates[request["custom_id"]] = key
+                    stats.add(*batch_request_tokens(request))
+                    continue
+                keys[request["custom_id"]] = key
+                book_keys.add(key)
+                to_send.append(request)
+
+            if not to_send and not duplicates:
+                print(f"All {len(requests_list)} requests of {book_name} are cached, merging without a batch")
+                merge(book_name, csv_file, cached)
+                continue
+
+            book_shards = []
+            if to_send:
+                submit_path = jsonl_file_path if len(to_send) == len(requests_list) else write_submitted(jsonl_file_path, to_send)
+                book_shards = submit_book(client, book_name, csv_file, submit_path, ledger, jsonl_file_path)
+            for shard in book_shards:
+                for custom_id in read_custom_ids(shard.shard_path):
+                    submitted.setdefault(keys[custom_id], (shard.batch_id, custom_id))
+            shards.extend(book_shards)
+            if duplicates:
+                aliases[csv_file] = {custom_id: submitted[key] for custom_id, key in duplicates.items()}
+                alias_books[csv_file] = (book_name, jsonl_file_path)
+                if ledger is not None:
+                    ledger.record_aliases(book_name, csv_file, jsonl_file_path, aliases[csv_file])
+        except Exception as e:
+            print(f"Error submitting {csv_file}: {e}")
+
+    if dedup and model is not None:
+        print(stats.report(model, batch=True))
+    if ledger is not None:
+        shards = ledger.unmerged()
+        aliases, alias_books = ledger.unmerged_aliases()
+    track_batches(client, shards, merge, ledger, cache, aliases, alias_books, **poll_kwargs)
+
+
+def resume_batches(client, ledger, merge, cache=None, **poll_kwargs):
+    """
+    Picks up every unmerged batch recorded in the ledger: polls the ones still running,
+    downloads the finished ones and merges each book, without submitting anything.
+    """
+    shards = ledger.unmerged()
+    aliases, alias_books = ledger.unmerged_aliases()
+    if not shards and not alias_books:
+        print(f"Nothing to resume in {ledger.path}")
+        return
+    books = {shard.csv_file for shard in shards} | set(alias_books)
+    print(f"Resuming {len(shards)} batches of {len(books)} books from {ledger.path}")
+    track_batches(client, shards, merge, ledger, cache, aliases, alias_books, **poll_kwargs)
@@ -0,0 +1,96 @@
+import os
+import json
+
+import pandas as pd
+
+from common.batch_api import BatchLedger, run_batches, resume_batches
+from common.response_cache import DEFAULT_CACHE_PATH, ResponseCache
+
+# Command line driver shared by the Batch API scripts. A script only supplies how it finds its
+# source CSVs, how it builds the requests of one CSV and which columns it sends.
+
+
+def write_batch_input(requests_list, book_name, output_dir):
+    """
+    Writes the requests of a book to <output_dir>/<book_name>_batch_input.jsonl and returns its path.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    jsonl_file_path = os.path.join(output_dir, f"{book_name}_batch_input.jsonl")
+    with open(jsonl_file_path, "w", encoding="utf-8") as f:
+        for req in requests_list:
+            f.write(json.dumps(req) + "\n")
+    return jsonl_file_path
+
+
+def add_result_columns(df, results, columns):
+    """
+    For each of `columns` in the DataFrame, adds a <column>_results column with the response of
+    each passage, whose custom_id is <column>_<row>.
+    """
+    for col in df.columns:
+        if col not in columns:
+            continue
+        df[f"{col}_results"] = [results.get(f"{col}_{idx}") for idx in df.index]
+    return df
+
+
+def add_batch_arguments(parser, base_dir, batches_dir):
+    parser.add_argument("command", nargs="?", choices=["run", "resume"], default="run",
+                        help="run submits every CSV, resume picks up the batches recorded in the ledger")
+    parser.add_argument("--base_dir", default=base_dir)
+    parser.add_argument("--batches_dir", default=batches_dir,
+                        help="Folder for the batch input files, the ledger and the results")
+    parser.add_argument("--ledger", default=None, help="Batch ledger, defaults to <batches_dir>/batch_ledger.sqlite")
+    parser.add_argument("--response_cache", default=DEFAULT_CACHE_PATH,
+                        help="Requests answered in earlier runs are taken from this cache instead of being submitted")
+    parser.add_argument("--no_response_cache", action="store_true")
+    parser.add_argument("--no_dedup", action="store_true", help="Submit identical prompts once per row instead of once per run")
+
+
+def run_batch_cli(args, find_csv_files, build_requests, columns):
+    """
+    Runs or resumes the Batch API jobs of every CSV find_csv_files(args.base_dir) returns.
+    build_requests(csv_file) gives (requests_list, df, book_name), and the answers are written
+    next to `columns` in <batches_dir>/<book_name>_results.csv.
+    """
+    import openai
+    client = openai.Client(api_key=os.getenv("OPENAI_API_KEY"))
+
+    batches_dir = args.batches_dir
+    os.makedirs(batches_dir, exist_ok=True)
+    ledger = BatchLedger(args.ledger or os.path.join(batches_dir, "batch_ledger.sqlite"))
+    cache = None if args.no_response_cache else ResponseCache(args.response_cache)
+
+    # results are merged into a fresh read of the source CSV, so a resumed run needs nothing in memory
+    def merge(book_name, csv_file, results):
+        updated_df = add_result_columns(pd.read_csv(csv_file), results, columns)
+        updated_csv_path = os.path.join(batches_dir, f"{book_name}_results.csv")
+        updated_df.to_csv(updated_csv_path, index=False)
+        print(f"Updated dataset saved to {updated_csv_path} for CSV {csv_file}")
+
+    if args.command == "resume":
+        resume_batches(client, ledger, merge, cache)
+        ledger.close()
+        return
+
+    csv_files = find_csv_files(args.base_dir)
+    if not csv_files:
+        print("No CSV files found in", args.base_dir)
+        ledger.close()
+        return
+
+    books = []
+    for csv_file in csv_files:
+        try:
+            requests_list, _, book_name = build_requests(csv_file)
+            jsonl_file_path = write_batch_input(requests_list, book_name, batches_dir)
+            print(f"Prepared {len(requests_list)} requests for {csv_file} in {jsonl_file_path}")
+            books.append((book_name, csv_file, jsonl_file_path))
+        except Exception as e:
+            print(f"Error processing {csv_file}: {e}")
+
+    # every book is submitted up front and merged as soon as all of its batches finish
+    run_batches(client, books, merge, ledger, cache, dedup=not args.no_dedup)
+    ledger.close()
+    if cache is not None:
+        print(cache.stats())
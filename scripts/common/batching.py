@@ -0,0 +1,136 @@
+import time
+import pandas as pd
+
+from common.journal import prompt_fingerprint
+
+
+def iter_prompts(task, books, prompt_setting):
+    """
+    Yields (conversation, sampling_params, (book, column, row)) for every language column of every
+    book, ordered by (language, mode). Conversations are built one column at a time.
+    """
+    # Jobs are grouped by (language, mode) so prompts sharing the same system prompt and
+    # demonstration run back to back and their cached KV blocks are reused before eviction.
+    all_jobs = [(book_title, job) for book_title, (df, jobs) in books.items() for job in jobs]
+    all_jobs.sort(key=lambda item: (item[1]["lang"], item[1].get("mode", "")))
+
+    for book_title, job in all_jobs:
+        column_prompts = task.job_messages(job, prompt_setting)
+        column_params = task.job_sampling_params(job)
+        for row, (prompt, params) in enumerate(zip(column_prompts, column_params)):
+            yield prompt, params, (book_title, job["column"], row)
+
+
+def collect_prompts(task, books, prompt_setting):
+    """
+    Gathers the prompts of every language column of every book into one list, ordered by (language, mode).
+    Returns (prompts, sampling_params, tags) where tags[i] is the (book, column, row) prompts[i] belongs to.
+    """
+    prompts = []
+    sampling_params = []
+    tags = []
+    for prompt, params, tag in iter_prompts(task, books, prompt_setting):
+        prompts.append(prompt)
+        sampling_params.append(params)
+        tags.append(tag)
+    return prompts, sampling_params, tags
+
+
+def scatter_results(books, tags, results):
+    """
+    Inserts results back into the per-book DataFrames, next to the column each job came from.
+    Rows without a result are left empty.
+    """
+    by_column = {}
+    for (book_title, column, row), result in zip(tags, results):
+        by_column.setdefault((book_title, column), {})[row] = result
+
+    for book_title, (df, jobs) in books.items():
+        for job in jobs:
+            rows = by_column.get((book_title, job["column"]), {})
+            output = [rows.get(row) for row in range(len(job["passages"]))]
+            index_of_column = df.columns.get_loc(job["insert_after"])
+            df.insert(index_of_column + 1, job["result_column"], pd.Series(output))
+
+
+def prefix_cache_hit_rate(completions):
+    """
+    Returns the share of prompt tokens served from the backend's prefix cache, or None when the
+    backend does not report cached tokens.
+    """
+    cached_tokens = 0
+    prompt_tokens = 0
+    for completion in completions:
+        if completion.cached_tokens is None:
+            return None
+        cached_tokens += completion.cached_tokens
+        prompt_tokens += completion.prompt_tokens or 0
+    return cached_tokens / prompt_tokens if prompt_tokens else None
+
+
+def parse_completion(task, completion):
+    """
+    Parses a completion with the task's parse_output, failed requests (text None) stay empty.
+    """
+    return None if completion.text is None else task.parse_output(completion.text)
+
+
+def mega_batch_generate(backend, task, books, prompt_setting, max_batch_prompts=None, journal=None, model_name=None):
+    """
+    Runs every column of every book through as few backend.generate calls as possible, so the
+    vLLM scheduler always has a full queue, and scatters the parsed outputs back into `books`.
+
+    `task` is a task module exposing job_messages, job_sampling_params and parse_output.
+    `books` maps a book title to the (df, jobs) pair returned by the task's load_jobs.
+    `max_batch_prompts` caps the number of prompts per generate call, None means a single call.
+    With a `journal`, rows already journaled for (model_name, prompt_setting) and the same prompt
+    and sampling params are not generated
+    again, and the results of every generate call are journaled as soon as it returns. Failed
+    requests are not journaled, so a resumed run generates them again.
+    """
+    prompts, sampling_params, tags = collect_prompts(task, books, prompt_setting)
+    if not prompts:
+        return
+
+    results = {}
+    journal_keys = {}
+    if journal is not None:
+        pending = []
+        for prompt, params, tag in zip(prompts, sampling_params, tags):
+            key = journal_keys[tag] = journal.key(*tag, model_name, prompt_setting, prompt_fingerprint(prompt, params))
+            if key in journal:
+                results[tag] = journal.get(key)
+            else:
+                pending.append((prompt, params, tag))
+        print(f"{len(results)} of {len(prompts)} prompts already journaled, generating {len(pending)}")
+    else:
+        pending = list(zip(prompts, sampling_params, tags))
+
+    step = max_batch_prompts or len(pending) or 1
+    for start in range(0, len(pending), step):
+        chunk_prompts, chunk_params, chunk_tags = zip(*pending[start:start + step])
+        start_time = time.time()
+        completions = backend.generate(list(chunk_prompts), list(chunk_params))
+        elapsed = max(time.time() - start_time, 1e-9)
+
+        # cache entries written before token counts were stored have None
+        prompt_tokens = sum(completion.prompt_tokens or 0 for completion in completions)
+        generated_tokens = sum(completion.generated_tokens or 0 for completion in completions)
+        print(f"Generated {len(chunk_prompts)} prompts from {len(books)} books in {elapsed:.1f}s "
+              f"({(prompt_tokens + generated_tokens) / elapsed:.0f} tok/s total, "
+              f"{generated_tokens / elapsed:.0f} tok/s generated)")
+
+        hit_rate = prefix_cache_hit_rate(completions)
+        if hit_rate is not None:
+            print(f"Prefix cache hit rate: {hit_rate:.1%} of prompt tokens")
+
+        chunk_results = [parse_completion(task, completion) for completion in completions]
+        results.update(zip(chunk_tags, chunk_results))
+        if journal is not None:
+            journal.record_many(
+                (journal_keys[tag], result)
+                for tag, result, completion in zip(chunk_tags, chunk_results, completions)
+                if completion.text is not None
+            )
+
+    scatter_results(books, tags, [results.get(tag) for tag in tags])
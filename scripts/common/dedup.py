@@ -0,0 +1,109 @@
+from common.backends import Backend, SamplingParams, _params_list, estimate_tokens, replay_key
+from common.pricing import request_cost
+
+
+class DedupStats:
+    """
+    Counts requests collapsed into an identical earlier one and the tokens they would have cost.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.duplicates = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def add(self, prompt_tokens, completion_tokens):
+        self.duplicates += 1
+        self.prompt_tokens += prompt_tokens or 0
+        self.completion_tokens += completion_tokens or 0
+
+    def report(self, model, batch=False):
+        saved = f"Deduplicated {self.duplicates} of {self.requests} requests"
+        if not self.duplicates:
+            return saved
+        saved += f", saving {self.prompt_tokens} prompt and {self.completion_tokens} completion tokens"
+        cost = request_cost(model, self.prompt_tokens, self.completion_tokens, batch)
+        if cost is not None:
+            saved += f" (${cost:.2f})"
+        return saved
+
+
+class DedupBackend(Backend):
+    """
+    Sends each distinct (conversation, sampling params) of a generate call once and fans the
+    completion out to every position that asked for it. Mega-batched runs put the prompts of
+    all books in one call, so passages shared by books or repeated within a book are generated
+    once. While streaming, a prompt identical to one still in flight waits for that one.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.name = backend.name
+        self.cacheable = backend.cacheable
+        self.stats = DedupStats()
+
+    def _unique(self, conversations, params):
+        """
+        Index of each position's distinct request, and the distinct conversations and params.
+        """
+        params = _params_list(params, len(conversations))
+        first = {}
+        order = []
+        positions = []
+        for i, (conversation, p) in enumerate(zip(conversations, params)):
+            key = replay_key(conversation, p)
+            if key not in first:
+                first[key] = len(order)
+                order.append(i)
+            positions.append(first[key])
+        self.stats.requests += len(conversations)
+        return positions, [conversations[i] for i in order], [params[i] for i in order]
+
+    def _count(self, positions, results):
+        seen = set()
+        for index in positions:
+            if index in seen and not isinstance(results[index], Exception):
+                self.stats.add(results[index].prompt_tokens, results[index].generated_tokens)
+            seen.add(index)
+
+    def generate(self, conversations, params):
+        positions, unique_conversations, unique_params = self._unique(conversations, params)
+        results = self.backend.generate(unique_conversations, unique_params)
+        self._count(positions, results)
+        return [results[index] for index in positions]
+
+    def generate_settled(self, conversations, params):
+        positions, unique_conversations, unique_params = self._unique(conversations, params)
+        results = self.backend.generate_settled(unique_conversations, unique_params)
+        self._count(positions, results)
+        return [results[index] for index in positions]
+
+    def stream(self, items, max_in_flight=1024):
+        waiting = {}
+
+        def unique():
+            for conversation, p, tag in items:
+                self.stats.requests += 1
+                key = replay_key(conversation, p)
+                if key in waiting:
+                    waiting[key].append(tag)
+                    continue
+                waiting[key] = [tag]
+                yield conversation, p, key
+
+        for key, completion in self.backend.stream(unique(), max_in_flight):
+            tags = waiting.pop(key)
+            for _ in tags[1:]:
+                self.stats.add(completion.prompt_tokens, completion.generated_tokens)
+            for tag in tags:
+                yield tag, completion
+
+
+def batch_request_tokens(request):
+    """
+    Estimated (prompt tokens, completion tokens) of a Batch API request: about 4 characters per
+    prompt token, and max_tokens for the response.
+    """
+    body = request["body"]
+    return estimate_tokens(body["messages"], SamplingParams(max_tokens=0)), body.get("max_tokens") or 0
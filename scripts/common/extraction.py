@@ -0,0 +1,99 @@
+import re
+
+# Completions are scanned with a precompiled pattern for simple tags. Whenever the text holds
+# anything the scanner cannot prove it handles exactly like BeautifulSoup's html.parser tree
+# (tags with attributes, comments, entities, markup inside or around nested answer tags), it
+# falls back to BeautifulSoup, so results are always identical to the previous bs4-only extraction.
+_SIMPLE_TAG = re.compile(r"<(/?)([a-zA-Z][^\t\n\r\f />\x00<]*)>")
+
+# html.parser reads the contents of these elements as raw text, tags in them are not tags
+_RAW_TEXT_ELEMENTS = {"script", "style", "textarea", "title", "xmp", "iframe", "noembed", "noframes",
+                      "noscript", "plaintext"}
+
+# '&' only stays a literal ampersand when it cannot start a character or entity reference
+_REFERENCE = re.compile(r"&(?!\s)")
+
+_ASCII_SPACES = " \n\t\x0c\r"
+
+
+def _scan_elements(text, tag):
+    """
+    Returns the raw contents of every `tag` element in document order, or None when the text
+    needs a full HTML parse to be handled correctly. Other tags are allowed outside the `tag`
+    elements, where they do not change what find and find_all return.
+    """
+    matches = list(_SIMPLE_TAG.finditer(text))
+    if len(matches) != text.count("<"):
+        return None
+
+    tag = tag.lower()
+    contents = []
+    start = None
+    for match in matches:
+        name = match.group(2).lower()
+        if name != tag:
+            if start is not None or name in _RAW_TEXT_ELEMENTS:
+                return None
+        elif match.group(1):
+            # html.parser ignores closing tags without an open element
+            if start is not None:
+                contents.append(text[start:match.start()])
+                start = None
+        elif start is not None:
+            return None
+        else:
+            start = match.end()
+
+    if start is not None:
+        # an unclosed element runs to the end of the document
+        contents.append(text[start:])
+
+    if any(_REFERENCE.search(content) for content in contents):
+        return None
+    return [_collapse_whitespace(content) for content in contents]
+
+
+def _collapse_whitespace(content):
+    # BeautifulSoup replaces strings made only of ASCII whitespace with a single newline or space
+    if content and not content.strip(_ASCII_SPACES):
+        return "\n" if "\n" in content else " "
+    return content
+
+
+def _soup(text):
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(text, 'html.parser')
+
+
+def extract_tag(text, tag):
+    """
+    Returns the inner HTML of the first `tag` element in text, or None if there is none.
+    Same result as BeautifulSoup(text, 'html.parser').find(tag).decode_contents().
+    """
+    if isinstance(text, str):
+        if "<" not in text:
+            return None
+        contents = _scan_elements(text, tag)
+        if contents is not None:
+            # decode_contents re-escapes '&' and '>' in text, '<' never reaches this point
+            return contents[0].replace("&", "&amp;").replace(">", "&gt;") if contents else None
+
+    element = _soup(text).find(tag)
+    if element:
+        return element.decode_contents()
+    return None
+
+
+def extract_all_tag_texts(text, tag):
+    """
+    Returns the text of every `tag` element in text, in document order.
+    Same result as [e.get_text() for e in BeautifulSoup(text, 'html.parser').find_all(tag)].
+    """
+    if isinstance(text, str):
+        if "<" not in text:
+            return []
+        contents = _scan_elements(text, tag)
+        if contents is not None:
+            return contents
+
+    return [element.get_text() for element in _soup(text).find_all(tag)]
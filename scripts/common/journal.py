@@ -0,0 +1,94 @@
+import os
+import json
+import hashlib
+
+
+def prompt_fingerprint(conversation, params):
+    """
+    Short hash of the conversation sent for a row and its sampling params, so a journaled result is
+    only reused for the same prompt template and settings.
+    """
+    return hashlib.sha256(
+        json.dumps([conversation, params.as_dict()], sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()[:16]
+
+
+class ResultJournal:
+    """
+    Append-only JSONL journal of probe results keyed by (book, column, row, model, prompt_setting,
+    prompt), where prompt is the prompt_fingerprint of the request the result answers.
+
+    Every result is written and flushed as soon as it is known, so a crashed run can be restarted
+    and only the rows missing from the journal are generated again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.results = {}
+
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # the last line can be cut short if the process died while writing it
+                        continue
+                    # entries from before prompts were fingerprinted have none and are generated again
+                    key = self.key(entry["book"], entry["column"], entry["row"], entry["model"], entry["prompt_setting"],
+                                   entry.get("prompt"))
+                    self.results[key] = entry["result"]
+            print(f"Loaded {len(self.results)} journaled results from {path}")
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        if self._ends_mid_line(path):
+            # end the cut short line, so the first new entry does not join it
+            self._file.write("\n")
+            self._file.flush()
+
+    @staticmethod
+    def _ends_mid_line(path):
+        if not os.path.getsize(path):
+            return False
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) != b"\n"
+
+    @staticmethod
+    def key(book, column, row, model, prompt_setting, prompt):
+        return (book, column, int(row), model, prompt_setting, prompt)
+
+    def __contains__(self, key):
+        return key in self.results
+
+    def __len__(self):
+        return len(self.results)
+
+    def get(self, key, default=None):
+        return self.results.get(key, default)
+
+    def record_many(self, entries):
+        """
+        Appends (key, result) pairs to the journal and flushes them to disk.
+        """
+        for key, result in entries:
+            book, column, row, model, prompt_setting, prompt = key
+            self._file.write(json.dumps({
+                "book": book,
+                "column": column,
+                "row": row,
+                "model": model,
+                "prompt_setting": prompt_setting,
+                "prompt": prompt,
+                "result": result,
+            }, ensure_ascii=False) + "\n")
+            self.results[key] = result
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def record(self, key, result):
+        self.record_many([(key, result)])
+
+    def close(self):
+        self._file.close()
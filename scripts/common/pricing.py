@@ -0,0 +1,30 @@
+# USD per million tokens of the OpenAI models the probing scripts call. The Batch API bills half
+# the synchronous price. Models missing here (local vLLM models) have no dollar cost.
+PRICES = {
+    "gpt-4o-2024-11-20": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+    "gpt-4o-2024-08-06": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+    "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+    "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+}
+
+BATCH_DISCOUNT = 0.5
+
+
+def model_prices(model):
+    """
+    Price entry of `model`, also matching provider prefixes such as "openai/gpt-4o", None if unknown.
+    """
+    if model in PRICES:
+        return PRICES[model]
+    return PRICES.get(model.split("/")[-1])
+
+
+def request_cost(model, prompt_tokens, completion_tokens, batch=False):
+    """
+    Dollar cost of `prompt_tokens` in and `completion_tokens` out, None for models without a price.
+    """
+    prices = model_prices(model)
+    if prices is None:
+        return None
+    cost = (prompt_tokens * prices["input"] + completion_tokens * prices["output"]) / 1_000_000
+    return cost * BATCH_DISCOUNT if batch else cost
@@ -0,0 +1,105 @@
+import json
+import array
+import sqlite3
+import hashlib
+
+
+# init_kwargs that change the ids of an encode() call with the default add_special_tokens
+TOKENIZATION_KWARGS = ["add_bos_token", "add_eos_token", "add_prefix_space", "legacy", "do_lower_case",
+                       "strip_accents", "tokenize_chinese_chars", "split_special_tokens"]
+
+
+def tokenizer_hash(tokenizer):
+    """
+    Fingerprint of everything that decides a prompt's token ids: the full tokenizer pipeline
+    (vocabulary, merges, normalizer, pre-tokenizer, post-processor), special tokens, the options
+    adding BOS/EOS and the chat template. Models sharing a tokenizer share cache entries.
+    """
+    h = hashlib.sha256()
+    h.update(type(tokenizer).__name__.encode("utf-8"))
+    backend_tokenizer = getattr(tokenizer, "backend_tokenizer", None)
+    if backend_tokenizer is not None:
+        h.update(backend_tokenizer.to_str().encode("utf-8"))
+    else:
+        h.update(json.dumps(sorted(tokenizer.get_vocab().items()), ensure_ascii=False).encode("utf-8"))
+        sp_model = getattr(tokenizer, "sp_model", None)
+        if sp_model is not None:
+            h.update(sp_model.serialized_model_proto())
+    init_kwargs = getattr(tokenizer, "init_kwargs", {})
+    h.update(json.dumps({name: init_kwargs.get(name) for name in TOKENIZATION_KWARGS}, sort_keys=True, default=str).encode("utf-8"))
+    h.update(json.dumps(getattr(tokenizer, "special_tokens_map", {}), sort_keys=True, default=str).encode("utf-8"))
+    h.update(str(getattr(tokenizer, "chat_template", "")).encode("utf-8"))
+    return h.hexdigest()
+
+
+def conversation_hash(conversation):
+    return hashlib.sha256(json.dumps(conversation, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class PromptTokenCache:
+    """
+    Content-addressed cache of chat-templated prompt token ids in SQLite, keyed by
+    (tokenizer hash, conversation hash). The conversation carries the task's prompt, language,
+    mode, prompt setting and passage, so any change to them is a new key.
+    Several workers of a sweep can share one cache file.
+    """
+
+    def __init__(self, path, tokenizer):
+        self.path = path
+        self.tokenizer = tokenizer
+        self.tokenizer_hash = tokenizer_hash(tokenizer)
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS prompt_tokens (key TEXT PRIMARY KEY, token_ids BLOB NOT NULL)")
+        self.conn.commit()
+
+    def key(self, conversation):
+        return f"{self.tokenizer_hash}:{conversation_hash(conversation)}"
+
+    def _lookup(self, keys):
+        found = {}
+        unique_keys = list(set(keys))
+        for start in range(0, len(unique_keys), 500):
+            chunk = unique_keys[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT key, token_ids FROM prompt_tokens WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            )
+            for key, blob in rows:
+                found[key] = array.array("I", blob).tolist()
+        return found
+
+    def compile(self, conversations):
+        """
+        Applies the chat template and tokenizes every conversation not cached yet, the same way
+        vLLM tokenizes a templated prompt string, and returns the token ids of all conversations.
+        """
+        keys = [self.key(conversation) for conversation in conversations]
+        token_ids = self._lookup(keys)
+
+        missing = {}
+        for key, conversation in zip(keys, conversations):
+            if key not in token_ids:
+                missing.setdefault(key, conversation)
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            texts = self.tokenizer.apply_chat_template(list(missing.values()), tokenize=False, add_generation_prompt=True)
+            encoded = self.tokenizer(texts)["input_ids"]
+            token_ids.update(zip(missing, encoded))
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO prompt_tokens (key, token_ids) VALUES (?, ?)",
+                [(key, array.array("I", ids).tobytes()) for key, ids in zip(missing, encoded)],
+            )
+            self.conn.commit()
+
+        return [token_ids[key] for key in keys]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return f"prompt token cache: {self.hits} hits, {self.misses} misses ({self.hits / total if total else 0:.1%} hit rate)"
+
+    def close(self):
+        self.conn.close()
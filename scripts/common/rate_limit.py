@@ -0,0 +1,180 @@
+import re
+import time
+import asyncio
+import threading
+
+# Token bucket rate limiting shared by everything in the process that calls the same external
+# API: the OpenAI backends, the infini-gram search and the Azure translator. Each caller asks
+# for the limiter of its provider with get_limiter(), so concurrent callers split one budget.
+
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_UNIT_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value):
+    """
+    Seconds in an OpenAI rate limit reset header such as "20ms", "1s" or "6m0s", None if absent.
+    """
+    if not value:
+        return None
+    parts = _DURATION.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(number) * _UNIT_SECONDS[unit] for number, unit in parts)
+
+
+def retry_after(headers):
+    """
+    Seconds the server asked us to wait before retrying, from retry-after-ms or retry-after.
+    """
+    if headers is None:
+        return None
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    return parse_duration(headers.get("retry-after"))
+
+
+class TokenBucket:
+    """
+    Refills `rate` units per second up to `capacity`. Reservations may take the bucket below
+    zero, the caller then waits until its share has refilled, which keeps callers in order.
+    A rate of None means unlimited.
+    """
+
+    def __init__(self, rate=None, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.level = self.capacity or 0.0
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        if self.rate:
+            self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self, amount, now):
+        """
+        Takes `amount` units and returns the seconds to wait before using them.
+        """
+        if not self.rate or amount <= 0:
+            return 0.0
+        self._refill(now)
+        self.level -= amount
+        return -self.level / self.rate if self.level < 0 else 0.0
+
+    def set_rate(self, rate, capacity=None):
+        self._refill(time.monotonic())
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.level = min(self.level, self.capacity)
+
+
+class RateLimiter:
+    """
+    Requests-per-second and tokens-per-second buckets for one API, safe to share between
+    threads and asyncio tasks.
+
+    A 429 pauses every caller for the server's Retry-After and lowers both rates by
+    `backoff_factor`. Successful requests raise them back by `recovery_factor` up to the
+    configured rates, or to the limits the API reports in its x-ratelimit headers.
+    """
+
+    def __init__(self, requests_per_second=None, tokens_per_second=None, burst_seconds=1.0,
+                 backoff_factor=0.8, recovery_factor=1.02):
+        self.burst_seconds = burst_seconds
+        self.backoff_factor = backoff_factor
+        self.recovery_factor = recovery_factor
+        self.max_rate = {"requests": requests_per_second, "tokens": tokens_per_second}
+        self.buckets = {
+            kind: TokenBucket(rate, rate * burst_seconds if rate else None)
+            for kind, rate in self.max_rate.items()
+        }
+        self.paused_until = 0.0
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=0):
+        """
+        Reserves one request of `tokens` tokens and returns the seconds to wait before sending it.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = max(
+                self.buckets["requests"].reserve(1, now),
+                self.buckets["tokens"].reserve(tokens, now),
+            )
+            return max(wait, self.paused_until - now)
+
+    def acquire(self, tokens=0):
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, tokens=0):
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _set_rate(self, kind, rate):
+        self.buckets[kind].set_rate(rate, rate * self.burst_seconds)
+
+    def on_rate_limited(self, seconds=None):
+        """
+        Records a 429: pauses all callers for `seconds` (the Retry-After) and slows down.
+        """
+        with self._lock:
+            self.rate_limited += 1
+            now = time.monotonic()
+            # requests already in flight when the limit was hit get 429s too, slow down once per pause
+            if now >= self.paused_until:
+                for kind, bucket in self.buckets.items():
+                    if bucket.rate:
+                        self._set_rate(kind, bucket.rate * self.backoff_factor)
+            if seconds:
+                self.paused_until = max(self.paused_until, now + seconds)
+
+    def on_success(self):
+        with self._lock:
+            for kind, bucket in self.buckets.items():
+                if bucket.rate and self.max_rate[kind] and bucket.rate < self.max_rate[kind]:
+                    self._set_rate(kind, min(self.max_rate[kind], bucket.rate * self.recovery_factor))
+
+    def update_from_headers(self, headers):
+        """
+        Adopts the per-minute x-ratelimit-limit-requests/tokens limits of an OpenAI style API as
+        the rates to run at, and pauses until x-ratelimit-reset-* once a window is used up.
+        """
+        with self._lock:
+            now = time.monotonic()
+            for kind in ["requests", "tokens"]:
+                limit = headers.get(f"x-ratelimit-limit-{kind}")
+                if limit and float(limit) > 0 and self.max_rate[kind] != float(limit) / 60:
+                    self.max_rate[kind] = float(limit) / 60
+                    self._set_rate(kind, self.max_rate[kind])
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                if remaining is not None and reset is not None and int(remaining) <= 0:
+                    self.paused_until = max(self.paused_until, now + reset)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name, requests_per_second=None, tokens_per_second=None, **kwargs):
+    """
+    Returns the process-wide limiter of the API called `name`, created with the given rates
+    the first time it is asked for.
+    """
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = RateLimiter(requests_per_second, tokens_per_second, **kwargs)
+        return _limiters[name]
+
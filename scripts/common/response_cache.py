@@ -0,0 +1,243 @@
+import os
+import json
+import time
+import itertools
+from collections import deque
+import sqlite3
+import hashlib
+
+from common.backends import Backend, Completion, SamplingParams, _params_list
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+# Shared by the OpenAI scripts and the Batch API builders unless they are given another path.
+# It lives in the user's cache directory, or in $BEAM_CACHE_DIR, never in the source tree.
+CACHE_DIR = os.environ.get("BEAM_CACHE_DIR") or os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "beam")
+DEFAULT_CACHE_PATH = os.path.join(CACHE_DIR, "response_cache.sqlite")
+
+
+def response_key(model, conversation, params):
+    """
+    Content address of a response: the model, the full conversation (a model's chat template
+    renders it to the same prompt every time) and every sampling setting.
+    """
+    return hashlib.sha256(
+        json.dumps([model, conversation, params.as_dict()], sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+
+
+def body_params(body):
+    """
+    SamplingParams of a chat completions request body. A body does not say whether the caller
+    keeps the stop string in its output, so batch requests only share keys with backend requests
+    that do not (include_stop_str_in_output=False), not with the vLLM and --backend openai probe
+    runs, and only when every sampling setting, defaults included, is the same.
+    """
+    stop = body.get("stop")
+    return SamplingParams(
+        temperature=body.get("temperature", 1.0),
+        top_p=body.get("top_p", 1.0),
+        max_tokens=body.get("max_tokens"),
+        stop=[stop] if isinstance(stop, str) else stop,
+    )
+
+
+def request_key(request):
+    """
+    Key of a Batch API request object ({"custom_id", "body": {...}}).
+    """
+    body = request["body"]
+    return response_key(body["model"], body["messages"], body_params(body))
+
+
+class ResponseCache:
+    """
+    Disk-backed cache of completions in SQLite, keyed by response_key. Once the stored responses
+    pass `max_bytes`, the least recently used ones are evicted. Several processes can share a file.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, completion TEXT NOT NULL, "
+            "size INTEGER NOT NULL, used_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)")
+        # running total of the stored bytes, kept by triggers so eviction never has to sum the table;
+        # a cache created before the total existed is summed once here
+        self.conn.execute("CREATE TABLE IF NOT EXISTS cache_size (bytes INTEGER NOT NULL)")
+        self.conn.execute("INSERT INTO cache_size (bytes) SELECT COALESCE(SUM(size), 0) FROM responses "
+                          "WHERE NOT EXISTS (SELECT 1 FROM cache_size)")
+        self.conn.execute("CREATE TRIGGER IF NOT EXISTS responses_insert AFTER INSERT ON responses "
+                          "BEGIN UPDATE cache_size SET bytes = bytes + NEW.size; END")
+        self.conn.execute("CREATE TRIGGER IF NOT EXISTS responses_update AFTER UPDATE OF size ON responses "
+                          "BEGIN UPDATE cache_size SET bytes = bytes + NEW.size - OLD.size; END")
+        self.conn.execute("CREATE TRIGGER IF NOT EXISTS responses_delete AFTER DELETE ON responses "
+                          "BEGIN UPDATE cache_size SET bytes = bytes - OLD.size; END")
+        self.conn.commit()
+
+    def get_many(self, keys):
+        """
+        Returns {key: Completion} for the cached keys and marks them as used.
+        """
+        found = {}
+        unique_keys = list(set(keys))
+        for start in range(0, len(unique_keys), 500):
+            chunk = unique_keys[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT key, completion FROM responses WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            )
+            for key, completion in rows:
+                found[key] = Completion(*json.loads(completion))
+        if found:
+            now = time.time()
+            self.conn.executemany("UPDATE responses SET used_at = ? WHERE key = ?", [(now, key) for key in found])
+            self.conn.commit()
+        self.hits += sum(1 for key in keys if key in found)
+        self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, items):
+        """
+        Stores (key, Completion) pairs. Completions without text (failed requests) are not cached.
+        """
+        now = time.time()
+        rows = []
+        for key, completion in items:
+            if completion.text is None:
+                continue
+            data = json.dumps(list(completion), ensure_ascii=False)
+            rows.append((key, data, len(data.encode("utf-8")), now))
+        if not rows:
+            return
+        # an upsert rather than INSERT OR REPLACE, whose implicit delete does not fire the delete trigger
+        self.conn.executemany(
+            "INSERT INTO responses (key, completion, size, used_at) VALUES (?, ?, ?, ?) ON CONFLICT (key) DO UPDATE "
+            "SET completion = excluded.completion, size = excluded.size, used_at = excluded.used_at", rows
+        )
+        self.conn.commit()
+        self.evict()
+
+    def size(self):
+        return self.conn.execute("SELECT bytes FROM cache_size").fetchone()[0]
+
+    def evict(self):
+        """
+        Drops the least recently used responses until the cache is back under max_bytes.
+        """
+        excess = self.size() - self.max_bytes
+        if excess <= 0:
+            return
+        keys = []
+        freed = 0
+        for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY used_at"):
+            keys.append(key)
+            freed += size
+            if freed >= excess:
+                break
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", [(key,) for key in keys])
+        self.conn.commit()
+        self.evictions += len(keys)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return (f"response cache: {self.hits} hits, {self.misses} misses "
+                f"({self.hits / total if total else 0:.1%} hit rate), {self.evictions} evicted, "
+                f"{self.size() / 1024 ** 2:.1f} MiB stored")
+
+    def close(self):
+        self.conn.close()
+
+
+class CachedBackend(Backend):
+    """
+    Serves completions of `backend` from a ResponseCache and only sends the misses to it,
+    storing what comes back. `model` is the model name the responses are keyed by. Responses
+    are keyed without the backend, so the chat, async and batch APIs share them, and stub
+    backends (echo, replay) are refused so their output is never served as the model's.
+    """
+
+    def __init__(self, backend, cache, model):
+        if not backend.cacheable:
+            raise ValueError(f"responses of the {backend.name} backend are not real {model} responses and cannot be cached")
+        self.backend = backend
+        self.cache = cache
+        self.model = model
+        self.name = backend.name
+
+    def _split(self, conversations, params):
+        params = _params_list(params, len(conversations))
+        keys = [response_key(self.model, conversation, p) for conversation, p in zip(conversations, params)]
+        cached = self.cache.get_many(keys)
+        missing = [i for i, key in enumerate(keys) if key not in cached]
+        return params, keys, cached, missing
+
+    def generate(self, conversations, params):
+        params, keys, cached, missing = self._split(conversations, params)
+        if missing:
+            generated = self.backend.generate([conversations[i] for i in missing], [params[i] for i in missing])
+            cached.update(zip([keys[i] for i in missing], generated))
+            self.cache.put_many([(keys[i], completion) for i, completion in zip(missing, generated)])
+        return [cached[key] for key in keys]
+
+    def generate_settled(self, conversations, params):
+        params, keys, cached, missing = self._split(conversations, params)
+        results = [cached.get(key) for key in keys]
+        if missing:
+            generated = self.backend.generate_settled([conversations[i] for i in missing], [params[i] for i in missing])
+            for i, result in zip(missing, generated):
+                results[i] = result
+            self.cache.put_many([(keys[i], result) for i, result in zip(missing, generated)
+                                 if not isinstance(result, Exception)])
+        return results
+
+    def stream(self, items, max_in_flight=1024, lookup_every=256, store_every=64):
+        """
+        Looks items up `lookup_every` at a time, yields the cached ones as they come up and streams
+        the rest through the wrapped backend, storing its completions `store_every` at a time.
+        """
+        items = iter(items)
+        hits = deque()
+        keys = {}
+        max_hits = max(max_in_flight, lookup_every)
+        exhausted = False
+
+        # Hits are yielded between the wrapped backend's results. A backend fed only hits yields
+        # nothing, so the feed ends once max_hits are waiting: the backend finishes what it has in
+        # flight, the hits are yielded, and a new stream picks up the remaining items.
+        def misses():
+            nonlocal exhausted
+            while len(hits) < max_hits:
+                chunk = list(itertools.islice(items, lookup_every))
+                if not chunk:
+                    exhausted = True
+                    return
+                chunk_keys = [response_key(self.model, conversation, p) for conversation, p, _ in chunk]
+                cached = self.cache.get_many(chunk_keys)
+                for (conversation, p, tag), key in zip(chunk, chunk_keys):
+                    if key in cached:
+                        hits.append((tag, cached[key]))
+                    else:
+                        keys[tag] = key
+                        yield conversation, p, tag
+
+        store = []
+        while not exhausted:
+            for tag, completion in self.backend.stream(misses(), max_in_flight):
+                while hits:
+                    yield hits.popleft()
+                store.append((keys.pop(tag), completion))
+                if len(store) >= store_every:
+                    self.cache.put_many(store)
+                    store = []
+                yield tag, completion
+            while hits:
+                yield hits.popleft()
+        self.cache.put_many(store)
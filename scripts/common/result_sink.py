@@ -0,0 +1,78 @@
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+RESULT_SCHEMA = pa.schema([
+    ("book", pa.string()),
+    ("column", pa.string()),
+    ("row", pa.int64()),
+    ("model", pa.string()),
+    ("prompt_setting", pa.string()),
+    ("result", pa.string()),
+])
+
+BATCH_RESULT_SCHEMA = pa.schema([
+    ("custom_id", pa.string()),
+    ("result", pa.string()),
+    ("error", pa.string()),
+])
+
+
+class ParquetResultSink:
+    """
+    Buffers per-prompt results and writes them to a Parquet file one row group at a time,
+    so memory stays bounded by `row_group_size` no matter how many prompts are streamed.
+    Rows follow `schema`, (book, column, row, model, prompt_setting, result) by default.
+    """
+
+    def __init__(self, path, row_group_size=4096, schema=RESULT_SCHEMA):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.row_group_size = row_group_size
+        self.schema = schema
+        self.rows_written = 0
+        self._buffer = {name: [] for name in schema.names}
+        self._writer = pq.ParquetWriter(path, schema)
+
+    def write(self, *values):
+        for name, value in zip(self.schema.names, values):
+            self._buffer[name].append(value)
+        if len(self._buffer[self.schema.names[0]]) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        buffered = len(self._buffer[self.schema.names[0]])
+        if not buffered:
+            return
+        self._writer.write_table(pa.Table.from_pydict(self._buffer, schema=self.schema))
+        self.rows_written += buffered
+        self._buffer = {name: [] for name in self.schema.names}
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_book_results(path, book):
+    """
+    Returns {(column, row): result} for one book of a result file written by ParquetResultSink.
+    """
+    table = pq.read_table(path, columns=["column", "row", "result"], filters=[("book", "=", book)])
+    columns = table.column("column").to_pylist()
+    rows = table.column("row").to_pylist()
+    results = table.column("result").to_pylist()
+    return {(column, row): result for column, row, result in zip(columns, rows, results)}
+
+
+def read_batch_results(path):
+    """
+    Returns {custom_id: result} from a Batch API result file written with BATCH_RESULT_SCHEMA.
+    """
+    table = pq.read_table(path, columns=["custom_id", "result"])
+    return dict(zip(table.column("custom_id").to_pylist(), table.column("result").to_pylist()))
@@ -0,0 +1,54 @@
+import time
+
+from common.batching import iter_prompts, parse_completion
+from common.journal import prompt_fingerprint
+
+
+def stream_task(backend, task, books, prompt_setting, sink, model_name, journal=None, max_in_flight=1024, journal_every=64):
+    """
+    Streams every prompt of `books` through backend.stream and writes each parsed result to `sink`
+    as it finishes, instead of building whole result columns in memory. With the vLLM backend at
+    most `max_in_flight` requests are queued in the engine and prompts are built lazily.
+    Rows already in `journal` are written to the sink without being generated again, failed
+    requests are not journaled so a resumed run generates them again.
+    Returns the number of prompts generated.
+    """
+    journal_keys = {}
+
+    def pending():
+        for prompt, params, tag in iter_prompts(task, books, prompt_setting):
+            if journal is not None:
+                key = journal.key(*tag, model_name, prompt_setting, prompt_fingerprint(prompt, params))
+                if key in journal:
+                    sink.write(*tag, model_name, prompt_setting, journal.get(key))
+                    continue
+                journal_keys[tag] = key
+            yield prompt, params, tag
+
+    start_time = time.time()
+    generated = 0
+    generated_tokens = 0
+    journal_buffer = []
+    for tag, completion in backend.stream(pending(), max_in_flight):
+        result = parse_completion(task, completion)
+        sink.write(*tag, model_name, prompt_setting, result)
+
+        generated += 1
+        generated_tokens += completion.generated_tokens or 0
+        key = journal_keys.pop(tag, None)
+        if key is not None and completion.text is not None:
+            journal_buffer.append((key, result))
+            if len(journal_buffer) >= journal_every:
+                journal.record_many(journal_buffer)
+                journal_buffer = []
+
+        if generated % 1000 == 0:
+            elapsed = max(time.time() - start_time, 1e-9)
+            print(f"Streamed {generated} results ({generated_tokens / elapsed:.0f} tok/s generated)")
+
+    if journal is not None and journal_buffer:
+        journal.record_many(journal_buffer)
+
+    elapsed = max(time.time() - start_time, 1e-9)
+    print(f"Streamed {generated} results in {elapsed:.1f}s ({generated_tokens / elapsed:.0f} tok/s generated)")
+    return generated
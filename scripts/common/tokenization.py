@@ -0,0 +1,167 @@
+import os
+import functools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+# Tokenizers are loaded once per process and shared by every caller: tiktoken encodings for the
+# OpenAI models, Hugging Face tokenizers (with their chat templates) for models run on vLLM.
+
+DEFAULT_ENCODING = "o200k_base"
+
+# tiktoken encodes a batch on several threads outside the GIL
+DEFAULT_THREADS = os.cpu_count() or 8
+
+# Text files are read and encoded this many characters' worth of lines at a time
+TEXT_CHUNK_CHARS = 4 * 1024 * 1024
+
+# OpenAI chat format: every message is framed by 3 tokens around its role and content,
+# and the reply is primed with 3 more
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(name=DEFAULT_ENCODING):
+    import tiktoken
+    return tiktoken.get_encoding(name)
+
+
+@functools.lru_cache(maxsize=None)
+def encoding_for_model(model):
+    """
+    tiktoken encoding of an OpenAI model, o200k_base for models tiktoken does not know.
+    """
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model.split("/")[-1])
+    except KeyError:
+        return get_encoding(DEFAULT_ENCODING)
+
+
+@functools.lru_cache(maxsize=None)
+def get_hf_tokenizer(model):
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(model)
+
+
+def encode_batch(texts, encoding, num_threads=DEFAULT_THREADS):
+    """
+    Token ids of every text, special tokens encoded as plain text. `encoding` is a tiktoken encoding
+    or the name of one. The texts are split into one contiguous slice per thread; tiktoken's own
+    encode_batch schedules a future per text, which costs more than encoding a short cell.
+    """
+    if isinstance(encoding, str):
+        encoding = get_encoding(encoding)
+    texts = [str(text) for text in texts]
+    size = -(-len(texts) // max(1, num_threads))
+    if num_threads <= 1 or size == len(texts):
+        return [encoding.encode_ordinary(text) for text in texts]
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        slices = executor.map(lambda start: [encoding.encode_ordinary(text) for text in texts[start:start + size]],
+                              range(0, len(texts), size))
+        return [token_ids for token_ids_slice in slices for token_ids in token_ids_slice]
+
+
+def count_tokens(texts, encoding, num_threads=DEFAULT_THREADS):
+    """
+    Token count of every text, encoded in one encode_batch call.
+    """
+    return [len(tokens) for tokens in encode_batch(texts, encoding, num_threads)]
+
+
+def iter_line_chunks(path, chunk_chars=TEXT_CHUNK_CHARS):
+    """
+    Yields the lines of a text file in lists of about `chunk_chars` characters, so large books
+    are never held in memory whole.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        while True:
+            lines = f.readlines(chunk_chars)
+            if not lines:
+                return
+            yield lines
+
+
+def count_text_file(path, encoding=DEFAULT_ENCODING, max_tokens_per_line=None, num_threads=DEFAULT_THREADS):
+    """
+    Returns (words, tokens) of a text file. Every line is encoded on its own, a chunk of lines per
+    encode_batch call, and its token count capped at `max_tokens_per_line` if given.
+    """
+    words = 0
+    tokens = 0
+    for lines in iter_line_chunks(path):
+        words += sum(len(line.split()) for line in lines)
+        counts = count_tokens(lines, encoding, num_threads)
+        if max_tokens_per_line is not None:
+            counts = [min(count, max_tokens_per_line) for count in counts]
+        tokens += sum(counts)
+    return words, tokens
+
+
+def map_files(function, paths, processes=None, **kwargs):
+    """
+    Runs function(path, **kwargs) on every path in a pool of processes, each loading its own
+    encoder once, and yields (path, result) as files finish. A file that fails yields the exception
+    as its result. Unless `num_threads` is given, the CPUs are split between the processes.
+    """
+    paths = list(paths)
+    if not paths:
+        return
+    processes = min(processes or DEFAULT_THREADS, len(paths))
+    kwargs.setdefault("num_threads", max(1, DEFAULT_THREADS // processes))
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {executor.submit(function, path, **kwargs): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], e
+
+
+def count_chat_tokens(conversations, encoding):
+    """
+    Prompt tokens an OpenAI chat model bills for each conversation.
+    """
+    parts = [part for conversation in conversations for message in conversation
+             for part in (message["role"], message["content"])]
+    lengths = iter(count_tokens(parts, encoding))
+    counts = []
+    for conversation in conversations:
+        tokens = TOKENS_PER_REPLY
+        for _ in conversation:
+            tokens += TOKENS_PER_MESSAGE + next(lengths) + next(lengths)
+        counts.append(tokens)
+    return counts
+
+
+def count_templated_tokens(conversations, tokenizer, prompt_cache=None):
+    """
+    Prompt tokens of each conversation after the model's chat template, tokenized the way the
+    vLLM backend does. With a common.prompt_cache.PromptTokenCache the ids come from the cache.
+    """
+    if prompt_cache is not None:
+        return [len(token_ids) for token_ids in prompt_cache.compile(conversations)]
+    texts = tokenizer.apply_chat_template(conversations, tokenize=False, add_generation_prompt=True)
+    return [len(token_ids) for token_ids in tokenizer(texts)["input_ids"]]
+
+
+def count_hf_tokens(texts, tokenizer):
+    """
+    Token count of every plain text with a Hugging Face tokenizer, without special tokens.
+    """
+    return [len(token_ids) for token_ids in tokenizer([str(text) for text in texts], add_special_tokens=False)["input_ids"]]
+
+
+def backend_token_counter(backend):
+    """
+    Returns a function mapping plain texts to their token counts for the model `backend` runs:
+    the vLLM backend's own tokenizer, or tiktoken for the OpenAI backends. None for backends
+    without a model, such as the CPU stubs.
+    """
+    tokenizer = getattr(backend, "tokenizer", None)
+    if tokenizer is not None:
+        return lambda texts: count_hf_tokens(texts, tokenizer)
+    model = getattr(backend, "model", None)
+    if isinstance(model, str):
+        encoding = encoding_for_model(model)
+        return lambda texts: count_tokens(texts, encoding)
+    return None
@@ -1,21 +1,23 @@
+import os
+import sys
 import pandas as pd
 from collections import Counter
-import tiktoken
 import seaborn as sns
 import matplotlib.pyplot as plt
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.tokenization import encode_batch
+
 def has_repeated_ngrams_in_column(path2csv, language_columns, n, threshold, encoding_name="o200k_base", visualization_path=None):
     df = pd.read_csv(path2csv)
-    encoding = tiktoken.get_encoding(encoding_name)
 
-    def get_token_ids(string): #tokenizing for token ids
-        return encoding.encode(string)
+    def get_token_ids(strings): #tokenizing a whole column at once for token ids
+        return encode_batch(strings, encoding_name)
 
     def get_ngram(token_ids, n): #calculating ngrams
         return [tuple(token_ids[i:i + n]) for i in range(len(token_ids) - n + 1)]
 
-    def has_repeated_ngrams(text, n, threshold):
-        token_ids = get_token_ids(text)
+    def has_repeated_ngrams(token_ids, n, threshold):
         ngrams = get_ngram(token_ids, n)
         ngram_counts = Counter(ngrams)
         return any(count >= threshold for count in ngram_counts.values())
@@ -30,8 +32,10 @@ def has_repeated_ngrams_in_column(path2csv, language_columns, n, threshold, enco
     for col in language_columns:
         if col in df.columns:
             new_col = f"{col}_has_repeated_ngram"
-            df[new_col] = df[col].dropna().apply(
-                lambda x: has_repeated_ngrams(str(x), n, threshold)
+            cells = df[col].dropna().astype(str)
+            df[new_col] = pd.Series(
+                [has_repeated_ngrams(token_ids, n, threshold) for token_ids in get_token_ids(cells.tolist())],
+                index=cells.index
             )
             proportion = df[new_col].mean()  # Calculate proportion of `True` values
             repetition_proportions.append((col, proportion))
@@ -1,7 +1,11 @@
 import requests
 import pandas as pd
-import time
 import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.rate_limit import get_limiter, retry_after
+
 # Azure Translator API credentials
 endpoint = "https://api.cognitive.microsofttranslator.com/"
 subscription_key = "" #TODO: Enter Key Here
@@ -18,6 +22,11 @@ languages = {
     "dv": "Divehi (Dhivehi)"
 }
 
+# Characters per hour of the Azure Translator tier (S1), use 2_000_000 for the free tier.
+# Batches are paced to it by a shared limiter that also follows Retry-After on 429s.
+CHARACTERS_PER_HOUR = 40_000_000
+limiter = get_limiter("azure-translator", tokens_per_second=CHARACTERS_PER_HOUR / 3600)
+
 #translate a batch of text with exponential backoff for rate limit handling.
 def translate_batch_with_backoff(texts, to_lang, max_retries=5, initial_delay=5):
     url = f"{endpoint}translate?api-version=3.0&to={to_lang}"
@@ -28,16 +37,19 @@ def translate_batch_with_backoff(texts, to_lang, max_retries=5, initial_delay=5)
     }
     body = [{"text": text} for text in texts]
     delay = initial_delay #initial delay in seconds
+    characters = sum(len(text) for text in texts)
 
     for attempt in range(max_retries):
+        limiter.acquire(characters)
         response = requests.post(url, headers=headers, json=body)
         if response.status_code == 429:  # Too many requests
-            retry_after = int(response.headers.get("Retry-After", delay))
-            print(f"Rate limit hit. Retrying in {retry_after} seconds...")
-            time.sleep(retry_after)
+            wait = retry_after(response.headers) or delay
+            print(f"Rate limit hit. Retrying in {wait} seconds...")
+            limiter.on_rate_limited(wait)
             delay *= 2  # exponential backoff looks ok!
         else:
             response.raise_for_status()
+            limiter.on_success()
             return [item['translations'][0]['text'] for item in response.json()]
 
     raise Exception("Max retries exceeded for translation request.")
@@ -86,10 +98,8 @@ if __name__ == "__main__":
             for i in range(0, len(df), batch_size):
                 batch = df['en'][i:i + batch_size].tolist()
                 translations.extend(translate_batch_with_backoff(batch, lang_code))
-                time.sleep(5)  # delay between batches
             df[lang_name] = translations
-            print(f"Completed translations for {lang_name}. Waiting before next language...")
-            time.sleep(10) #delay in between languages
+            print(f"Completed translations for {lang_name}.")
 
         df.to_csv(input_csv, index=False)
         print(f"Translation complete for {title}. Updated {input_csv}.")
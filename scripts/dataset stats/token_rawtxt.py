@@ -1,54 +1,47 @@
 import os
+import sys
 import csv
 import re
 from collections import defaultdict
-import tiktoken
 
-# Load tokenizer (choose based on target model, e.g., "cl100k_base" for GPT-4/3.5)
-encoding = tiktoken.get_encoding("cl100k_base")  # or use tiktoken.encoding_for_model("gpt-4")
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.tokenization import count_text_file, map_files
 
-def safe_tokenize(text, encoding):
-    try:
-        # Truncate to 512 tokens like before
-        tokens = encoding.encode(text)
-        return len(tokens[:512])
-    except Exception as e:
-        print(f"Tokenization error: {e}")
-        return 0
+# Choose based on target model, e.g., "cl100k_base" for GPT-4/3.5, "o200k_base" for GPT-4o
+ENCODING = "cl100k_base"
+# Each line's count is truncated to 512 tokens like before
+MAX_TOKENS_PER_LINE = 512
 
-def count_words_and_tokens_streamed(root_dir, output_csv="grouped_counts_streamed_2024.csv"):
+def count_words_and_tokens_streamed(root_dir, output_csv="grouped_counts_streamed_2024.csv", processes=None):
+    """
+    Counts words and tokens of every book file, one file per worker process. Files are streamed
+    in chunks of lines and each chunk is encoded in one batch.
+    """
     lang_suffixes = ['en', 'es', 'tr', 'vi']
     grouped_counts = defaultdict(dict)
+    pattern = r"^(.*)_(" + "|".join(lang_suffixes) + r")\.txt$"
 
+    books = {}
     for dirpath, _, filenames in os.walk(root_dir):
         for file in filenames:
             if file.endswith(".txt") and ("Dracula" in file or "Animal_Farm" in file):
-                pattern = r"^(.*)_(" + "|".join(lang_suffixes) + r")\.txt$"
                 match = re.match(pattern, file)
-
                 if match:
-                    book_name, lang = match.groups()
-                    file_path = os.path.join(dirpath, file)
-
-                    total_words = 0
-                    total_tokens = 0
-
-                    try:
-                        with open(file_path, "r", encoding="utf-8") as f:
-                            for line in f:
-                                words = line.strip().split()
-                                total_words += len(words)
-                                total_tokens += safe_tokenize(line, encoding)
-
-                        grouped_counts[book_name][lang] = {
-                            "words": total_words,
-                            "tokens": total_tokens
-                        }
-                        print(f"{file_path} → words: {total_words}, tokens: {total_tokens}")
+                    books[os.path.join(dirpath, file)] = match.groups()
 
-                    except Exception as e:
-                        print(f"Failed to process {file_path}: {e}")
-                        grouped_counts[book_name][lang] = {"words": "", "tokens": ""}
+    for file_path, counts in map_files(count_text_file, books, processes,
+                                       encoding=ENCODING, max_tokens_per_line=MAX_TOKENS_PER_LINE):
+        book_name, lang = books[file_path]
+        if isinstance(counts, Exception):
+            print(f"Failed to process {file_path}: {counts}")
+            grouped_counts[book_name][lang] = {"words": "", "tokens": ""}
+            continue
+        total_words, total_tokens = counts
+        grouped_counts[book_name][lang] = {
+            "words": total_words,
+            "tokens": total_tokens
+        }
+        print(f"{file_path} → words: {total_words}, tokens: {total_tokens}")
 
     # Write to CSV
     with open(output_csv, "w", newline='', encoding="utf-8") as csvfile:
@@ -69,5 +62,6 @@ def count_words_and_tokens_streamed(root_dir, output_csv="grouped_counts_streame
     return grouped_counts
 
 # Example usage
-directory_path = "/home/ekorukluoglu_umass_edu/beam2/BEAM/alignment/preprocess_books/raw"
-count_words_and_tokens_streamed(directory_path)
+if __name__ == "__main__":
+    directory_path = "/home/ekorukluoglu_umass_edu/beam2/BEAM/alignment/preprocess_books/raw"
+    count_words_and_tokens_streamed(directory_path)
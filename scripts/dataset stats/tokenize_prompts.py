@@ -1,17 +1,14 @@
 import os
+import sys
 import csv
 import pandas as pd
-import tiktoken
 from statistics import mean, median, stdev
 
-# Tokenizer setup
-encoding = tiktoken.get_encoding("o200k_base")
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.tokenization import count_tokens, map_files
 
-def count_tokens(text: str) -> int:
-    try:
-        return len(encoding.encode(str(text)))
-    except Exception:
-        return 0
+# Tokenizer setup
+ENCODING = "o200k_base"
 
 def is_lang_col(colname, lang):
     return f"only{lang}" in colname or colname.startswith(lang + "_")
@@ -26,7 +23,19 @@ def group_column(colname):
     else:
         return "none"
 
-def process_csvs_under_prompts(root_dir="/home/ekorukluoglu_umass_edu/beam2/BEAM/scripts/Prompts", output_csv="token_stats_summary_ne.csv"):
+def count_csv_tokens(filepath, num_threads):
+    """
+    Token counts of the cells of a prompt CSV grouped by column group, every column encoded in one batch.
+    """
+    df = pd.read_csv(filepath)
+    counts = {}
+    for col in df.columns:
+        group = group_column(col)
+        if group != "none":
+            counts.setdefault(group, []).extend(count_tokens(df[col].dropna().astype(str).tolist(), ENCODING, num_threads))
+    return counts
+
+def process_csvs_under_prompts(root_dir="/home/ekorukluoglu_umass_edu/beam2/BEAM/scripts/Prompts", output_csv="token_stats_summary_ne.csv", processes=None):
     grouped_token_counts = {
         "English": [],
         "Translations": [],
@@ -39,6 +48,7 @@ def process_csvs_under_prompts(root_dir="/home/ekorukluoglu_umass_edu/beam2/BEAM
         'The_Ministry_of_Time', 'The_Paradise_Problem', 'You_Like_It_Darker_Stories','Paper_Towns'
     ]
 
+    filepaths = []
     for dirpath, _, filenames in os.walk(root_dir):
         for filename in filenames:
             if filename.endswith(".csv") and "_unmasked_passages" in filename:
@@ -48,18 +58,15 @@ def process_csvs_under_prompts(root_dir="/home/ekorukluoglu_umass_edu/beam2/BEAM
                 
                 if test not in skip_books:
                     print(test)
-                    filepath = os.path.join(dirpath, filename)
-                    try:
-                        df = pd.read_csv(filepath)
-                    except Exception as e:
-                        print(f"Skipping {filepath} due to error: {e}")
-                        continue
+                    filepaths.append(os.path.join(dirpath, filename))
 
-                    for col in df.columns:
-                        group = group_column(col)
-                        if group != "none":
-                            token_counts = df[col].dropna().astype(str).map(count_tokens).tolist()
-                            grouped_token_counts[group].extend(token_counts)
+    # Files are tokenized in parallel, one per worker process
+    for filepath, token_counts in map_files(count_csv_tokens, filepaths, processes):
+        if isinstance(token_counts, Exception):
+            print(f"Skipping {filepath} due to error: {token_counts}")
+            continue
+        for group, values in token_counts.items():
+            grouped_token_counts[group].extend(values)
 
     # Compute summary statistics
     summary = []
@@ -92,4 +99,5 @@ def process_csvs_under_prompts(root_dir="/home/ekorukluoglu_umass_edu/beam2/BEAM
     print(f"Saved summary to {output_csv}")
 
 # Run it
-process_csvs_under_prompts()
+if __name__ == "__main__":
+    process_csvs_under_prompts()
@@ -1,122 +1,73 @@
-import pandas as pd
-import tiktoken
 import os
+import sys
+import glob
+import pandas as pd
+from argparse import ArgumentParser
 
+# Estimates what the gpt-4o direct probing runs are billed for: the sync path builds its requests with
+# Openai_direct_probing from the JSON data, the batch path with Batch_api_DP from the CSV data, so the
+# prompts, columns and max_tokens priced are the ones those scripts send.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from estimate_cost import add_estimate_arguments, batch_request_prompts, estimate_prompts, make_counter, print_estimates
+import Openai_direct_probing
+import Batch_api_DP
 
-def count_token_in_string(string: str, encoding_name: str = "o200k_base") -> int:
-    """
-    Returns the number of tokens in a text string using the specified encoding.
+PROMPTS_DIR = '/home/ekorukluoglu_umass_edu/beam2/BEAM/scripts/Prompts/'
+MODEL = "gpt-4o-2024-11-20"
 
-    Args:
-    string (str): The text string to tokenize.
-    encoding_name (str): The encoding name. Default is "o200k_base". New for gpt-4o.
 
-    Returns:
-    int: The number of tokens in the text string.
+def sync_prompts(data_paths, prompt_setting):
     """
-    # Load the encoding
-    encoding = tiktoken.get_encoding(encoding_name)
-
-    # Convert the string into tokens and count them
-    num_tokens = len(encoding.encode(string))
-    return num_tokens
-
-
-# replace the prompt with the correct language when running experiments
-def predict(lang, passage):
-    if lang == "es":
-        text = f"""
-            You are provided with a passage in {lang}. Your task is to carefully read the passage and identify the book it originated from and the book's author.
-
-            Example:
-            <passage>Lord Henry alzó las cejas y lo miró con asombro a través de las delgadas volutas de humo que, al salir de su cigarrillo con mezcla de opio, se retorcían adoptando extrañas formas.</passage>
-            <answer>"title": "The Picture of Dorian Gray","author": "Oscar Wilde"</answer>
-
-            Now, here is the passage. Please provide the book title and its author:
-            <passage>{passage}</passage>
-            You must format your output exactly as follows:
-            <output>"title": "Book title","author": "author name"</output>
-        """
-    elif lang == "tr":
-        text = f"""
-            You are provided with a passage in {lang}. Your task is to carefully read the passage and identify the book it originated from and the book's author.
-
-            Example:
-            <passage>Kendimden pek çok şey kattım buna.” Lord Henry divana boylu boyunca uzanarak güldü.</passage>
-            <answer>"title": "The Picture of Dorian Gray","author": "Oscar Wilde"</answer>
-
-            Now, here is the passage. Please provide the book title and its author:
-            <passage>{passage}</passage>
-            You must format your output exactly as follows:
-            <output>"title": "Book title","author": "author name"</output>
-        """
-    elif lang == "vi":
-        text = f"""
-            You are provided with a passage in {lang}. Your task is to carefully read the passage and identify the book it originated from and the book's author.
+    Conversations, sampling params and tags of the requests Openai_direct_probing sends for the JSON files.
+    """
+    prompts, sampling_params, tags = [], [], []
+    for data_path in data_paths:
+        book_title = os.path.basename(data_path).replace(".json", "")
+        df = pd.read_json(data_path)
+        for language, base_language, mode in Openai_direct_probing.iter_columns(df):
+            conversations = Openai_direct_probing.build_conversations(base_language, df[language].tolist(), mode, prompt_setting)
+            prompts.extend(conversations)
+            sampling_params.extend([Openai_direct_probing.SAMPLING_PARAMS] * len(conversations))
+            tags.extend((book_title, language, i) for i in range(len(conversations)))
+    return prompts, sampling_params, tags
+
+
+def batch_prompts(base_dir):
+    """
+    Conversations, sampling params and tags of the requests Batch_api_DP submits for the CSV files under base_dir.
+    """
+    prompts, sampling_params, tags = [], [], []
+    for csv_file in Batch_api_DP.find_csv_files(base_dir):
+        requests_list, _, book_name = Batch_api_DP.build_requests(csv_file)
+        book_prompts, book_sampling_params, book_tags = batch_request_prompts(book_name, requests_list)
+        prompts.extend(book_prompts)
+        sampling_params.extend(book_sampling_params)
+        tags.extend(book_tags)
+    return prompts, sampling_params, tags
 
-            Example:
-            <passage>Oliver không hề thích thú kiểu đùa giỡn này và chuẩn bị thổ lộ sự bất bình của mình với hai anh bạn</passage>
-            <answer>"title": "Oliver Twist","author": "Charles Dickens"</answer>
 
-            Now, here is the passage. Please provide the book title and its author:
-            <passage>{passage}</passage>
-            You must format your output exactly as follows:
-            <output>"title": "Book title","author": "author name"</output>
-        """
+if __name__ == "__main__":
+    parser = ArgumentParser(description=f"Estimates tokens and dollar cost of direct probing on {MODEL}")
+    parser.add_argument("path", nargs="?", choices=["sync", "batch"], default="sync",
+                        help="sync prices Openai_direct_probing, batch prices Batch_api_DP at Batch API rates")
+    parser.add_argument("--data", default=os.path.join(PROMPTS_DIR, "*/*_non_NE.json"),
+                        help="Glob of the JSON files the sync path reads")
+    parser.add_argument("--base_dir", default=PROMPTS_DIR, help="Folder searched for the _non_NE.csv files of the batch path")
+    parser.add_argument("--prompt_setting", default="one-shot", choices=["zero-shot", "one-shot"],
+                        help="Prompt setting of the sync path, the batch path always sends one-shot")
+    add_estimate_arguments(parser)
+    args = parser.parse_args()
+    args.model = MODEL
+    args.modes = [args.path]
+
+    if args.path == "sync":
+        label = f"Openai_direct_probing ({args.prompt_setting})"
+        prompts, sampling_params, tags = sync_prompts(sorted(glob.glob(args.data)), args.prompt_setting)
     else:
-        text = f"""
-            You are provided with a passage in {lang}. Your task is to carefully read the passage and identify the book it originated from and the book's author.
-
-            Example:
-            <passage>I am afraid I must be going, Basil.</passage>
-            <answer>"title": "The Picture of Dorian Gray", "author": "Oscar Wilde"</answer>
-            
-            Now, here is the passage. Please provide the book title and its author:
-            <passage>{passage}</passage>
-            You must format your output exactly as follows:
-            <output>"title": "Book title","author": "author name"</output>
-        """
-    return count_token_in_string(text)
+        label = "Batch_api_DP (one-shot)"
+        prompts, sampling_params, tags = batch_prompts(args.base_dir)
+    print(f"{len(set(book for book, _, _ in tags))} books")
 
-
-def direct_probe(csv_file_name):
-    try:
-        df = pd.read_csv(csv_file_name)
-        total_token = 0
-        total_lines = 0
-
-        for language in df.columns:
-            if language != 'Entity':
-                for i in range(len(df)):
-                    passage = df[language].iloc[i]
-                    total_token += predict(language, passage)
-                    total_lines += 1
-        
-        avg_tokens_per_line = total_token / total_lines
-        print(f"Total tokens in {title}: {total_token}")
-        print(f"Average tokens per line in {title}: {round(avg_tokens_per_line)}")
-        print(f'Projected token output per line in {title}: {round(avg_tokens_per_line/2)}')
-        print(f"Total lines in {title}: {total_lines}")
-        print(f'Projected cost: {(total_token*3/1000000+(20)*3/1000000)}')
-        print('\n')
-        return (total_token*3/1000000+(20)*3/1000000)
-    except:
-        print(f'{title} is missing\n')
-        return 0
-
-def get_folder_names(directory):
-    folder_names = []
-    for item in os.listdir(directory):
-        item_path = os.path.join(directory, item)
-        if os.path.isdir(item_path):
-            folder_names.append(item)
-    return folder_names
-
-if __name__ == "__main__":
-    titles = get_folder_names('/home/ekorukluoglu_umass_edu/beam2/BEAM/scripts/Prompts/')
-    total = 0
-    for title in titles:
-        if title != 'raw':
-            print(f'----------------- running {title} -----------------')
-            total += direct_probe(f"/home/ekorukluoglu_umass_edu/beam2/BEAM/scripts/Prompts/{title}/{title}_non_NE.csv")
-    print(f'\ntotal amount for all books: {total}')
\ No newline at end of file
+    counter = make_counter(args.tokenizer, MODEL)
+    estimates = estimate_prompts(counter, prompts, sampling_params, tags, args.output_tokens, dedup=not args.no_dedup)
+    print_estimates(label, estimates, args)
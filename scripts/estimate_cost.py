@@ -0,0 +1,217 @@
+import os
+import sys
+import glob
+from argparse import ArgumentParser
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(SCRIPTS_DIR)
+
+from run_probes import TASKS, PROMPT_SETTINGS, load_books
+import prefix_probe
+from common import tokenization
+from common.backends import SamplingParams, estimate_tokens, replay_key
+from common.batching import collect_prompts
+from common.pricing import model_prices, request_cost
+
+# auto: tiktoken for the OpenAI models in the price table, the model's own chat template and
+# tokenizer for models run on vLLM. approx: 4 characters per token, no tokenizer needed.
+TOKENIZERS = ["auto", "tiktoken", "hf", "approx"]
+
+MODES = ["sync", "batch"]
+
+
+def make_counter(tokenizer, model, prompt_cache_path=None):
+    """
+    Returns a function mapping a list of conversations to the prompt tokens each one costs on `model`.
+    """
+    if tokenizer == "auto":
+        tokenizer = "tiktoken" if model_prices(model) is not None else "hf"
+    if tokenizer == "tiktoken":
+        encoding = tokenization.encoding_for_model(model)
+        return lambda conversations: tokenization.count_chat_tokens(conversations, encoding)
+    if tokenizer == "hf":
+        hf_tokenizer = tokenization.get_hf_tokenizer(model)
+        prompt_cache = None
+        if prompt_cache_path:
+            from common.prompt_cache import PromptTokenCache
+            prompt_cache = PromptTokenCache(prompt_cache_path, hf_tokenizer)
+        return lambda conversations: tokenization.count_templated_tokens(conversations, hf_tokenizer, prompt_cache)
+    no_output = SamplingParams(max_tokens=0)
+    return lambda conversations: [estimate_tokens(conversation, no_output) for conversation in conversations]
+
+
+def make_text_counter(tokenizer, model):
+    """
+    Returns a function mapping plain texts to their token counts on `model`, which sizes the prefix
+    probe's max_tokens like run_probes does. None for the approx tokenizer, which leaves every
+    budget at the task's maximum.
+    """
+    if tokenizer == "auto":
+        tokenizer = "tiktoken" if model_prices(model) is not None else "hf"
+    if tokenizer == "tiktoken":
+        encoding = tokenization.encoding_for_model(model)
+        return lambda texts: tokenization.count_tokens(texts, encoding)
+    if tokenizer == "hf":
+        hf_tokenizer = tokenization.get_hf_tokenizer(model)
+        return lambda texts: tokenization.count_hf_tokens(texts, hf_tokenizer)
+    return None
+
+
+def estimate_prompts(counter, prompts, sampling_params, tags, output_tokens=None, dedup=True, chunk_size=4096):
+    """
+    Returns {book: [requests, sent requests, prompt tokens, output tokens]} for the prompts of one
+    (task, prompt setting). With dedup, a prompt asked for more than once is sent (and counted) once,
+    against the first book that asks for it. Output tokens are max_tokens, or `output_tokens`
+    capped at max_tokens.
+    """
+    first = {}
+    for i, (conversation, params) in enumerate(zip(prompts, sampling_params)):
+        first.setdefault(replay_key(conversation, params) if dedup else i, i)
+    sent = sorted(first.values())
+
+    prompt_tokens = {}
+    for start in range(0, len(sent), chunk_size):
+        chunk = sent[start:start + chunk_size]
+        prompt_tokens.update(zip(chunk, counter([prompts[i] for i in chunk])))
+
+    books = {}
+    for i, (params, (book_title, _, _)) in enumerate(zip(sampling_params, tags)):
+        book = books.setdefault(book_title, [0, 0, 0, 0])
+        book[0] += 1
+        if i in prompt_tokens:
+            book[1] += 1
+            book[2] += prompt_tokens[i]
+            book[3] += params.max_tokens if output_tokens is None else min(output_tokens, params.max_tokens)
+    return books
+
+
+def gpu_hours(prompt_tokens, output_tokens, gpus, generated_tokens_per_second, prompt_tokens_per_second=None):
+    """
+    GPU-hours of a run from measured throughput: decode time, plus prefill time when its rate is known.
+    """
+    seconds = output_tokens / generated_tokens_per_second
+    if prompt_tokens_per_second:
+        seconds += prompt_tokens / prompt_tokens_per_second
+    return gpus * seconds / 3600
+
+
+def format_estimate(label, estimate, args):
+    requests, sent, prompt_tokens, output_tokens = estimate
+    line = (f"{label}: {requests} requests ({sent} sent), {prompt_tokens} prompt tokens, "
+            f"{output_tokens} output tokens")
+    costs = []
+    for mode in args.modes:
+        cost = request_cost(args.model, prompt_tokens, output_tokens, batch=mode == "batch")
+        if cost is not None:
+            costs.append(f"${cost:.2f} {mode}")
+    if costs:
+        line += ", " + " / ".join(costs)
+    if args.generated_tokens_per_second:
+        hours = gpu_hours(prompt_tokens, output_tokens, args.gpus, args.generated_tokens_per_second,
+                          args.prompt_tokens_per_second)
+        line += f", {hours:.1f} GPU-hours on {args.gpus} GPUs"
+    return line
+
+
+def add_estimates(total, estimate):
+    return [a + b for a, b in zip(total, estimate)]
+
+
+def add_estimate_arguments(parser):
+    """
+    Arguments shared by every estimate: tokenizer, expected output, dedup, throughput and per book output.
+    """
+    parser.add_argument("--tokenizer", type=str, default="auto", choices=TOKENIZERS)
+    parser.add_argument("--output_tokens", type=int, default=None,
+                        help="Expected output tokens per request, capped at max_tokens. Defaults to max_tokens, an upper bound")
+    parser.add_argument("--no_dedup", action="store_true", help="Count identical prompts once per row, as runs with --no_dedup send them")
+    parser.add_argument("--gpus", type=int, default=1)
+    parser.add_argument("--generated_tokens_per_second", type=float, default=None,
+                        help="Measured decode throughput of the model on --gpus GPUs, enables the GPU-hour estimate")
+    parser.add_argument("--prompt_tokens_per_second", type=float, default=None,
+                        help="Measured prefill throughput, prefill time is left out if not set")
+    parser.add_argument("--per_book", action="store_true", help="Print an estimate for every book")
+
+
+def batch_request_prompts(book_name, requests_list):
+    """
+    Conversations, sampling params and tags of Batch API request objects, priced as the bodies are sent.
+    """
+    prompts, sampling_params, tags = [], [], []
+    for request in requests_list:
+        body = request["body"]
+        prompts.append(body["messages"])
+        sampling_params.append(SamplingParams(temperature=body.get("temperature", 1.0),
+                                              max_tokens=body["max_tokens"]))
+        tags.append((book_name, request["custom_id"], None))
+    return prompts, sampling_params, tags
+
+
+def print_estimates(label, estimates, args):
+    """
+    Prints the estimate of every book with --per_book and their total, which is returned.
+    """
+    total = [0, 0, 0, 0]
+    for book_title, estimate in estimates.items():
+        if args.per_book:
+            print(format_estimate(book_title, estimate, args))
+        total = add_estimates(total, estimate)
+    print(format_estimate(label, total, args))
+    return total
+
+
+def main(argv=None):
+    parser = ArgumentParser(description="Estimates tokens, dollar cost and GPU-hours of a run before launching it, "
+                                        "from the prompts the task modules actually build")
+    parser.add_argument("model", type=str, help="Model the run will use, an OpenAI model or a Hugging Face model id")
+    for task_name in TASKS:
+        parser.add_argument(f"--{task_name}_data", type=str, default=None,
+                            help=f"Glob of data files to estimate {task_name} on, the task is skipped if not set")
+    parser.add_argument("--prompt_settings", nargs="+", default=PROMPT_SETTINGS, choices=PROMPT_SETTINGS)
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES,
+                        help="Price synchronous requests, Batch API requests or both")
+    parser.add_argument("--prompt_cache", type=str, default=None,
+                        help="PromptTokenCache file of a previous vLLM run, so already templated prompts are not tokenized again")
+    parser.add_argument("--prefix_cache_layout", action="store_true",
+                        help="Estimate the prefix probe prompt run_probes uses with --prefix_cache_layout")
+    add_estimate_arguments(parser)
+    args = parser.parse_args(argv)
+
+    task_data = {}
+    for task_name in TASKS:
+        pattern = getattr(args, f"{task_name}_data")
+        if pattern:
+            task_data[task_name] = sorted(glob.glob(pattern, recursive=True))
+            print(f"{task_name}: {len(task_data[task_name])} data files")
+    if not task_data:
+        parser.error("no task selected, pass at least one --<task>_data glob")
+
+    templates = {"prefix_probe": prefix_probe.PREFIX_CACHE_PROMPT} if args.prefix_cache_layout else None
+
+    counter = make_counter(args.tokenizer, args.model, args.prompt_cache)
+    count_tokens = make_text_counter(args.tokenizer, args.model)
+    if model_prices(args.model) is None:
+        print(f"No price for {args.model}, only tokens and GPU-hours are estimated")
+
+    total = [0, 0, 0, 0]
+    for task_name, data_paths in task_data.items():
+        task = TASKS[task_name]
+        books = load_books(task, data_paths, templates, count_tokens)
+        for prompt_setting in args.prompt_settings:
+            print(f'----------------- {task.name} | {len(books)} books | {prompt_setting} -----------------')
+            try:
+                prompts, sampling_params, tags = collect_prompts(task.module, books, prompt_setting)
+                estimates = estimate_prompts(counter, prompts, sampling_params, tags, args.output_tokens,
+                                             dedup=not args.no_dedup)
+            except Exception as e:
+                print(f'Error estimating {task.name} ({prompt_setting}): {e}')
+                continue
+            task_total = print_estimates(f"{task.name} ({prompt_setting})", estimates, args)
+            total = add_estimates(total, task_total)
+
+    print()
+    print(format_estimate("Total", total, args))
+
+
+if __name__ == "__main__":
+    main()
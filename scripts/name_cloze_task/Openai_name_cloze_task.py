@@ -1,24 +1,23 @@
-from bs4 import BeautifulSoup
-from openai import OpenAI
 import pandas as pd
 import os
+import sys
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.async_openai import backend_stats, make_openai_backend
+from common.backends import SamplingParams
+from common.extraction import extract_tag
 
-client = OpenAI(
-    api_key=os.environ['OpenAI_API_KEY'],
-)
 
+MODEL = "gpt-4o-2024-11-20"
+
+SAMPLING_PARAMS = SamplingParams(temperature=0.0, max_tokens=100)
 
-def extract_output(llm_output):
-    soup = BeautifulSoup(llm_output, 'html.parser')
-    name_tag = soup.find('name')
-    if name_tag:
-        return name_tag.decode_contents()
 
-    return None
+def extract_output(llm_output):
+    return extract_tag(llm_output, 'name')
 
 
-def predict(lang, passage, mode="unshuffled", prompt_setting="zero-shot"):
+def build_prompt(lang, passage, mode="unshuffled", prompt_setting="zero-shot"):
     
     demonstrations = {
                 "es": {
@@ -86,42 +85,54 @@ def predict(lang, passage, mode="unshuffled", prompt_setting="zero-shot"):
         <output>Name</output>
     """
 
-    completion = client.chat.completions.create(
-        model="gpt-4o-2024-11-20",
-
-        max_tokens=100,
+    return prompt
 
-        messages=[
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.0
-    )
-
-    extract = extract_output(completion.choices[0].message.content)
+def parse_content(content):
+    extract = extract_output(content)
     if extract:
         return extract
     else:
-        print(completion.choices[0].message.content)
-    return completion.choices[0].message.content
+        print(content)
+    return content
+
+def build_conversations(lang, passages, mode="unshuffled", prompt_setting="zero-shot"):
+    return [[{"role": "user", "content": build_prompt(lang, passage, mode, prompt_setting)}] for passage in passages]
+
+def iter_columns(df):
+    """
+    Yields (column, base language, mode) of every column of the data that is run.
+    """
+    for language in df.columns:
+        if language != 'Single_ent':
+            mode = "shuffled" if "shuffled" in language.lower() else "unshuffled"
+            yield language, language.split('_')[0], mode
+
+def predict_column(lang, passages, backend, mode="unshuffled", prompt_setting="zero-shot"):
+    """
+    Sends every passage of a column concurrently. A failed request raises.
+    """
+    conversations = build_conversations(lang, passages, mode, prompt_setting)
+
+    output = []
+    for result in backend.generate_settled(conversations, SAMPLING_PARAMS):
+        if isinstance(result, Exception):
+            raise result
+        output.append(parse_content(result.text))
+    return output
 
-def name_cloze_task(csv_file_name, book_title, prompt_setting="zero-shot"):
+def name_cloze_task(csv_file_name, book_title, backend, prompt_setting="zero-shot"):
     try:
         df = pd.read_json(csv_file_name)
 
-        for language in df.columns:
-            if language != 'Single_ent':
-                print(f'Running {language}')
-                output = []
-                mode = "shuffled" if "shuffled" in language.lower() else "unshuffled"
-                for i in range(len(df)):
-                    masked_passage = df[language].iloc[i]
-                    base_language = language.split('_')[0]
-                    content = predict(base_language, masked_passage, mode, prompt_setting)
-                    print(f'{i}: {content}, {masked_passage}, {base_language}')
-                    output.append(content)
-                index_of_language = df.columns.get_loc(language)
-                guess_results = pd.Series(output)
-                df.insert(index_of_language + 1, f"{language}_results", guess_results)
+        for language, base_language, mode in list(iter_columns(df)):
+            print(f'Running {language}')
+            masked_passages = df[language].tolist()
+            output = predict_column(base_language, masked_passages, backend, mode, prompt_setting)
+            for i, (content, masked_passage) in enumerate(zip(output, masked_passages)):
+                print(f'{i}: {content}, {masked_passage}, {base_language}')
+            index_of_language = df.columns.get_loc(language)
+            guess_results = pd.Series(output)
+            df.insert(index_of_language + 1, f"{language}_results", guess_results)
                 
         df.to_csv(f"out/{book_title}_name_cloze_gpt-4o-2024-11-20_{prompt_setting}.csv", index=False, encoding='utf-8')
     except Exception as e:
@@ -137,6 +148,8 @@ def get_folder_names(directory):
     return folder_names
 
 if __name__ == "__main__":
+    backend = make_openai_backend(MODEL)
     data_path = ""
     filename =  os.path.basename(data_path).replace(".json","")
-    name_cloze_task(data_path,filename,"one-shot")
\ No newline at end of file
+    name_cloze_task(data_path,filename,backend,"one-shot")
+    print(backend_stats(backend, MODEL))
@@ -1,9 +1,11 @@
 import os
 import glob
-import json
-import time
-import openai
+import sys
 import pandas as pd
+from argparse import ArgumentParser
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.batch_cli import add_batch_arguments, run_batch_cli
 
 ALLOWED_COLUMNS = [
     "st_shuffled", "yo_shuffled", "ty_shuffled", "tn_shuffled", "mai_shuffled", "mg_shuffled"
@@ -86,11 +88,10 @@ def construct_prompt(lang, passage, mode, prompt_setting="zero-shot"):
     except Exception as e:
         print(e)
 
-def prepare_jsonl_input_file(csv_file_path, output_dir):
+def build_requests(csv_file_path):
     """
-    Reads the CSV file and creates a JSONL file with one API request per passage.
+    Reads the CSV file and builds one API request per passage.
     Each request is given a unique custom_id in the format <column>_<row>.
-    Saves the JSONL file in the output_dir using the book name.
     """
     df = pd.read_csv(csv_file_path)
     requests_list = []
@@ -115,99 +116,7 @@ def prepare_jsonl_input_file(csv_file_path, output_dir):
                 }
             }
             requests_list.append(request_obj)
-    
-    os.makedirs(output_dir, exist_ok=True)
-    jsonl_file_path = os.path.join(output_dir, f"{book_name}_batch_input.jsonl")
-    
-    with open(jsonl_file_path, "w", encoding="utf-8") as f:
-        for req in requests_list:
-            f.write(json.dumps(req) + "\n")
-    
-    return requests_list, df, jsonl_file_path, book_name
-
-def upload_file_to_openai(client, jsonl_file_path):
-    """
-    Uploads the JSONL file to OpenAI using the Files API.
-    """
-    with open(jsonl_file_path, "rb") as f:
-        batch_file = client.files.create(file=f, purpose="batch")
-    return batch_file.id
-
-def create_batch(client, input_file_id):
-    """
-    Initiates a batch process with the given input_file_id.
-    """
-    batch = client.batches.create(
-        input_file_id=input_file_id,
-        endpoint="/v1/chat/completions",
-        completion_window="24h"
-    )
-    return batch.id
-
-def poll_batch_completion(client, batch_id, poll_interval=30):
-    """
-    Polls the batch status every poll_interval seconds until it is complete.
-    Raises an exception if the batch fails or expires.
-    """
-    while True:
-        batch = client.batches.retrieve(batch_id)
-        status = batch.status
-        print(f"Batch {batch_id} status: {status}")
-        if status == "completed":
-            return batch
-        elif status in ["failed", "expired"]:
-            raise Exception(f"Batch {batch_id} failed or expired")
-        time.sleep(poll_interval)
-
-def download_and_parse_results(client, batch):
-    """
-    Downloads the output file from the completed batch and parses each JSON line.
-    Returns a dictionary mapping custom_id to the model response.
-    """
-    output_file_id = batch.output_file_id
-    file_response = client.files.content(output_file_id)
-    file_contents = file_response.text
-
-    results = {}
-    for line in file_contents.splitlines():
-        response_data = json.loads(line)
-        custom_id = response_data.get("custom_id")
-        if response_data.get("error"):
-            results[custom_id] = None
-        else:
-            content = response_data["response"]["body"]["choices"][0]["message"]["content"]
-            results[custom_id] = content
-    return results
-
-def update_dataset_with_results(df, results):
-    """
-    For each allowed column in the DataFrame, creates a new column that contains the response
-    corresponding to each passage.
-    """
-    for col in df.columns:
-        if col not in ALLOWED_COLUMNS:
-            continue
-        result_col = []
-        for idx in df.index:
-            custom_id = f"{col}_{idx}"
-            result_col.append(results.get(custom_id))
-        df[f"{col}_results"] = result_col
-    return df
-
-def process_csv(client, csv_file_path, batches_dir):
-    """
-    Process a single CSV: generate JSONL, upload file, create a batch, and return batch info.
-    """
-    requests_list, df, jsonl_file_path, book_name = prepare_jsonl_input_file(csv_file_path, batches_dir)
-    print(f"Prepared {len(requests_list)} requests for {csv_file_path} in {jsonl_file_path}")
-    
-    input_file_id = upload_file_to_openai(client, jsonl_file_path)
-    print(f"Uploaded file for {csv_file_path}. input_file_id: {input_file_id}")
-    
-    batch_id = create_batch(client, input_file_id)
-    print(f"Created batch for {csv_file_path} with ID: {batch_id}")
-    
-    return batch_id, df, book_name
+    return requests_list, df, book_name
 
 def extract_book_name(csv_file_path):
     """
@@ -222,39 +131,13 @@ def extract_book_name(csv_file_path):
         book_name = base.split("_")[0]
     return book_name
 
-def main():
-    openai.api_key = os.getenv("OPENAI_API_KEY")
-    client = openai.Client(api_key=os.getenv("OPENAI_API_KEY"))
-    
-    base_dir = "/Users/alishasrivastava/BEAM-scripts/BEAM/scripts/Prompts/Alice_in_Wonderland"
+def find_csv_files(base_dir):
     all_csvs = glob.glob(os.path.join(base_dir, "**/*.csv"), recursive=True)
-    csv_files = [f for f in all_csvs if "2024" not in f and f.endswith("_masked_passages.csv")]    # Hardcoded folder path for storing batches and results
-    batches_dir = "/Users/alishasrivastava/BEAM-scripts/BEAM/scripts/name_cloze_task/batches/alice"
-    
-    if not csv_files:
-        print("No CSV files found in", base_dir)
-        return
-    
-    batch_info = {}
-    
-    for csv_file in csv_files:
-        try:
-            batch_id, df, book_name = process_csv(client, csv_file, batches_dir)
-            batch_info[batch_id] = {"df": df, "book_name": book_name, "csv_file": csv_file}
-        except Exception as e:
-            print(f"Error processing {csv_file}: {e}")
-    
-    #for every submitted batch, poll for completion and update the dataset
-    for batch_id, info in batch_info.items():
-        try:
-            batch = poll_batch_completion(client, batch_id)
-            results = download_and_parse_results(client, batch)
-            updated_df = update_dataset_with_results(info["df"], results)
-            updated_csv_path = os.path.join(batches_dir, f"{info['book_name']}_results.csv")
-            updated_df.to_csv(updated_csv_path, index=False)
-            print(f"Updated dataset saved to {updated_csv_path} for CSV {info['csv_file']}")
-        except Exception as e:
-            print(f"Error with batch {batch_id}: {e}")
+    return [f for f in all_csvs if "2024" not in f and f.endswith("_masked_passages.csv")]
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = ArgumentParser()
+    add_batch_arguments(parser,
+                        base_dir="/Users/alishasrivastava/BEAM-scripts/BEAM/scripts/Prompts/Alice_in_Wonderland",
+                        batches_dir="/Users/alishasrivastava/BEAM-scripts/BEAM/scripts/name_cloze_task/batches/alice")
+    run_batch_cli(parser.parse_args(), find_csv_files, build_requests, ALLOWED_COLUMNS)
@@ -1,122 +1,73 @@
-import pandas as pd
-import tiktoken
 import os
+import sys
+import glob
+import pandas as pd
+from argparse import ArgumentParser
 
+# Estimates what the gpt-4o name cloze runs are billed for: the sync path builds its requests with
+# Openai_name_cloze_task from the JSON data, the batch path with batch.py from the CSV data, so the
+# prompts, columns and max_tokens priced are the ones those scripts send.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from estimate_cost import add_estimate_arguments, batch_request_prompts, estimate_prompts, make_counter, print_estimates
+import Openai_name_cloze_task
+import batch
 
-def count_token_in_string(string: str, encoding_name: str = "o200k_base") -> int:
-    """
-    Returns the number of tokens in a text string using the specified encoding.
+PROMPTS_DIR = '/home/ekorukluoglu_umass_edu/beam2/BEAM/scripts/Prompts/'
+MODEL = "gpt-4o-2024-11-20"
 
-    Args:
-    string (str): The text string to tokenize.
-    encoding_name (str): The encoding name. Default is "o200k_base". New for gpt-4o.
 
-    Returns:
-    int: The number of tokens in the text string.
+def sync_prompts(data_paths, prompt_setting):
+    """
+    Conversations, sampling params and tags of the requests Openai_name_cloze_task sends for the JSON files.
     """
-    # Load the encoding
-    encoding = tiktoken.get_encoding(encoding_name)
+    prompts, sampling_params, tags = [], [], []
+    for data_path in data_paths:
+        book_title = os.path.basename(data_path).replace(".json", "")
+        df = pd.read_json(data_path)
+        for language, base_language, mode in Openai_name_cloze_task.iter_columns(df):
+            conversations = Openai_name_cloze_task.build_conversations(base_language, df[language].tolist(), mode, prompt_setting)
+            prompts.extend(conversations)
+            sampling_params.extend([Openai_name_cloze_task.SAMPLING_PARAMS] * len(conversations))
+            tags.extend((book_title, language, i) for i in range(len(conversations)))
+    return prompts, sampling_params, tags
 
-    # Convert the string into tokens and count them
-    num_tokens = len(encoding.encode(string))
-    return num_tokens
 
+def batch_prompts(base_dir):
+    """
+    Conversations, sampling params and tags of the requests batch.py submits for the CSV files under base_dir.
+    """
+    prompts, sampling_params, tags = [], [], []
+    for csv_file in batch.find_csv_files(base_dir):
+        requests_list, _, book_name = batch.build_requests(csv_file)
+        book_prompts, book_sampling_params, book_tags = batch_request_prompts(book_name, requests_list)
+        prompts.extend(book_prompts)
+        sampling_params.extend(book_sampling_params)
+        tags.extend(book_tags)
+    return prompts, sampling_params, tags
 
-# replace the prompt with the correct language when running experiments
-def predict(lang, passage):
-    if lang == "es":
-        text = f"""
-            You are provided with a passage in {lang}. Your task is to carefully read the passage and determine what proper name goes into the [MASK]. This name is a proper name (not a pronoun or any other word). You must make a guess, even if you are uncertain.
-    
-            Example:
-            <passage>Creo que incluso [MASK] estaría de acuerdo con tu opinión</passage>
-            <name>Kafka</name>
-    
-            Read the following passage and determine what proper name fills in the [MASK]:
-            <passage>{passage}</passage>
-            You must format your output exactly as follows: 
-            <name>Name</name>
-        """
-    elif lang == "tr":
-        text = f"""
-            You are provided with a passage in {lang}. Your task is to carefully read the passage and determine what proper name goes into the [MASK]. This name is a proper name (not a pronoun or any other word). You must make a guess, even if you are uncertain.
 
-            Example:
-            <passage>Sadece [MASK] değil tüm grup hayduttu ve diğer insanlardan ayrı yaşıyorlardı</passage>
-            <name>Robin</name>
+if __name__ == "__main__":
+    parser = ArgumentParser(description=f"Estimates tokens and dollar cost of the name cloze task on {MODEL}")
+    parser.add_argument("path", nargs="?", choices=["sync", "batch"], default="sync",
+                        help="sync prices Openai_name_cloze_task, batch prices batch.py at Batch API rates")
+    parser.add_argument("--data", default=os.path.join(PROMPTS_DIR, "*/*_masked.json"),
+                        help="Glob of the JSON files the sync path reads")
+    parser.add_argument("--base_dir", default=PROMPTS_DIR, help="Folder searched for the _masked_passages.csv files of the batch path")
+    parser.add_argument("--prompt_setting", default="one-shot", choices=["zero-shot", "one-shot"],
+                        help="Prompt setting of the sync path, the batch path always sends one-shot")
+    add_estimate_arguments(parser)
+    args = parser.parse_args()
+    args.model = MODEL
+    args.modes = [args.path]
 
-            Read the following passage and determine what proper name fills in the [MASK]:
-            <passage>{passage}</passage>
-            You must format your output exactly as follows: 
-            <name>Name</name>
-            """
-    elif lang == "vi":
-        text = f"""
-            You are provided with a passage in {lang}. Your task is to carefully read the passage and determine what proper name goes into the [MASK]. This name is a proper name (not a pronoun or any other word). You must make a guess, even if you are uncertain.
-    
-            Example:
-            <passage>"Rõ ràng đây là điều rất bình thường, chẳng có ai ăn bánh mà lại bị to ra hay bé đi cả, nhưng [MASK] đang quá trông chờ vào những điều bất thường nên khi cái điều bình thường đó xảy ra đã khiến cô cảm thấy cuộc đời sao mà ảm đạm và đáng chán."</passage>
-            <name>Alice</name>
-            
-            Read the following passage and determine what proper name fills in the [MASK]:
-            <passage>{passage}</passage>
-            You must format your output exactly as follows: 
-            <name>Name</name>
-        """
+    if args.path == "sync":
+        label = f"Openai_name_cloze_task ({args.prompt_setting})"
+        prompts, sampling_params, tags = sync_prompts(sorted(glob.glob(args.data)), args.prompt_setting)
     else:
-        text = f"""
-            You are provided with a passage in {lang}. Your task is to carefully read the passage and determine what proper name goes into the [MASK]. This name is a proper name (not a pronoun or any other word). You must make a guess, even if you are uncertain.
+        label = "batch.py (one-shot)"
+        prompts, sampling_params, tags = batch_prompts(args.base_dir)
+    print(f"{len(set(book for book, _, _ in tags))} books")
 
-            Example:
-            <passage>Stay gold, [MASK], stay gold.</passage>
-            <name>Ponyboy</name>
-            
-            Read the following passage and determine what proper name fills in the [MASK]:
-            <passage>{passage}</passage>
-            You must format your output exactly as follows: 
-            <name>Name</name>
-            """
-    return count_token_in_string(text)
-
-
-def direct_probe(csv_file_name):
-    try:
-        df = pd.read_csv(csv_file_name)
-        total_token = 0
-        total_lines = 0
-
-        for language in df.columns:
-            if language != 'Entity':
-                for i in range(len(df)):
-                    passage = df[language].iloc[i]
-                    total_token += predict(language, passage)
-                    total_lines += 1
-        
-        avg_tokens_per_line = total_token / total_lines
-        print(f"Total tokens in {title}: {total_token}")
-        print(f"Average tokens per line in {title}: {round(avg_tokens_per_line)}")
-        print(f'Projected token output per line in {title}: {round(avg_tokens_per_line/2)}')
-        print(f"Total lines in {title}: {total_lines}")
-        print(f'Projected cost: {(total_token*5/1000000+(20)*15/1000000)}')
-        print('\n')
-        return (total_token*5/1000000+(20)*15/1000000)
-    except:
-        print(f'{title} is missing\n')
-        return 0
-
-def get_folder_names(directory):
-    folder_names = []
-    for item in os.listdir(directory):
-        item_path = os.path.join(directory, item)
-        if os.path.isdir(item_path):
-            folder_names.append(item)
-    return folder_names
-
-if __name__ == "__main__":
-    titles = get_folder_names('/home/nhatminhle_umass_edu/Prompts')
-    total = 0
-    for title in titles:
-        if title != 'raw':
-            print(f'----------------- running {title} -----------------')
-            total += direct_probe(f"/home/nhatminhle_umass_edu/Prompts/{title}/{title}_ner.csv")
-    print(f'\ntotal amount for all books: {total}')
+    counter = make_counter(args.tokenizer, MODEL)
+    estimates = estimate_prompts(counter, prompts, sampling_params, tags, args.output_tokens, dedup=not args.no_dedup)
+    print_estimates(label, estimates, args)
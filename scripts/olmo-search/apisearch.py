@@ -1,11 +1,18 @@
 import os
+import sys
 import pandas as pd
 import requests
-import time
 import textwrap
 import pprint
 import logging
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.rate_limit import get_limiter, retry_after
+
+# Requests per second sent to infini-gram, the shared limiter slows down further on every 429
+INFINI_GRAM_REQUESTS_PER_SECOND = 10
+limiter = get_limiter("infini-gram", requests_per_second=INFINI_GRAM_REQUESTS_PER_SECOND)
+
 # Configure logging
 
 logging.basicConfig(
@@ -56,9 +63,11 @@ def search_passages_in_infini_gram(root_folder, index_name, output_file):
                 }
 
                 for attempt in range(5):
+                    limiter.acquire()
                     response = requests.post('https://api.infini-gram.io/', json=payload)
                     # print(response.status_code)
                     if response.status_code == 200:
+                        limiter.on_success()
                         result = response.json()
                         # count =result.get('count',0)
                         logging.info(result)
@@ -83,17 +92,11 @@ def search_passages_in_infini_gram(root_folder, index_name, output_file):
                         break
                     elif response.status_code == 429:
                         logging.info("RATELIMITTTT")
-                        time.sleep(1)
+                        limiter.on_rate_limited(retry_after(response.headers) or 1)
                     else:
                         logging.info(f"Error: {response.status_code} - {response.text}")
                         break
 
-# Optional: convert to DataFrame
-
-
-                    # Small delay to avoid hammering the server
-                    time.sleep(0.1)
-
     # Save results to a CSV file
     results_df = pd.DataFrame(results)
     results_df.to_csv(output_file, index=False)
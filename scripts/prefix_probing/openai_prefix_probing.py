@@ -1,26 +1,31 @@
 import pandas as pd
-from bs4 import BeautifulSoup
-from openai import OpenAI
 import os
 import re
+import sys
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.async_openai import backend_stats, make_openai_backend
+from common.backends import SamplingParams
+from common.extraction import extract_all_tag_texts
 
-client = OpenAI(
-    api_key=os.environ['OpenAI_API_KEY'],
-)
+
+MODEL = "gpt-4o-2024-11-20"
+
+SAMPLING_PARAMS = SamplingParams(temperature=0.0, max_tokens=100)
+
+LANGUAGES = ["en", "vi", "es", "tr"]
 
 
 def extract_output(text):
-    soup = BeautifulSoup(text, 'html.parser')
-    passages = soup.find_all('continuation')
+    passages = extract_all_tag_texts(text, 'continuation')
 
     if passages:
-        return max([passage.get_text() for passage in passages])
+        return max(passages, key=len)
     else:
         return None
 
 
-def predict(passage, lang, word_count, prompt_setting="zero-shot"):
+def build_prompt(passage, lang, word_count, prompt_setting="zero-shot"):
 
     demonstrations = {
         "es": {
@@ -64,23 +69,35 @@ def predict(passage, lang, word_count, prompt_setting="zero-shot"):
        <continuation>Passage continuation</continuation>
     """
 
-    completion = client.chat.completions.create(
-        model="gpt-4o-2024-11-20",
+    return prompt
 
-        max_tokens=100,
 
-        messages=[
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.0
-    )
-    
-    extract = extract_output(completion.choices[0].message.content)
+def parse_content(content):
+    extract = extract_output(content)
     if extract:
         return extract
     else:
-        print(completion.choices[0].message.content)
-    return completion.choices[0].message.content
+        print(content)
+    return content
+
+
+def build_conversations(passages, lang, word_counts, prompt_setting="zero-shot"):
+    return [
+        [{"role": "user", "content": build_prompt(passage, lang, word_count, prompt_setting)}]
+        for passage, word_count in zip(passages, word_counts)
+    ]
+
+
+def predict_column(passages, lang, word_counts, backend, prompt_setting="zero-shot"):
+    """
+    Sends every passage of a column concurrently. A failed request gives its exception in place of the completion.
+    """
+    conversations = build_conversations(passages, lang, word_counts, prompt_setting)
+
+    return [
+        result if isinstance(result, Exception) else parse_content(result.text)
+        for result in backend.generate_settled(conversations, SAMPLING_PARAMS)
+    ]
 
 
 def split_sentence_in_half(sentence):
@@ -131,22 +148,23 @@ def remove_extra_suffix(text, limit):
             return text[:next_space]
 
 
-def prefixProbe(csv_file_name, book_title, prompt_setting="zero-shot"):
+def prefixProbe(csv_file_name, book_title, backend, prompt_setting="zero-shot"):
     try:
         df = pd.read_json(csv_file_name)
         df_out = pd.DataFrame()
 
-        languages = ["en", "vi", "es", "tr"]
-        for lang in languages:
+        for lang in LANGUAGES:
             if lang in df.columns:
                 print(f'///running {lang}///')
+                halves = [split_sentence_in_half(full_passage) for full_passage in df[lang]]
+                completions = predict_column([first_half for first_half, _, _ in halves], lang,
+                                             [word_count for _, _, word_count in halves], backend, prompt_setting)
                 output = []
-                for i in range(len(df)):
-                    full_passage = df[lang].iloc[i]
-                    first_half, second_half, word_count = split_sentence_in_half(full_passage)
+                for (first_half, second_half, word_count), completion in zip(halves, completions):
                     try:
                         print(f"Running prompt for {lang}: {first_half}")
-                        completion = predict(first_half, lang, word_count, prompt_setting)
+                        if isinstance(completion, Exception):
+                            raise completion
                         trimmed_completion = remove_extra_suffix(trim_common_prefix_suffix(first_half, completion), len(second_half))
                         output.append([first_half, second_half, trimmed_completion])
                     except Exception as e:
@@ -169,7 +187,9 @@ def get_folder_names(directory):
     return folder_names
 
 if __name__ == "__main__":
+    backend = make_openai_backend(MODEL)
     
     data_path = ""
     filename =  os.path.basename(data_path).replace(".json","")
-    prefixProbe(csv_file_name=data_path, book_title=filename, prompt_setting="zero-shot") # modify the prompt setting here
+    prefixProbe(csv_file_name=data_path, book_title=filename, backend=backend, prompt_setting="zero-shot") # modify the prompt setting here
+    print(backend_stats(backend, MODEL))
@@ -1,45 +1,82 @@
-    import os
+import os
+import sys
+import math
 import pandas as pd
 import re
-from vllm import LLM, SamplingParams
 from argparse import ArgumentParser
-from bs4 import BeautifulSoup
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.backends import VLLMBackend, closing_tag_params
+from common.extraction import extract_all_tag_texts
+from common.tokenization import backend_token_counter
 
 
 def extract_output(text):
-    soup = BeautifulSoup(text, 'html.parser')
-    passages = soup.find_all('continuation')
+    passages = extract_all_tag_texts(text, 'continuation')
 
     if passages:
-        return max([passage.get_text() for passage in passages])
+        return max(passages, key=len)
     else:
         return text
 
 
-def predict(passages, word_counts, llm, lang, prompt_setting="zero-shot"):
-
-    SYSTEM_PROMPT = "You are a helpful assistant. You follow every single instruction carefully."
-    
-    demonstrations = {
-        "es": {
-            "first_half": "Hemos de agregar que quemaba tan hondamente el pecho de Hester, que quizá había",
-            "second_half": "mayor verdad en el rumor que lo que nuestra moderna incredulidad nos permite aceptar."
-        },
-        "tr": {
-            "first_half": "Ve Hester'ın göğsünü o kadar derinden yaktı ki, belki de",
-            "second_half": "modern şüphemizin kabul etmeye meyilli olmadığı söylentide daha fazla gerçeklik vardı."
-        },
-        "vi": {
-            "first_half": "Và chúng ta tất phải thuật lại rằng nó đã nung đốt thành dấu hằn vào ngực Hester sâu đến nỗi có lẽ trong lời",
-            "second_half": "đồn kia có nhiều phần sự thực hơn là đầu óc đa nghi của chúng ta trong thời hiện đại có thể sẵn sàng thừa nhận."
-        },
-        "en": {
-            "first_half": "And we must needs say, it seared Hester's bosom so deeply, that perhaps there",
-            "second_half": "was more truth in the rumor than our modern incredulity may be inclined to admit."
-        }
+SYSTEM_PROMPT = "You are a helpful assistant. You follow every single instruction carefully."
+
+DEMONSTRATIONS = {
+    "es": {
+        "first_half": "Hemos de agregar que quemaba tan hondamente el pecho de Hester, que quizá había",
+        "second_half": "mayor verdad en el rumor que lo que nuestra moderna incredulidad nos permite aceptar."
+    },
+    "tr": {
+        "first_half": "Ve Hester'ın göğsünü o kadar derinden yaktı ki, belki de",
+        "second_half": "modern şüphemizin kabul etmeye meyilli olmadığı söylentide daha fazla gerçeklik vardı."
+    },
+    "vi": {
+        "first_half": "Và chúng ta tất phải thuật lại rằng nó đã nung đốt thành dấu hằn vào ngực Hester sâu đến nỗi có lẽ trong lời",
+        "second_half": "đồn kia có nhiều phần sự thực hơn là đầu óc đa nghi của chúng ta trong thời hiện đại có thể sẵn sàng thừa nhận."
+    },
+    "en": {
+        "first_half": "And we must needs say, it seared Hester's bosom so deeply, that perhaps there",
+        "second_half": "was more truth in the rumor than our modern incredulity may be inclined to admit."
     }
-    
-    demo = demonstrations.get(lang)
+}
+
+PROMPT = """
+       You are provided with an incomplete passage from a book. Your task is to continue the passage *in the SAME LANGUAGE* with {word_count}. Your response should ONLY be the continuation, directly quoted from the book. Do not repeat or rephrase the input.
+        {demo_passage}
+        Here is the passage:
+        <passage>{passage}</passage>
+
+        Use the following format as output:
+       <continuation>Passage continuation</continuation>
+    """
+
+# Same instructions as PROMPT, but the passage dependent {word_count} is moved after the
+# demonstration so the system prompt, instructions and demonstration form a byte-identical
+# prefix across a language that vLLM's automatic prefix caching can reuse.
+PREFIX_CACHE_PROMPT = """
+       You are provided with an incomplete passage from a book. Your task is to continue the passage *in the SAME LANGUAGE*. Your response should ONLY be the continuation, directly quoted from the book. Do not repeat or rephrase the input.
+        {demo_passage}
+        Here is the passage, continue it with {word_count}:
+        <passage>{passage}</passage>
+
+        Use the following format as output:
+       <continuation>Passage continuation</continuation>
+    """
+
+MAX_TOKENS = 1000
+
+# Budget for a continuation: the model's token count of the reference second half times a margin,
+# plus room for the <continuation> tags. Words cost very different numbers of tokens across the
+# probed languages, so the budget is never derived from the word count.
+CONTINUATION_TOKEN_MARGIN = 1.5
+TAG_OVERHEAD_TOKENS = 32
+
+SAMPLING_PARAMS = closing_tag_params("</continuation>", max_tokens=MAX_TOKENS)
+
+
+def build_messages(lang, passages, word_counts, prompt_setting="zero-shot", template=PROMPT):
+    demo = DEMONSTRATIONS.get(lang)
     
     demo_passage = ""
     if prompt_setting != "zero-shot":
@@ -50,45 +87,57 @@ def predict(passages, word_counts, llm, lang, prompt_setting="zero-shot"):
         <continuation>{demo['second_half']}</continuation>
         
         """
-        
-    prompt = """
-       You are provided with an incomplete passage from a book. Your task is to continue the passage *in the SAME LANGUAGE* with {word_count}. Your response should ONLY be the continuation, directly quoted from the book. Do not repeat or rephrase the input.
-        {demo_passage}
-        Here is the passage:
-        <passage>{passage}</passage>
 
-        Use the following format as output:
-       <continuation>Passage continuation</continuation>
-    """
-
-    tokenizer = llm.get_tokenizer()
-    sampling_params = SamplingParams(temperature=0.0, top_p=1.0, max_tokens=1000)
-
-    prompts = tokenizer.apply_chat_template(
+    return [
         [
-            [
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": prompt.format(
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": template.format(
                 word_count=word_count,
                 demo_passage=demo_passage,
                 passage=passage
             ).strip()},
-            ] for passage, word_count in zip(passages, word_counts)
-        ],
-        tokenize=False,
-        add_generation_prompt=True,
-    )
-    
-    outputs = llm.generate(prompts, sampling_params, use_tqdm=False)
+        ] for passage, word_count in zip(passages, word_counts)
+    ]
 
-    batch_results = []
-    for output in outputs:
-        extract = extract_output(output.outputs[0].text)
-        extract = extract.replace('\n', ' ')
 
-        batch_results.append(extract)
+def parse_output(text):
+    return extract_output(text).replace('\n', ' ')
 
-    return batch_results
+
+_sampling_params_by_budget = {}
+
+
+def sampling_params_for(max_tokens=MAX_TOKENS):
+    """
+    Returns SAMPLING_PARAMS with the given max_tokens, one shared object per budget.
+    """
+    if max_tokens not in _sampling_params_by_budget:
+        params = SAMPLING_PARAMS.clone()
+        params.max_tokens = max_tokens
+        _sampling_params_by_budget[max_tokens] = params
+    return _sampling_params_by_budget[max_tokens]
+
+
+def continuation_budget(reference_tokens):
+    return min(MAX_TOKENS, TAG_OVERHEAD_TOKENS + math.ceil(CONTINUATION_TOKEN_MARGIN * reference_tokens))
+
+
+def set_token_budgets(jobs, count_tokens):
+    """
+    Sizes max_tokens of every prompt to its reference second half. `count_tokens` maps a list of
+    texts to their token counts with the tokenizer of the model that will be run.
+    """
+    for job in jobs:
+        second_halves = [text if isinstance(text, str) else "" for text in job["second_halves"]]
+        job["max_tokens"] = [continuation_budget(tokens) for tokens in count_tokens(second_halves)]
+
+
+def predict(passages, word_counts, backend, lang, prompt_setting="zero-shot", max_tokens=None):
+    messages = build_messages(lang, passages, word_counts, prompt_setting)
+    sampling_params = [sampling_params_for(budget) for budget in (max_tokens or [MAX_TOKENS] * len(passages))]
+    completions = backend.generate(messages, sampling_params)
+
+    return [parse_output(completion.text) for completion in completions]
 
 
 def split_sentence_in_half(sentence):
@@ -139,28 +188,67 @@ def remove_extra_suffix(text, limit):
             return text[:next_space]
 
 
-def prefixProbe(csv_file_name, book_title, llm, model_name, prompt_setting="zero-shot"):
+def load_jobs(csv_file_name):
+    """
+    Reads a book, splits every passage in half and returns (df_out, jobs) with one job per language.
+    Each job holds the first halves to continue and where its results go in df_out.
+    """
+    df = pd.read_json(csv_file_name)
+    df_out = pd.DataFrame()
+    jobs = []
+
+    languages = ["en", "vi", "es", "tr"]
+    for lang in languages:
+        try:
+            df_out[[f"{lang}_first_half", f"{lang}_second_half", f"{lang}_word_count"]] = df[lang].apply(
+                lambda x: pd.Series(split_sentence_in_half(x)) if pd.notnull(x) else pd.Series([x, x, 0])
+            )
+            jobs.append({
+                "column": lang,
+                "lang": lang,
+                "passages": df_out[f"{lang}_first_half"].tolist(),
+                "word_counts": df_out[f"{lang}_word_count"].tolist(),
+                "second_halves": df_out[f"{lang}_second_half"].tolist(),
+                "insert_after": f"{lang}_word_count",
+                "result_column": f"{lang}_results_raw",
+            })
+        except Exception as e:
+            print(e)
+    return df_out, jobs
+
+
+def job_messages(job, prompt_setting):
+    return build_messages(job["lang"], job["passages"], job["word_counts"], prompt_setting, job.get("template", PROMPT))
+
+
+def job_sampling_params(job):
+    """
+    Per prompt sampling params, with the budgets of set_token_budgets or MAX_TOKENS when the jobs
+    were loaded without a tokenizer.
+    """
+    return [sampling_params_for(budget) for budget in job.get("max_tokens") or [MAX_TOKENS] * len(job["passages"])]
+
+
+def prefixProbe(csv_file_name, book_title, backend, model_name, prompt_setting="zero-shot", output_dir="."):
     try:
-        df = pd.read_json(csv_file_name)
-        df_out = pd.DataFrame()
-        
-        languages = ["en", "vi", "es", "tr"]
-        for lang in languages:
+        df_out, jobs = load_jobs(csv_file_name)
+        count_tokens = backend_token_counter(backend)
+        if count_tokens is not None:
+            set_token_budgets(jobs, count_tokens)
+
+        for job in jobs:
             try:
-                print(f'///running {lang}///')
-                df_out[[f"{lang}_first_half", f"{lang}_second_half", f"{lang}_word_count"]] = df[lang].apply(
-                    lambda x: pd.Series(split_sentence_in_half(x)) if pd.notnull(x) else pd.Series([x, x, 0])
-                )
-                passages = df_out[f"{lang}_first_half"].tolist()
-                word_counts = df_out[f"{lang}_word_count"].tolist()
-                output = predict(passages, word_counts, llm, lang, prompt_setting)
-
-                index_of_lang = df_out.columns.get_loc(f"{lang}_word_count")
-                df_out.insert(index_of_lang + 1, f"{lang}_results_raw", pd.Series(output))
+                print(f'///running {job["lang"]}///')
+                output = predict(job["passages"], job["word_counts"], backend, job["lang"], prompt_setting,
+                                 job.get("max_tokens"))
+
+                index_of_lang = df_out.columns.get_loc(job["insert_after"])
+                df_out.insert(index_of_lang + 1, job["result_column"], pd.Series(output))
             except Exception as e:
                 print(e)
 
-        df_out.to_csv(f"{book_title}_prefix_probe_{model_name}.csv", index=False, encoding='utf-8')
+        os.makedirs(output_dir, exist_ok=True)
+        df_out.to_csv(os.path.join(output_dir, f"{book_title}_prefix_probe_{model_name}.csv"), index=False, encoding='utf-8')
 
     except Exception as e:
         print(e)
@@ -181,8 +269,8 @@ if __name__ == "__main__":
     parser.add_argument("gpus", type=str, help="Nums of gpus to use")
     args = parser.parse_args()
 
-    llm = LLM(model=args.model, tensor_parallel_size=int(args.gpus), max_model_len=2048)
+    backend = VLLMBackend.from_model(args.model, tensor_parallel_size=int(args.gpus), max_model_len=2048)
     data_path = ""
     filename =  os.path.basename(data_path).replace(".json","")
-    prefixProbe(csv_file_name=data_path, book_title=filename, llm=llm, model_name=args.model.split('/')[1], prompt_setting="zero-shot") # modify the prompt setting here
+    prefixProbe(csv_file_name=data_path, book_title=filename, backend=backend, model_name=args.model.split('/')[1], prompt_setting="zero-shot") # modify the prompt setting here
     
\ No newline at end of file
@@ -0,0 +1,276 @@
+import os
+import sys
+import glob
+import time
+from argparse import ArgumentParser
+from collections import namedtuple
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+for task_dir in ["direct_probing", "prefix_probing", "name_cloze_task"]:
+    sys.path.append(os.path.join(SCRIPTS_DIR, task_dir))
+
+import direct_probe
+import prefix_probe
+import name_cloze_task
+from common.backends import BACKENDS, make_backend
+from common.dedup import DedupBackend
+from common.response_cache import CachedBackend, ResponseCache
+from common.batching import mega_batch_generate, scatter_results
+from common.journal import ResultJournal
+from common.result_sink import ParquetResultSink, read_book_results
+from common.streaming import stream_task
+from common.tokenization import backend_token_counter
+
+# A task plugin wraps one of the task modules, which expose load_jobs, job_messages,
+# job_sampling_params and parse_output on top of their predict() functions.
+TaskPlugin = namedtuple("TaskPlugin", ["name", "module"])
+
+TASKS = {
+    "direct_probe": TaskPlugin("direct_probe", direct_probe),
+    "prefix_probe": TaskPlugin("prefix_probe", prefix_probe),
+    "name_cloze": TaskPlugin("name_cloze", name_cloze_task),
+}
+
+PROMPT_SETTINGS = ["zero-shot", "one-shot"]
+
+BATCHING_MODES = ["column", "mega"]
+
+
+def book_title_from_path(data_path):
+    """
+    Returns the book title used in output file names, i.e. the file name without its extension.
+    """
+    return os.path.splitext(os.path.basename(data_path))[0]
+
+
+def output_path(output_dir, task, prompt_setting, book_title, model_name):
+    return os.path.join(output_dir, task.name, prompt_setting, f"{book_title}_{task.name}_{model_name}.csv")
+
+
+def open_journal(journal_dir, task, model_name, backend):
+    """
+    Opens the journal of a task and model. Every backend gets its own, so the answers of a stub
+    backend (echo, replay) smoke run are never resumed into a real run in the same output_dir.
+    """
+    if not journal_dir:
+        return None
+    return ResultJournal(os.path.join(journal_dir, f"{task.name}_{model_name}_{backend.name}.jsonl"))
+
+
+def load_book(task, data_path, templates=None, count_tokens=None):
+    """
+    Returns the (df, jobs) pair of one book. `templates` maps task names to a prompt template their
+    jobs are built with instead of the task module's default. `count_tokens` (see
+    common.tokenization.backend_token_counter) lets tasks with set_token_budgets size max_tokens
+    to each row's reference answer.
+    """
+    df, jobs = task.module.load_jobs(data_path)
+    if templates and task.name in templates:
+        for job in jobs:
+            job["template"] = templates[task.name]
+    if count_tokens is not None and hasattr(task.module, "set_token_budgets"):
+        task.module.set_token_budgets(jobs, count_tokens)
+    return df, jobs
+
+
+def load_books(task, data_paths, templates=None, count_tokens=None):
+    books = {}
+    for data_path in data_paths:
+        try:
+            books[book_title_from_path(data_path)] = load_book(task, data_path, templates, count_tokens)
+        except Exception as e:
+            print(f'Error loading {data_path}: {e}')
+    return books
+
+
+def save_book(df, output_dir, task, prompt_setting, book_title, model_name):
+    path = output_path(output_dir, task, prompt_setting, book_title, model_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df.to_csv(path, index=False, encoding='utf-8')
+
+
+def run_mega_batched(backend, model_name, task_data, prompt_settings, output_dir, max_batch_prompts=None, journal_dir=None,
+                     templates=None, count_tokens=None):
+    """
+    For every (task, prompt setting), gathers the prompts of all columns of all books into one
+    generate call and writes each book's results to the same layout as run_probes.
+    """
+    for task_name, data_paths in task_data.items():
+        task = TASKS[task_name]
+        journal = open_journal(journal_dir, task, model_name, backend)
+        for prompt_setting in prompt_settings:
+            print(f'----------------- {task.name} | {len(data_paths)} books | {prompt_setting} -----------------')
+            start = time.time()
+            books = load_books(task, data_paths, templates, count_tokens)
+
+            try:
+                mega_batch_generate(backend, task.module, books, prompt_setting, max_batch_prompts, journal, model_name)
+            except Exception as e:
+                print(f'Error running {task.name} ({prompt_setting}): {e}')
+                continue
+
+            for book_title, (df, _) in books.items():
+                save_book(df, output_dir, task, prompt_setting, book_title, model_name)
+            print(f'Finished {task.name} ({prompt_setting}) in {time.time() - start:.1f}s')
+        if journal is not None:
+            journal.close()
+
+
+def run_probes(backend, model_name, task_data, prompt_settings, output_dir, journal_dir=None, templates=None, count_tokens=None):
+    """
+    Streams every (task, book, language column, prompt setting) job through a single, already
+    loaded backend, one generate call per column.
+    Results are written to <output_dir>/<task>/<prompt_setting>/<book>_<task>_<model>.csv.
+    """
+    for task_name, data_paths in task_data.items():
+        task = TASKS[task_name]
+        journal = open_journal(journal_dir, task, model_name, backend)
+        for prompt_setting in prompt_settings:
+            for data_path in data_paths:
+                book_title = book_title_from_path(data_path)
+                print(f'----------------- {task.name} | {book_title} | {prompt_setting} -----------------')
+                start = time.time()
+                try:
+                    df, jobs = load_book(task, data_path, templates, count_tokens)
+                    for job in jobs:
+                        print(f'Running {job["column"]}')
+                        mega_batch_generate(backend, task.module, {book_title: (df, [job])}, prompt_setting,
+                                            journal=journal, model_name=model_name)
+                    save_book(df, output_dir, task, prompt_setting, book_title, model_name)
+                except Exception as e:
+                    print(f'Error: {e}')
+                print(f'Finished {task.name} on {book_title} ({prompt_setting}) in {time.time() - start:.1f}s')
+        if journal is not None:
+            journal.close()
+
+
+def run_streaming(backend, model_name, task_data, prompt_settings, output_dir, journal_dir=None, max_in_flight=1024, row_group_size=4096,
+                  templates=None, count_tokens=None):
+    """
+    Streams per-prompt results from the backend into one Parquet file per (task, prompt setting),
+    written in row groups, then rebuilds each book's CSV from it one book at a time.
+    """
+    for task_name, data_paths in task_data.items():
+        task = TASKS[task_name]
+        journal = open_journal(journal_dir, task, model_name, backend)
+        for prompt_setting in prompt_settings:
+            print(f'----------------- {task.name} | {len(data_paths)} books | {prompt_setting} (streaming) -----------------')
+            start = time.time()
+            sink_path = os.path.join(output_dir, task.name, prompt_setting, f"{task.name}_{model_name}.parquet")
+            try:
+                with ParquetResultSink(sink_path, row_group_size) as sink:
+                    stream_task(backend, task.module, load_books(task, data_paths, templates, count_tokens), prompt_setting, sink,
+                                model_name, journal, max_in_flight)
+            except Exception as e:
+                print(f'Error running {task.name} ({prompt_setting}): {e}')
+                continue
+
+            for data_path in data_paths:
+                book_title = book_title_from_path(data_path)
+                try:
+                    df, jobs = load_book(task, data_path, templates)
+                    results = read_book_results(sink_path, book_title)
+                    tags = [(book_title, column, row) for column, row in results]
+                    scatter_results({book_title: (df, jobs)}, tags, list(results.values()))
+                    save_book(df, output_dir, task, prompt_setting, book_title, model_name)
+                except Exception as e:
+                    print(f'Error writing {book_title}: {e}')
+            print(f'Finished {task.name} ({prompt_setting}) in {time.time() - start:.1f}s')
+        if journal is not None:
+            journal.close()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("model", type=str, help="Name of the model to use")
+    parser.add_argument("gpus", type=str, help="Nums of gpus to use")
+    for task_name in TASKS:
+        parser.add_argument(f"--{task_name}_data", type=str, default=None,
+                            help=f"Glob of data files to run {task_name} on, the task is skipped if not set")
+    parser.add_argument("--prompt_settings", nargs="+", default=PROMPT_SETTINGS, choices=PROMPT_SETTINGS)
+    parser.add_argument("--output_dir", type=str, default="out")
+    parser.add_argument("--max_model_len", type=int, default=2048)
+    parser.add_argument("--backend", type=str, default="vllm", choices=BACKENDS,
+                        help="echo: deterministic CPU-only backend for testing the pipeline without a GPU, "
+                             "replay: replays --replay_path and records misses with echo")
+    parser.add_argument("--replay_path", type=str, default=None,
+                        help="Recorded completions for the replay backend, defaults to <output_dir>/replay.jsonl")
+    parser.add_argument("--batching", type=str, default="mega", choices=BATCHING_MODES,
+                        help="column: one generate call per language column, mega: one call across all columns and books")
+    parser.add_argument("--max_batch_prompts", type=int, default=2048,
+                        help="Upper bound on prompts per generate call in mega batching, results are journaled after every call")
+    parser.add_argument("--journal_dir", type=str, default=None,
+                        help="Directory of per-row result journals used to resume crashed runs, defaults to <output_dir>/journal")
+    parser.add_argument("--no_journal", action="store_true", help="Do not journal results")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream per-prompt results into Parquet row groups instead of holding whole columns in memory")
+    parser.add_argument("--max_in_flight", type=int, default=1024, help="Requests queued in the engine at once when streaming")
+    parser.add_argument("--row_group_size", type=int, default=4096, help="Results per Parquet row group when streaming")
+    parser.add_argument("--no_prefix_caching", dest="enable_prefix_caching", action="store_false",
+                        help="Disable vLLM automatic prefix caching")
+    parser.add_argument("--prompt_cache", type=str, default=None,
+                        help="SQLite cache of chat-templated prompt token ids shared by models with the same tokenizer, "
+                             "defaults to <output_dir>/prompt_cache.sqlite")
+    parser.add_argument("--no_prompt_cache", action="store_true", help="Template and tokenize every prompt from scratch")
+    parser.add_argument("--response_cache", type=str, default=None,
+                        help="Completions cached by (model, prompt, sampling params), shared across runs and models, "
+                             "defaults to <output_dir>/response_cache.sqlite")
+    parser.add_argument("--no_response_cache", action="store_true", help="Generate every prompt even if it was answered before")
+    parser.add_argument("--no_dedup", action="store_true", help="Generate identical prompts once per row instead of once per batch")
+    parser.add_argument("--response_cache_max_gb", type=float, default=2.0,
+                        help="Least recently used responses are evicted above this size")
+    parser.add_argument("--prefix_cache_layout", action="store_true",
+                        help="Use the prefix probe prompt with {word_count} after the demonstration, so one-shot prompts share a cacheable prefix")
+    args = parser.parse_args()
+
+    task_data = {}
+    for task_name in TASKS:
+        pattern = getattr(args, f"{task_name}_data")
+        if pattern:
+            task_data[task_name] = sorted(glob.glob(pattern, recursive=True))
+            print(f"{task_name}: {len(task_data[task_name])} data files")
+
+    if not task_data:
+        parser.error("no task selected, pass at least one --<task>_data glob")
+
+    templates = {"prefix_probe": prefix_probe.PREFIX_CACHE_PROMPT} if args.prefix_cache_layout else None
+
+    backend = base_backend = make_backend(
+        args.backend,
+        args.model,
+        replay_path=args.replay_path or os.path.join(args.output_dir, "replay.jsonl"),
+        prompt_cache_path=None if args.no_prompt_cache else (args.prompt_cache or os.path.join(args.output_dir, "prompt_cache.sqlite")),
+        tensor_parallel_size=int(args.gpus),
+        max_model_len=args.max_model_len,
+        enable_prefix_caching=args.enable_prefix_caching,
+    )
+    dedup_backend = None
+    if not args.no_dedup:
+        backend = dedup_backend = DedupBackend(backend)
+    response_cache = None
+    if not args.no_response_cache and not base_backend.cacheable:
+        print(f"The {args.backend} backend does not answer as {args.model}, its responses are not cached")
+    elif not args.no_response_cache:
+        response_cache = ResponseCache(args.response_cache or os.path.join(args.output_dir, "response_cache.sqlite"),
+                                       max_bytes=int(args.response_cache_max_gb * 1024 ** 3))
+        backend = CachedBackend(backend, response_cache, args.model)
+    model_name = args.model.split('/')[-1]
+    count_tokens = backend_token_counter(base_backend)
+    journal_dir = None if args.no_journal else (args.journal_dir or os.path.join(args.output_dir, "journal"))
+    if args.stream:
+        run_streaming(backend, model_name, task_data, args.prompt_settings, args.output_dir, journal_dir,
+                      args.max_in_flight, args.row_group_size, templates, count_tokens)
+    elif args.batching == "mega":
+        run_mega_batched(backend, model_name, task_data, args.prompt_settings, args.output_dir, args.max_batch_prompts, journal_dir,
+                         templates, count_tokens)
+    else:
+        run_probes(backend, model_name, task_data, args.prompt_settings, args.output_dir, journal_dir, templates, count_tokens)
+
+    prompt_cache = getattr(base_backend, "prompt_cache", None)
+    if prompt_cache is not None:
+        print(prompt_cache.stats())
+    if dedup_backend is not None:
+        print(dedup_backend.stats.report(args.model, batch=args.backend == "openai-batch"))
+    if response_cache is not None:
+        print(response_cache.stats())
+        response_cache.close()
@@ -0,0 +1,134 @@
+import os
+import sys
+import glob
+import time
+import subprocess
+from argparse import ArgumentParser
+from collections import namedtuple
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+RUN_PROBES = os.path.join(SCRIPTS_DIR, "run_probes.py")
+
+ModelSpec = namedtuple("ModelSpec", ["model", "tensor_parallel_size"])
+
+
+def parse_model_spec(text):
+    """
+    Parses "<model>[:<tensor_parallel_size>]", e.g. "meta-llama/Llama-3.1-70B-Instruct:4".
+    """
+    model, _, tensor_parallel_size = text.rpartition(":")
+    if model and tensor_parallel_size.isdigit():
+        return ModelSpec(model, int(tensor_parallel_size))
+    return ModelSpec(text, 1)
+
+
+def model_name(spec):
+    return spec.model.split('/')[-1]
+
+
+def launch_run_probes(spec, gpus, run_args, output_dir, log_dir):
+    """
+    Starts run_probes.py for one model on the given GPUs and returns the process.
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    env = dict(os.environ, CUDA_VISIBLE_DEVICES=",".join(str(gpu) for gpu in gpus))
+    command = [sys.executable, RUN_PROBES, spec.model, str(spec.tensor_parallel_size), "--output_dir", output_dir] + run_args
+    # the worker writes to its own copy of the log file descriptor, ours is closed once it started
+    with open(os.path.join(log_dir, f"{model_name(spec)}.log"), "a", encoding="utf-8") as log_file:
+        return subprocess.Popen(command, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+
+
+def schedule(specs, gpu_ids, launch, poll_interval=5.0):
+    """
+    Runs one worker per model, packing workers onto gpu_ids so that as many run concurrently as fit.
+
+    Models are placed first-fit decreasing by tensor-parallel size: whenever GPUs are free, the
+    largest pending model that fits is launched, and smaller ones fill what is left.
+    `launch(spec, gpus)` starts a worker and returns an object with poll() like subprocess.Popen.
+    Models may not share a name (the part after the last "/"), as their workers would write the
+    same result files and journals.
+    Returns {model: (returncode, gpus, seconds)}.
+    """
+    by_name = {}
+    for spec in specs:
+        by_name.setdefault(model_name(spec), []).append(spec.model)
+    duplicates = [" and ".join(models) for name, models in sorted(by_name.items()) if len(models) > 1]
+    if duplicates:
+        raise ValueError(f"models share an output name: {'; '.join(duplicates)}")
+
+    pending = sorted(specs, key=lambda spec: spec.tensor_parallel_size, reverse=True)
+    for spec in [spec for spec in pending if spec.tensor_parallel_size > len(gpu_ids)]:
+        print(f"Skipping {spec.model}: needs {spec.tensor_parallel_size} GPUs, only {len(gpu_ids)} available")
+        pending.remove(spec)
+
+    free = list(gpu_ids)
+    running = {}
+    finished = {}
+    while pending or running:
+        for spec in list(pending):
+            if spec.tensor_parallel_size <= len(free):
+                gpus, free = free[:spec.tensor_parallel_size], free[spec.tensor_parallel_size:]
+                print(f"Launching {spec.model} on GPUs {gpus}")
+                running[spec.model] = (launch(spec, gpus), gpus, time.time())
+                pending.remove(spec)
+
+        time.sleep(poll_interval if running else 0)
+        for model, (worker, gpus, start) in list(running.items()):
+            returncode = worker.poll()
+            if returncode is not None:
+                seconds = time.time() - start
+                print(f"{model} finished with code {returncode} in {seconds:.0f}s, freeing GPUs {gpus}")
+                finished[model] = (returncode, gpus, seconds)
+                # keep the GPUs in the order they were given, ids are not always numbers (GPU UUIDs)
+                free = sorted(free + gpus, key=gpu_ids.index)
+                del running[model]
+    return finished
+
+
+def collect_results(output_dir, specs):
+    """
+    Returns {model: [result csv paths]} from the <task>/<prompt_setting>/<book>_<task>_<model>.csv layout.
+    """
+    return {
+        spec.model: sorted(glob.glob(os.path.join(output_dir, "*", "*", f"*_{model_name(spec)}.csv")))
+        for spec in specs
+    }
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Runs run_probes.py for several models, packing them onto the node's GPUs. "
+                                        "Unrecognised arguments are passed on to run_probes.py.")
+    parser.add_argument("--models", nargs="+", required=True, help="Models as <name>[:<tensor_parallel_size>]")
+    parser.add_argument("--gpus", type=str, default=os.environ.get("CUDA_VISIBLE_DEVICES"),
+                        help="Comma separated GPU ids to pack models onto, defaults to CUDA_VISIBLE_DEVICES")
+    parser.add_argument("--output_dir", type=str, default="out")
+    parser.add_argument("--log_dir", type=str, default=None, help="Per-model worker logs, defaults to <output_dir>/logs")
+    parser.add_argument("--poll_interval", type=float, default=5.0)
+    args, run_args = parser.parse_known_args()
+
+    if not args.gpus:
+        parser.error("no GPUs given, pass --gpus or set CUDA_VISIBLE_DEVICES")
+
+    specs = [parse_model_spec(text) for text in args.models]
+    gpu_ids = [gpu.strip() for gpu in args.gpus.split(",") if gpu.strip()]
+    log_dir = args.log_dir or os.path.join(args.output_dir, "logs")
+
+    try:
+        finished = schedule(
+            specs,
+            gpu_ids,
+            lambda spec, gpus: launch_run_probes(spec, gpus, run_args, args.output_dir, log_dir),
+            args.poll_interval,
+        )
+    except ValueError as e:
+        parser.error(str(e))
+
+    results = collect_results(args.output_dir, specs)
+    print("\n----------------- sweep summary -----------------")
+    all_ok = True
+    for spec in specs:
+        returncode, gpus, seconds = finished.get(spec.model, (None, [], 0))
+        status = "skipped" if returncode is None else ("ok" if returncode == 0 else f"failed ({returncode})")
+        all_ok = all_ok and returncode == 0
+        print(f"{spec.model}: {status}, GPUs {gpus}, {seconds:.0f}s, {len(results[spec.model])} result files")
+    sys.exit(0 if all_ok else 1)
@@ -0,0 +1,53 @@
+import os
+import sys
+import asyncio
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.async_openai import AsyncOpenAIChatBackend
+from common.backends import Completion, SamplingParams
+
+PARAMS = SamplingParams(max_tokens=10)
+
+
+class FakeAsyncBackend(AsyncOpenAIChatBackend):
+    """
+    Answers every conversation with its last message's content instead of calling the API, and
+    fails the ones whose content is "fail".
+    """
+
+    async def _run(self, conversations, params):
+        await asyncio.sleep(0)
+        return [ValueError("failed") if conversation[-1]["content"] == "fail"
+                else Completion(f"answer to {conversation[-1]['content']}", 1, 1, None)
+                for conversation in conversations]
+
+
+def conversations(*contents):
+    return [[{"role": "user", "content": content}] for content in contents]
+
+
+def test_async_callers_await_the_backend():
+    backend = FakeAsyncBackend("gpt-4o")
+
+    async def caller():
+        return await backend.generate_async(conversations("a", "b"), PARAMS)
+
+    assert [completion.text for completion in asyncio.run(caller())] == ["answer to a", "answer to b"]
+
+
+def test_synchronous_generate_works_inside_a_running_loop():
+    backend = FakeAsyncBackend("gpt-4o")
+
+    async def caller():
+        return backend.generate_settled(conversations("a", "fail"), PARAMS)
+
+    completion, error = asyncio.run(caller())
+    assert completion.text == "answer to a"
+    assert isinstance(error, ValueError)
+
+
+def test_generate_raises_failed_requests():
+    with pytest.raises(ValueError):
+        FakeAsyncBackend("gpt-4o").generate(conversations("a", "fail"), PARAMS)
@@ -0,0 +1,141 @@
+import os
+import sys
+import json
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.batch_api import BatchShard, complete_synchronously, track_batches
+from common.rate_limit import RateLimiter
+
+
+class FakeStatusError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+class FakeClient:
+    """
+    Answers chat completions with the last message's content, after raising the errors queued in
+    `errors` one per request. Batches listed in `batches` complete at the first poll with the
+    given {custom_id: content} output.
+    """
+
+    def __init__(self, batches=None, errors=None):
+        self.batches_output = batches or {}
+        self.errors = list(errors or [])
+        self.sent = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(with_raw_response=SimpleNamespace(create=self.create)))
+        self.batches = SimpleNamespace(retrieve=self.retrieve)
+        self.files = SimpleNamespace(with_streaming_response=SimpleNamespace(content=self.content))
+
+    def with_options(self, **options):
+        return self
+
+    def create(self, **body):
+        self.sent.append(body)
+        if self.errors:
+            raise self.errors.pop(0)
+        message = SimpleNamespace(content=f"answer to {body['messages'][-1]['content']}")
+        completion = SimpleNamespace(choices=[SimpleNamespace(message=message)])
+        return SimpleNamespace(headers={}, parse=lambda: completion)
+
+    def retrieve(self, batch_id):
+        if batch_id not in self.batches_output:
+            raise KeyError(batch_id)
+        return SimpleNamespace(id=batch_id, status="completed", output_file_id=batch_id, error_file_id=None)
+
+    def content(self, file_id):
+        lines = [json.dumps({"custom_id": custom_id, "response": {"body": {"choices": [{"message": {"content": content}}]}}})
+                 for custom_id, content in self.batches_output[file_id].items()]
+        data = "\n".join(lines).encode("utf-8")
+        return FakeStream(data)
+
+
+class FakeStream:
+    def __init__(self, data):
+        self.data = data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_bytes(self, chunk_size):
+        for start in range(0, len(self.data), chunk_size):
+            yield self.data[start:start + chunk_size]
+
+
+def write_requests(path, prompts):
+    with open(path, "w", encoding="utf-8") as f:
+        for custom_id, prompt in prompts.items():
+            body = {"model": "gpt-4o", "messages": [{"role": "user", "content": prompt}], "max_tokens": 10}
+            f.write(json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body}) + "\n")
+
+
+@pytest.fixture
+def limiter():
+    return RateLimiter(None, None)
+
+
+def test_alias_of_unknown_batch_is_retried_and_merged(tmp_path, monkeypatch, limiter):
+    monkeypatch.setattr("common.batch_api.get_limiter", lambda name: limiter)
+    requests_path = str(tmp_path / "book.jsonl")
+    write_requests(requests_path, {"request_0": "a", "request_1": "b"})
+    client = FakeClient()
+    merged = []
+
+    track_batches(client, [], lambda book_name, csv_file, results: merged.append((book_name, csv_file, results)),
+                  aliases={"book.csv": {"request_1": ("batch_gone", "request_7")}},
+                  books={"book.csv": ("book", requests_path)},
+                  poll_interval=0)
+
+    assert merged == [("book", "book.csv", {"request_0": "answer to a", "request_1": "answer to b"})]
+    assert len(client.sent) == 2
+
+
+def test_alias_of_unknown_batch_does_not_block_book_with_shards(tmp_path, monkeypatch, limiter):
+    monkeypatch.setattr("common.batch_api.get_limiter", lambda name: limiter)
+    requests_path = str(tmp_path / "book.jsonl")
+    write_requests(requests_path, {"request_0": "a", "request_1": "b"})
+    shard = BatchShard("book", "book.csv", requests_path, "file_1", "batch_1", requests_path)
+    client = FakeClient({"batch_1": {"request_0": "batched a"}})
+    merged = []
+
+    track_batches(client, [shard], lambda book_name, csv_file, results: merged.append((book_name, csv_file, results)),
+                  aliases={"book.csv": {"request_1": ("batch_gone", "request_7")}},
+                  poll_interval=0)
+
+    assert merged == [("book", "book.csv", {"request_0": "batched a", "request_1": "answer to b"})]
+
+
+def request(custom_id, prompt):
+    return {"custom_id": custom_id, "body": {"model": "gpt-4o", "messages": [{"role": "user", "content": prompt}], "max_tokens": 10}}
+
+
+def test_rate_limited_request_is_retried_after_retry_after(monkeypatch, limiter):
+    sleeps = []
+    monkeypatch.setattr("common.backends.time.sleep", sleeps.append)
+    client = FakeClient(errors=[FakeStatusError(429, {"retry-after-ms": "250"})])
+
+    results = complete_synchronously(client, [request("request_0", "a")], limiter)
+
+    assert results == {"request_0": "answer to a"}
+    # the retry waits out Retry-After, and the limiter holds back its other callers as long
+    assert sleeps[0] == 0.25
+    assert limiter.rate_limited == 1
+
+
+def test_invalid_request_is_skipped_and_other_errors_are_raised(limiter):
+    client = FakeClient(errors=[FakeStatusError(400)])
+    assert complete_synchronously(client, [request("request_0", "a"), request("request_1", "b")], limiter) == {"request_1": "answer to b"}
+
+    client = FakeClient(errors=[FakeStatusError(401)])
+    with pytest.raises(FakeStatusError):
+        complete_synchronously(client, [request("request_0", "a")], limiter)
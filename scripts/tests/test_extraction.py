@@ -0,0 +1,77 @@
+import os
+import sys
+
+import pytest
+
+bs4 = pytest.importorskip("bs4")
+pytest.importorskip("pandas")
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(SCRIPTS_DIR)
+sys.path.append(os.path.join(SCRIPTS_DIR, "prefix_probing"))
+from common.extraction import extract_all_tag_texts, extract_tag
+from prefix_probe import extract_output as extract_continuation
+
+# Completions in the shapes the probing models produced, including the ones that fall back to bs4
+OUTPUTS = [
+    '<output>"title": "The Picture of Dorian Gray","author": "Oscar Wilde"</output>',
+    'Based on the passage, I believe this is from:\n<output>"title": "Dracula","author": "Bram Stoker"</output>',
+    '<output>Elizabeth Bennet</output>\n\nThe passage mentions Darcy, so the masked name is likely Elizabeth.',
+    '<name>Alice</name>',
+    '<name>Raskólnikov</name> </name>',
+    '<output>"title": "1984","author": "George Orwell"</output> <b>Note</b>: shuffled text.',
+    '<output>"title": "Moby Dick", <b>"author"</b>: "Herman Melville"</output>',
+    '<output><output>"title": "Emma","author": "Jane Austen"</output></output>',
+    '<output>Hester <name>Prynne</name></output>',
+    '<output>Tom &amp; Huck</output>',
+    '<output>Tom & Huck</output>',
+    '<output>Jekyll &lt;and&gt; Hyde &nbsp;&#233;</output>',
+    '<output class="answer">Ahab</output>',
+    '<output>   </output>',
+    '<output>\n</output>',
+    '<output>"title": "Frankenstein","author": "Mary Shelley"',
+    '<continuation>was more truth in the rumor than our modern incredulity may be inclined to admit.</continuation>',
+    '<continuation>Y entonces</continuation> <continuation>el viejo se fue y no volvió a la aldea</continuation>',
+    '<continuation>zzz</continuation>\n<continuation>and the scarlet letter burned upon her breast</continuation>',
+    '<continuation>Y entonces</continuation> <continuation>el viejo se fue & no volvió</continuation>',
+    'Here is the continuation:\n<continuation>and the door closed behind him',
+    '<continuation>modern şüphemizin <i>kabul</i> etmeye</continuation>',
+    '"title": "Frankenstein","author": "Mary Shelley"',
+    'and the door closed behind him',
+    '',
+]
+
+
+def bs4_find(text, tag):
+    element = bs4.BeautifulSoup(text, 'html.parser').find(tag)
+    return element.decode_contents() if element else None
+
+
+def bs4_find_all_texts(text, tag):
+    return [element.get_text() for element in bs4.BeautifulSoup(text, 'html.parser').find_all(tag)]
+
+
+@pytest.mark.parametrize("text", OUTPUTS)
+@pytest.mark.parametrize("tag", ["output", "name"])
+def test_extract_tag_matches_bs4(text, tag):
+    assert extract_tag(text, tag) == bs4_find(text, tag)
+
+
+@pytest.mark.parametrize("text", OUTPUTS)
+def test_extract_all_tag_texts_matches_bs4(text):
+    assert extract_all_tag_texts(text, "continuation") == bs4_find_all_texts(text, "continuation")
+
+
+def test_longest_continuation_wins():
+    text = '<continuation>zzz</continuation>\n<continuation>and the scarlet letter burned upon her breast</continuation>'
+    assert extract_continuation(text) == "and the scarlet letter burned upon her breast"
+
+
+def test_unclosed_continuation_runs_to_the_end():
+    text = 'Here is the continuation:\n<continuation>and the door closed behind him'
+    assert extract_continuation(text) == "and the door closed behind him"
+
+
+def test_completion_without_continuation_is_kept_as_raw_text():
+    text = 'and the door closed behind him'
+    assert extract_continuation(text) == text
@@ -0,0 +1,67 @@
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("pandas")
+pytest.importorskip("unidecode")
+pytest.importorskip("fuzzywuzzy")
+pytest.importorskip("rapidfuzz")
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(SCRIPTS_DIR, "Evaluation", "nct"))
+import nct_eval
+from fuzzywuzzy import fuzz
+from nct_eval import batch_match_scores, calculate_match_scores, ensure_list, granular_ents, preprocess_result
+
+# (Single_ent as stored in the result CSVs, raw completion)
+ROWS = [
+    ("['Elizabeth Bennet']", "<output>Elizabeth</output>"),
+    ("['Elizabeth Bennet']", "<output>Elizabeth Bennet</output>"),
+    ("['']", "<output></output>"),
+    ("['Hester Prynne']", "<output></output>"),
+    ("['']", "<output>Hester</output>"),
+    ("['Hester Prynne']", float("nan")),
+    ("[]", "<output>Alice</output>"),
+    ("['Raskólnikov']", "<output>Raskolnikov</output>"),
+    ("['Dorian Gray']", "<output>DORIÁN gray</output>"),
+    ("['Tom Sawyer', 'Huckleberry Finn', 'Becky Thatcher']", "<output>Huck</output>"),
+    ("['Tom Sawyer', 'Huckleberry Finn', 'Becky Thatcher']", "<output>Becky</output>"),
+    ("['Jean Valjean', 'Javert']", "Based on the passage, the name is <output>Javert</output>"),
+    ("['Jean Valjean', 'Javert']", "I am not sure who this is."),
+]
+
+
+@pytest.fixture(params=[False, True], ids=["difflib", "cdist"])
+def levenshtein_ratio(request, monkeypatch):
+    monkeypatch.setattr(nct_eval, "LEVENSHTEIN_RATIO", request.param)
+    return request.param
+
+
+def assert_batch_matches_row_wise():
+    ents_lists = [granular_ents(ensure_list(ents)) for ents, _ in ROWS]
+    preds = [preprocess_result(pred) for _, pred in ROWS]
+
+    exact_match, highest_fuzzy_score = batch_match_scores(ents_lists, preds)
+
+    expected = [calculate_match_scores(ents, pred) for ents, pred in zip(ents_lists, preds)]
+    assert exact_match.tolist() == [exact for exact, _ in expected]
+    assert highest_fuzzy_score.tolist() == [fuzzy for _, fuzzy in expected]
+
+
+def test_batch_match_scores_matches_row_wise_scores():
+    assert_batch_matches_row_wise()
+
+
+def test_cdist_scores_match_row_wise_scores(monkeypatch):
+    # fuzz.ratio only agrees with rapidfuzz's Levenshtein ratio when python-Levenshtein backs it
+    pytest.importorskip("Levenshtein")
+    monkeypatch.setattr(nct_eval, "LEVENSHTEIN_RATIO", True)
+    assert_batch_matches_row_wise()
+
+
+@pytest.mark.parametrize("ent, pred", [("", ""), ("hester", ""), ("", "hester"), ("hester", "hester")])
+def test_empty_strings_score_like_fuzz_ratio(levenshtein_ratio, ent, pred):
+    _, highest_fuzzy_score = batch_match_scores([[ent]], [pred])
+    assert highest_fuzzy_score.tolist() == [fuzz.ratio(ent, pred) / 100]
@@ -0,0 +1,92 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.backends import Backend, Completion, SamplingParams
+from common.response_cache import CachedBackend, ResponseCache, response_key
+
+PARAMS = SamplingParams(max_tokens=10)
+
+
+class CountingBackend(Backend):
+    """
+    Answers with the last message's content and counts the items it was asked to stream.
+    """
+
+    name = "counting"
+
+    def __init__(self):
+        self.streamed = 0
+
+    def generate(self, conversations, params):
+        self.streamed += len(conversations)
+        return [Completion(f"answer to {conversation[-1]['content']}", 1, 1, None) for conversation in conversations]
+
+
+def conversation(i):
+    return [{"role": "user", "content": str(i)}]
+
+
+def test_size_follows_inserts_replaces_and_evictions(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_bytes=10 ** 9)
+    cache.put_many([("a", Completion("x" * 100, 1, 1, None)), ("b", Completion("y" * 100, 1, 1, None))])
+    cache.put_many([("a", Completion("x" * 10, 1, 1, None))])
+    expected = cache.conn.execute("SELECT SUM(size) FROM responses").fetchone()[0]
+    assert cache.size() == expected
+
+    cache.max_bytes = expected - 1
+    cache.evict()
+    assert cache.size() == cache.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    assert cache.evictions == 1
+    size = cache.size()
+    cache.close()
+
+    assert ResponseCache(str(tmp_path / "cache.sqlite")).size() == size
+
+
+def test_size_of_cache_created_before_the_total_is_summed_once(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = ResponseCache(path)
+    cache.put_many([("a", Completion("x" * 100, 1, 1, None))])
+    size = cache.size()
+    cache.conn.execute("DROP TABLE cache_size")
+    cache.conn.commit()
+    cache.close()
+
+    assert ResponseCache(path).size() == size
+
+
+def test_fully_cached_stream_yields_hits_without_buffering_them_all(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    cache.put_many([(response_key("m", conversation(i), PARAMS), Completion(f"cached {i}", 1, 1, None)) for i in range(1000)])
+    backend = CountingBackend()
+    pulled = 0
+
+    def items():
+        nonlocal pulled
+        for i in range(1000):
+            pulled += 1
+            yield conversation(i), PARAMS, i
+
+    stream = CachedBackend(backend, cache, "m").stream(items(), max_in_flight=16, lookup_every=8)
+    tag, completion = next(stream)
+    assert (tag, completion.text) == (0, "cached 0")
+    assert pulled <= 16 + 8
+
+    assert [tag for tag, _ in stream] == list(range(1, 1000))
+    assert backend.streamed == 0
+
+
+def test_stream_mixes_hits_and_misses(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    cache.put_many([(response_key("m", conversation(i), PARAMS), Completion(f"cached {i}", 1, 1, None)) for i in range(0, 100, 2)])
+    backend = CountingBackend()
+
+    results = dict(CachedBackend(backend, cache, "m").stream(((conversation(i), PARAMS, i) for i in range(100)),
+                                                             max_in_flight=4, lookup_every=8))
+
+    assert sorted(results) == list(range(100))
+    assert results[2].text == "cached 2"
+    assert results[3].text == "answer to 3"
+    assert backend.streamed == 50
+    assert len(cache.get_many([response_key("m", conversation(i), PARAMS) for i in range(100)])) == 100
@@ -0,0 +1,95 @@
+import os
+import sys
+import json
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sweep_scheduler import ModelSpec, collect_results, launch_run_probes, parse_model_spec, schedule
+
+
+class FakeWorker:
+    """
+    Stands in for a run_probes process: finishes with `returncode` after `polls` polls.
+    """
+
+    def __init__(self, polls=1, returncode=0):
+        self.polls = polls
+        self.returncode = returncode
+
+    def poll(self):
+        self.polls -= 1
+        return self.returncode if self.polls < 0 else None
+
+
+class FakeLauncher:
+    def __init__(self, polls=None):
+        self.polls = polls or {}
+        self.launched = []
+
+    def __call__(self, spec, gpus):
+        self.launched.append((spec.model, gpus))
+        return FakeWorker(self.polls.get(spec.model, 1))
+
+
+def test_models_are_packed_largest_first():
+    launch = FakeLauncher()
+    specs = [parse_model_spec(text) for text in ["org/small-a", "org/mid:2", "org/large:4", "org/small-b"]]
+
+    finished = schedule(specs, ["0", "1", "2", "3"], launch, poll_interval=0)
+
+    assert launch.launched == [
+        ("org/large", ["0", "1", "2", "3"]),
+        ("org/mid", ["0", "1"]),
+        ("org/small-a", ["2"]),
+        ("org/small-b", ["3"]),
+    ]
+    assert {model: returncode for model, (returncode, _, _) in finished.items()} == {spec.model: 0 for spec in specs}
+
+
+def test_freed_gpus_go_to_the_next_model_that_fits():
+    launch = FakeLauncher(polls={"org/slow": 5})
+    specs = [ModelSpec("org/slow", 1), ModelSpec("org/mid", 2), ModelSpec("org/fast", 1), ModelSpec("org/last", 1)]
+
+    schedule(specs, ["gpu-a", "gpu-b", "gpu-c"], launch, poll_interval=0)
+
+    # mid and slow fill the node, fast and last share the GPUs mid frees while slow still runs
+    assert launch.launched == [
+        ("org/mid", ["gpu-a", "gpu-b"]),
+        ("org/slow", ["gpu-c"]),
+        ("org/fast", ["gpu-a"]),
+        ("org/last", ["gpu-b"]),
+    ]
+
+
+def test_models_larger_than_the_node_are_skipped():
+    launch = FakeLauncher()
+
+    finished = schedule([ModelSpec("org/huge", 8), ModelSpec("org/small", 1)], ["0", "1"], launch, poll_interval=0)
+
+    assert launch.launched == [("org/small", ["0"])]
+    assert list(finished) == ["org/small"]
+
+
+def test_models_sharing_an_output_name_are_refused():
+    launch = FakeLauncher()
+
+    with pytest.raises(ValueError, match="org-a/foo and org-b/foo"):
+        schedule([ModelSpec("org-a/foo", 1), ModelSpec("org-b/foo", 1)], ["0"], launch, poll_interval=0)
+    assert launch.launched == []
+
+
+def test_echo_worker_writes_the_results_collect_results_finds(tmp_path):
+    pytest.importorskip("pandas")
+    data_path = tmp_path / "book.json"
+    data_path.write_text(json.dumps({"en": ["And we must needs say it seared her bosom so deeply", "one two three four"]}))
+    output_dir = str(tmp_path / "out")
+    spec = ModelSpec("org/echo-model", 1)
+
+    worker = launch_run_probes(spec, ["0"], ["--backend", "echo", "--prefix_probe_data", str(data_path),
+                                             "--prompt_settings", "zero-shot"], output_dir, str(tmp_path / "logs"))
+
+    assert worker.wait(timeout=120) == 0
+    assert collect_results(output_dir, [spec]) == {
+        "org/echo-model": [os.path.join(output_dir, "prefix_probe", "zero-shot", "book_prefix_probe_echo-model.csv")],
+    }